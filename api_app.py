@@ -1,7 +1,191 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+import asyncio
+import json
+import os
+import threading
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from gmail_utils import get_credentials, get_gmail_service
+from gmail_async import AsyncGmailClient
+from micro_batcher import MicroBatcher, QueueFull
+from summary_cache import SummaryCache
+import summarizer
 
-app = FastAPI()
+# one pooled async Gmail client shared by all requests, created on first use
+_gmail = {}
+
+# /summarize micro-batching (override with environment variables)
+SUMMARIZE_MAX_BATCH = int(os.environ.get('MAILSCRIBE_MAX_BATCH', 16))
+SUMMARIZE_MAX_WAIT_MS = float(os.environ.get('MAILSCRIBE_MAX_WAIT_MS', 10))
+SUMMARIZE_MAX_QUEUE = int(os.environ.get('MAILSCRIBE_MAX_QUEUE', 256))
+SUMMARIZE_TIMEOUT_S = float(os.environ.get('MAILSCRIBE_TIMEOUT_S', 30))
+# one batcher per distinct summarizer settings; models stay loaded in summarizers' registry
+_batchers = {}
+_summary_cache = {}
+
+class SummarizeRequest(BaseModel):
+    text: str
+    mode: Literal['extractive', 'transformer'] = 'extractive'
+    max_sentences: int = 3
+    max_length: int = 130
+    min_length: int = 30
+    timeout_s: Optional[float] = None
+
+class SummarizeBatchRequest(BaseModel):
+    texts: List[str]
+    mode: Literal['extractive', 'transformer'] = 'extractive'
+    max_sentences: int = 3
+    max_length: int = 130
+    min_length: int = 30
+    timeout_s: Optional[float] = None
+
+def _summary_args(req):
+    """summarizer.py defaults with the request's settings applied."""
+    args = summarizer.build_parser().parse_args([])
+    args.mode = req.mode
+    args.max_sentences = req.max_sentences
+    args.max_length = req.max_length
+    args.min_length = req.min_length
+    args.batch_size = SUMMARIZE_MAX_BATCH
+    args.backend = os.environ.get('MAILSCRIBE_BACKEND', args.backend)
+    return args
+
+def get_summary_cache():
+    if 'cache' not in _summary_cache:
+        _summary_cache['cache'] = SummaryCache()
+    return _summary_cache['cache']
+
+def get_batcher(req):
+    key = (req.mode, req.max_sentences) if req.mode == 'extractive' else (req.mode, req.max_length, req.min_length)
+    batcher = _batchers.get(key)
+    if batcher is None:
+        args = _summary_args(req)
+        cache = get_summary_cache()
+        batcher = MicroBatcher(lambda texts: summarizer.summarize_texts(texts, args, cache=cache),
+                               max_batch_size=SUMMARIZE_MAX_BATCH, max_wait_ms=SUMMARIZE_MAX_WAIT_MS,
+                               max_queue=SUMMARIZE_MAX_QUEUE)
+        _batchers[key] = batcher
+    return batcher
+
+async def _summarize(req, texts):
+    if len(texts) > SUMMARIZE_MAX_QUEUE:
+        raise HTTPException(413, f"at most {SUMMARIZE_MAX_QUEUE} texts per request")
+    try:
+        return await get_batcher(req).submit(texts, timeout=req.timeout_s or SUMMARIZE_TIMEOUT_S)
+    except QueueFull as e:
+        raise HTTPException(429, str(e), headers={'Retry-After': '1'})
+    except asyncio.TimeoutError:
+        raise HTTPException(504, "summarization timed out")
+
+async def get_gmail_client():
+    if 'client' not in _gmail:
+        creds = await asyncio.to_thread(get_credentials)
+        _gmail['client'] = AsyncGmailClient(creds)
+    return _gmail['client']
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    for batcher in _batchers.values():
+        await batcher.stop()
+    _batchers.clear()
+    client = _gmail.pop('client', None)
+    if client is not None:
+        await client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 def root():
     return {"message": "MailScribe API is running!"}
+
+@app.get("/messages")
+async def list_messages(query: str = 'is:unread', limit: int = Query(10, ge=1, le=500)):
+    """List matching messages (id, thread, From/Subject/Date headers, snippet) via the async client."""
+    client = await get_gmail_client()
+    ids = await client.list_message_ids(query=query, limit=limit)
+    msgs = await client.get_messages(ids, format='metadata', metadata_headers=['From', 'Subject', 'Date'])
+    out = []
+    for m in msgs:
+        if m is None:
+            continue
+        hd = {h['name'].lower(): h['value'] for h in m.get('payload', {}).get('headers', [])}
+        out.append({'id': m['id'], 'threadId': m.get('threadId'), 'from': hd.get('from'),
+                    'subject': hd.get('subject'), 'date': hd.get('date'), 'snippet': m.get('snippet')})
+    return out
+
+@app.post("/summarize")
+async def summarize(req: SummarizeRequest):
+    """Summarize one text; concurrent requests are batched together (429 when the queue is full)."""
+    summaries = await _summarize(req, [req.text])
+    return {'summary': summaries[0], 'mode': req.mode}
+
+@app.post("/summarize/batch")
+async def summarize_batch(req: SummarizeBatchRequest):
+    """Summarize several texts; returns one summary per text, in order."""
+    return {'summaries': await _summarize(req, req.texts), 'mode': req.mode}
+
+@app.get("/summarize/stats")
+def summarize_stats():
+    return {'%s:%s' % (key[0], ','.join(map(str, key[1:]))): b.stats() for key, b in _batchers.items()}
+
+_DONE = object()
+
+async def _iter_in_thread(gen):
+    """
+    Drive a blocking generator from worker threads, one item at a time.
+    When the consumer stops (e.g. the client disconnected) the generator is
+    closed as soon as the step in progress returns, which stops the pipeline.
+    """
+    lock = threading.Lock()
+
+    def step():
+        with lock:
+            return next(gen, _DONE)
+
+    def close():
+        with lock:
+            gen.close()
+
+    try:
+        while True:
+            item = await asyncio.to_thread(step)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        # not awaited: a cancelled consumer must not wait for the message being summarized
+        asyncio.get_running_loop().run_in_executor(None, close)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/digest")
+async def digest(request: Request, query: str = 'is:unread', limit: int = Query(50, ge=1, le=1000),
+                 mode: Literal['extractive', 'tfidf', 'textrank', 'transformer'] = 'extractive',
+                 max_sentences: int = 3, format: Literal['sse', 'ndjson'] = 'sse'):
+    """
+    Stream a summary per matching message as soon as it is ready, as server-sent
+    events ("summary" events, then "done") or NDJSON lines. Disconnecting stops the run.
+    """
+    args = summarizer.build_parser().parse_args([])
+    args.query, args.max_results, args.mode, args.max_sentences = query, limit, mode, max_sentences
+    # a service per stream: httplib2 connections must not be shared between threads
+    service = await asyncio.to_thread(get_gmail_service)
+    entries = summarizer.iter_digest(service, args, cache=get_summary_cache())
+
+    async def events():
+        count = 0
+        async for entry in _iter_in_thread(entries):
+            if await request.is_disconnected():
+                return
+            count += 1
+            yield _sse('summary', entry) if format == 'sse' else json.dumps(entry) + "\n"
+        done = {'done': True, 'count': count}
+        yield _sse('done', done) if format == 'sse' else json.dumps(done) + "\n"
+
+    media_type = 'text/event-stream' if format == 'sse' else 'application/x-ndjson'
+    return StreamingResponse(events(), media_type=media_type, headers={'Cache-Control': 'no-cache'})
+
@@ -2,34 +2,87 @@
 import base64
 from email.mime.text import MIMEText
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from gmail_utils import iter_message_ids, get_messages, execute, execute_batched, DEFAULT_BATCH_SIZE, QUOTA_UNITS, _new_http
+
+# replies sent at the same time by a ReplySender
+DEFAULT_SEND_CONCURRENCY = 4
+# messages.batchModify accepts up to 1000 ids per call
+BATCH_MODIFY_MAX_IDS = 1000
+
+# headers is_automated_message looks at; all the metadata-only triage pass downloads
+TRIAGE_HEADERS = ['From', 'Subject', 'List-Id', 'Auto-Submitted', 'Precedence']
 
 def _headers_to_dict(headers):
     return {h['name'].lower(): h['value'] for h in headers}
 
 def ensure_label(service, label_name="AutoReplied"):
     """Return labelId for label_name; create if missing."""
-    labels_resp = service.users().labels().list(userId='me').execute()
+    labels_resp = execute(service, service.users().labels().list(userId='me'), 'labels.list')
     labels = labels_resp.get('labels', [])
     for lab in labels:
         if lab.get('name') == label_name:
             return lab['id']
     # create
     body = {"name": label_name, "labelListVisibility": "labelShow", "messageListVisibility": "show"}
-    lab = service.users().labels().create(userId='me', body=body).execute()
+    lab = execute(service, service.users().labels().create(userId='me', body=body), 'labels.create')
     return lab['id']
 
-def is_thread_replied(service, thread_id):
-    """
-    Return True if any message in the thread has the 'SENT' label (i.e., user replied or sent a message in thread).
-    """
-    thread = service.users().threads().get(userId='me', id=thread_id, format='metadata', metadataHeaders=[]).execute()
+def _thread_has_sent(thread):
     for m in thread.get('messages', []):
         labels = m.get('labelIds', [])
         if 'SENT' in labels:
             return True
     return False
 
+def is_thread_replied(service, thread_id, cache=None, history_id=None):
+    """
+    Return True if any message in the thread has the 'SENT' label (i.e., user replied or sent a message in thread).
+    cache: optional ThreadStateCache consulted before calling threads().get.
+    history_id: historyId of a message of the thread, if known (older cache entries are ignored).
+    """
+    if cache is not None:
+        replied = cache.get(thread_id, history_id=history_id)
+        if replied is not None:
+            return replied
+    thread = execute(service, service.users().threads().get(userId='me', id=thread_id, format='metadata', metadataHeaders=[]),
+                     'threads.get')
+    replied = _thread_has_sent(thread)
+    if cache is not None:
+        cache.put(thread_id, replied, history_id=thread.get('historyId'))
+    return replied
+
+def are_threads_replied(service, thread_ids, cache=None, history_ids=None):
+    """
+    Batched is_thread_replied: returns {thread_id: bool}. Each distinct thread is
+    looked up once; cache misses are resolved with threads().get calls grouped
+    into batch requests. Threads that could not be fetched are left out.
+    history_ids: optional {thread_id: newest historyId seen among its messages}.
+    """
+    history_ids = history_ids or {}
+    result = {}
+    missing = []
+    for tid in dict.fromkeys(thread_ids):
+        replied = cache.get(tid, history_id=history_ids.get(tid)) if cache is not None else None
+        if replied is None:
+            missing.append(tid)
+        else:
+            result[tid] = replied
+
+    def make_request(tid):
+        return service.users().threads().get(userId='me', id=tid, format='minimal')
+
+    for tid, thread in zip(missing, execute_batched(service, missing, make_request, method='threads.get')):
+        if thread is None:
+            continue
+        result[tid] = _thread_has_sent(thread)
+        if cache is not None:
+            cache.put(tid, result[tid], history_id=thread.get('historyId'))
+    return result
+
 def is_automated_message(payload):
     """
     Heuristics to detect automated emails (mailing lists, auto-generated, no-reply).
@@ -58,6 +111,85 @@ def get_message_datetime_ms(msg):
     except Exception:
         return 0
 
+def triage_skip_reason(msg, label_id=None, skip_automated=True, min_age_seconds=None, now_ms=None):
+    """
+    Cheap skip rules that only need metadata (labelIds, headers, internalDate).
+    Returns a skip result dict, or None if the message survives.
+    """
+    mid = msg.get('id')
+    # skip if already labeled (avoid duplicate processing)
+    if label_id and label_id in msg.get('labelIds', []):
+        return {'id': mid, 'skipped': 'already_labeled'}
+    # skip auto messages
+    if skip_automated and is_automated_message(msg.get('payload', {})):
+        return {'id': mid, 'skipped': 'automated'}
+    # skip fresh messages within min_age_seconds
+    if min_age_seconds is not None:
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        age = (now_ms - get_message_datetime_ms(msg)) / 1000.0
+        if age < min_age_seconds:
+            return {'id': mid, 'skipped': 'too_new', 'age_seconds': age}
+    return None
+
+def iter_triaged_messages(service, ids, label_id=None, skip_automated=True, min_age_seconds=None,
+                          check_thread=False, batch_size=DEFAULT_BATCH_SIZE, mirror=None, thread_cache=None):
+    """
+    Two-phase fetch over an iterable of message ids.
+    - Phase one downloads format='metadata' (TRIAGE_HEADERS, labelIds, internalDate)
+      and applies triage_skip_reason, plus (if check_thread) one batched
+      are_threads_replied lookup for the remaining threads.
+    - Phase two downloads full bodies for the survivors only.
+    Yields (id, full_message, skip_result) in id order; exactly one of
+    full_message / skip_result is None.
+    """
+    ids = iter(ids)
+    now_ms = int(time.time() * 1000)
+    # a mirror already holds full messages locally, so there is nothing to save by asking for metadata
+    fmt = 'full' if mirror is not None else 'metadata'
+    while True:
+        chunk = list(islice(ids, batch_size))
+        if not chunk:
+            return
+        skipped = {}
+        metas = get_messages(service, chunk, format=fmt, batch_size=batch_size, mirror=mirror,
+                             metadata_headers=TRIAGE_HEADERS)
+        for mid, meta in zip(chunk, metas):
+            if meta is None:
+                skipped[mid] = {'id': mid, 'skipped': 'fetch_failed'}
+                continue
+            reason = triage_skip_reason(meta, label_id=label_id, skip_automated=skip_automated,
+                                        min_age_seconds=min_age_seconds, now_ms=now_ms)
+            if reason is not None:
+                skipped[mid] = reason
+        # only reply if thread has no sent messages by user
+        if check_thread:
+            thread_of = {mid: meta.get('threadId') for mid, meta in zip(chunk, metas)
+                         if mid not in skipped}
+            # a message newer than a cached thread entry means the thread changed since
+            history_ids = {}
+            for mid, meta in zip(chunk, metas):
+                if mid in thread_of and meta.get('historyId'):
+                    tid = thread_of[mid]
+                    history_ids[tid] = max(history_ids.get(tid, 0), int(meta['historyId']))
+            replied = are_threads_replied(service, thread_of.values(), cache=thread_cache, history_ids=history_ids)
+            for mid, tid in thread_of.items():
+                if tid not in replied:
+                    skipped[mid] = {'id': mid, 'skipped': 'thread_check_failed'}
+                elif replied[tid]:
+                    skipped[mid] = {'id': mid, 'skipped': 'thread_has_reply'}
+        survivors = [mid for mid in chunk if mid not in skipped]
+        full = {}
+        if survivors:
+            full = dict(zip(survivors, get_messages(service, survivors, batch_size=batch_size, mirror=mirror)))
+        for mid in chunk:
+            if mid in skipped:
+                yield mid, None, skipped[mid]
+            elif full.get(mid) is None:
+                yield mid, None, {'id': mid, 'skipped': 'fetch_failed'}
+            else:
+                yield mid, full[mid], None
+
 def make_reply_message(to_addr, subject, body_text, in_reply_to=None, references=None, from_email=None):
     msg = MIMEText(body_text, 'plain')
     # Subject should be prefixed with "Re:" if not present
@@ -74,13 +206,8 @@ def make_reply_message(to_addr, subject, body_text, in_reply_to=None, references
     raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
     return raw
 
-def send_reply_and_label(service, orig_msg, thread_id, reply_text, label_id=None, from_email=None):
-    """
-    orig_msg: Gmail message resource (dict)
-    thread_id: thread id string
-    reply_text: text body
-    label_id: if provided, will be added to the original message after sending
-    """
+def make_reply_to(orig_msg, reply_text, from_email=None):
+    """Return the raw (base64url) reply to orig_msg, addressed and threaded from its headers."""
     payload = orig_msg.get('payload', {})
     headers = payload.get('headers', [])
     hd = _headers_to_dict(headers)
@@ -89,76 +216,275 @@ def send_reply_and_label(service, orig_msg, thread_id, reply_text, label_id=None
     subject = hd.get('subject', '')
     message_id = hd.get('message-id', None)
     references = hd.get('references', None)
-    raw = make_reply_message(to_addr, subject, reply_text, in_reply_to=message_id, references=references, from_email=from_email)
+    return make_reply_message(to_addr, subject, reply_text, in_reply_to=message_id, references=references, from_email=from_email)
+
+def send_reply_and_label(service, orig_msg, thread_id, reply_text, label_id=None, from_email=None):
+    """
+    orig_msg: Gmail message resource (dict)
+    thread_id: thread id string
+    reply_text: text body
+    label_id: if provided, will be added to the original message after sending
+    """
+    raw = make_reply_to(orig_msg, reply_text, from_email=from_email)
 
     send_body = {'raw': raw, 'threadId': thread_id}
-    sent = service.users().messages().send(userId='me', body=send_body).execute()
+    sent = execute(service, service.users().messages().send(userId='me', body=send_body), 'messages.send')
 
-    # add label to original message to avoid repeated replies
+    # add label to original message to avoid repeated replies (transient errors are retried by execute)
     if label_id:
         try:
-            service.users().messages().modify(userId='me', id=orig_msg['id'], body={'addLabelIds': [label_id]}).execute()
-        except Exception:
-            pass
+            execute(service, service.users().messages().modify(userId='me', id=orig_msg['id'], body={'addLabelIds': [label_id]}),
+                    'messages.modify')
+        except Exception as e:
+            print(f"Warning: reply sent but labelling {orig_msg['id']} failed: {e}")
 
     return sent
 
+def add_label(service, msg_ids, label_id):
+    """
+    Add label_id to every message in msg_ids with messages.batchModify (one call
+    per BATCH_MODIFY_MAX_IDS ids). Fewer ids than a batchModify costs in quota
+    units go out as per-message modify calls in one batch request instead.
+    When a batchModify fails its messages are retried that way too, so failures
+    are pinned on the messages they concern.
+    Returns {msg_id: error} for the messages that could not be labelled.
+    """
+    msg_ids = list(dict.fromkeys(msg_ids))
+    errors = {}
+    for start in range(0, len(msg_ids), BATCH_MODIFY_MAX_IDS):
+        chunk = msg_ids[start:start + BATCH_MODIFY_MAX_IDS]
+        if len(chunk) * QUOTA_UNITS['messages.modify'] >= QUOTA_UNITS['messages.batchModify']:
+            body = {'ids': chunk, 'addLabelIds': [label_id]}
+            try:
+                execute(service, service.users().messages().batchModify(userId='me', body=body), 'messages.batchModify')
+                continue
+            except Exception as e:
+                print(f"batchModify of {len(chunk)} messages failed ({e}), labelling them one by one")
+        results = execute_batched(
+            service, chunk,
+            lambda mid: service.users().messages().modify(userId='me', id=mid, body={'addLabelIds': [label_id]}),
+            method='messages.modify'
+        )
+        for mid, result in zip(chunk, results):
+            if result is None:
+                errors[mid] = 'messages.modify failed'
+    return errors
+
+class ReplySender:
+    """
+    Reply stage that pipelines sends instead of running send + modify per message.
+    - submit() queues a reply; up to concurrency sends run at once, each worker
+      thread on its own authorized Http (httplib2 is not thread-safe).
+    - flush() waits for the queued sends, then labels every message whose reply
+      went out with batched messages.batchModify calls (see add_label).
+    - Only one reply per thread is queued, like the thread check would ensure
+      if the sends were serial.
+    """
+
+    def __init__(self, service, label_id=None, concurrency=DEFAULT_SEND_CONCURRENCY, from_email=None,
+                 thread_cache=None):
+        self.service = service
+        self.label_id = label_id
+        self.from_email = from_email
+        self.thread_cache = thread_cache
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self._local = threading.local()
+        self._pending = []
+        self._threads = set()
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _http(self):
+        if not hasattr(self._local, 'http'):
+            self._local.http = _new_http(self.service)
+        return self._local.http
+
+    def _send(self, orig_msg, reply_text):
+        body = {'raw': make_reply_to(orig_msg, reply_text, from_email=self.from_email), 'threadId': orig_msg.get('threadId')}
+        return execute(self.service, self.service.users().messages().send(userId='me', body=body), 'messages.send',
+                       http=self._http())
+
+    def submit(self, orig_msg, reply_text):
+        """Queue a reply to orig_msg; its outcome is reported by the next flush()."""
+        thread_id = orig_msg.get('threadId')
+        if thread_id in self._threads:
+            self._pending.append((orig_msg, None))
+            return
+        self._threads.add(thread_id)
+        self._pending.append((orig_msg, self._executor.submit(self._send, orig_msg, reply_text)))
+
+    def flush(self):
+        """
+        Wait for queued replies and label the replied messages. Returns one result per submit, in order:
+        {'id', 'action': 'sent', 'sent_id'} (plus 'label_error' if labelling failed),
+        {'id', 'action': 'send_failed', 'error'} or {'id', 'skipped': 'thread_has_reply'}.
+        """
+        pending, self._pending = self._pending, []
+        results = []
+        for orig_msg, fut in pending:
+            mid = orig_msg['id']
+            if fut is None:
+                results.append({'id': mid, 'skipped': 'thread_has_reply'})
+                continue
+            try:
+                sent = fut.result()
+            except Exception as e:
+                # let a later run try this thread again
+                self._threads.discard(orig_msg.get('threadId'))
+                results.append({'id': mid, 'action': 'send_failed', 'error': str(e)})
+                continue
+            if self.thread_cache is not None:
+                self.thread_cache.put(orig_msg.get('threadId'), True)
+            results.append({'id': mid, 'action': 'sent', 'sent_id': sent.get('id')})
+        if self.label_id:
+            errors = add_label(self.service, [r['id'] for r in results if r.get('action') == 'sent'], self.label_id)
+            for r in results:
+                if r['id'] in errors:
+                    r['label_error'] = errors[r['id']]
+        return results
+
+    def close(self):
+        """Flush, stop the worker threads and return the last results."""
+        results = self.flush()
+        self._executor.shutdown()
+        return results
+
+def _template_fn(reply_template):
+    if callable(reply_template):
+        return reply_template
+    default_template = ("Hello,\n\nThank you for your message. I have received it and will get back to you shortly.\n\n"
+                        "Best regards,\n[Your Name]")
+    return (lambda msg: reply_template) if reply_template else (lambda msg: default_template)
+
 def process_unreplied(service, query='is:unread', reply_template=None, max_results=20,
-                       min_age_seconds=60*60*6, label_name='AutoReplied', dry_run=False, from_email=None):
+                       min_age_seconds=60*60*6, label_name='AutoReplied', dry_run=False, from_email=None,
+                       thread_cache=None, send_concurrency=DEFAULT_SEND_CONCURRENCY, outbox=None):
+    """
+    Run iter_unreplied to the end and return all results as a list (same arguments).
+    """
+    return list(iter_unreplied(service, query=query, reply_template=reply_template, max_results=max_results,
+                               min_age_seconds=min_age_seconds, label_name=label_name, dry_run=dry_run,
+                               from_email=from_email, thread_cache=thread_cache, send_concurrency=send_concurrency,
+                               outbox=outbox))
+
+def iter_unreplied(service, query='is:unread', reply_template=None, max_results=20,
+                   min_age_seconds=60*60*6, label_name='AutoReplied', dry_run=False, from_email=None,
+                   thread_cache=None, send_concurrency=DEFAULT_SEND_CONCURRENCY, outbox=None):
     """
+    Yield one result dict per candidate message as soon as it is handled
+    (skipped / would_send; sent / send_failed once its batch of sends completes).
+    Stopping the iteration stops the run.
     - query: Gmail search query to select candidate messages (default is unread).
     - reply_template: str or callable(msg)->str. If None, a default template is used.
     - min_age_seconds: only reply to messages older than this (to avoid immediate replies while user may reply)
     - label_name: name for label to mark processed messages.
     - dry_run: True -> only print actions, do not send.
     - from_email: optional From field for outgoing messages.
+    - thread_cache: optional ThreadStateCache so thread reply checks are reused across runs.
+    - send_concurrency: replies sent at the same time; labels are added per batch of sends (ReplySender).
+    - outbox: optional outbox.Outbox; replies then go through it (queued once per message, retried,
+      marked done with the label) and a restarted run never replies twice.
     """
-    if callable(reply_template):
-        template_fn = reply_template
-    else:
-        default_template = ("Hello,\n\nThank you for your message. I have received it and will get back to you shortly.\n\n"
-                            "Best regards,\n[Your Name]")
-        template_fn = (lambda msg: reply_template) if reply_template else (lambda msg: default_template)
+    template_fn = _template_fn(reply_template)
 
     # ensure label exists
     label_id = ensure_label(service, label_name)
+    if thread_cache is not None:
+        thread_cache.refresh(service)
 
-    # list messages
-    resp = service.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-    msg_ids = [m['id'] for m in resp.get('messages', [])]
-    results = []
-    now_ms = int(time.time() * 1000)
-    for mid in msg_ids:
-        msg = service.users().messages().get(userId='me', id=mid, format='full').execute()
-        thread_id = msg.get('threadId')
-        # skip if already labeled (avoid duplicate processing)
-        if label_id in msg.get('labelIds', []):
-            results.append({'id': mid, 'skipped': 'already_labeled'})
-            continue
-        # skip auto messages
-        if is_automated_message(msg.get('payload', {})):
-            results.append({'id': mid, 'skipped': 'automated'})
-            continue
-        # only reply if thread has no sent messages by user
-        if is_thread_replied(service, thread_id):
-            results.append({'id': mid, 'skipped': 'thread_has_reply'})
-            continue
-        # skip fresh messages within min_age_seconds
-        internal_date = get_message_datetime_ms(msg)
-        age = (now_ms - internal_date) / 1000.0
-        if age < min_age_seconds:
-            results.append({'id': mid, 'skipped': 'too_new', 'age_seconds': age})
-            continue
+    # stream message ids; the cheap skip rules run on metadata-only fetches and
+    # full bodies are downloaded (in batches) only for messages that survive them
+    msg_ids = iter_message_ids(service, query=query, limit=max_results)
+    if dry_run:
+        sender = None
+    elif outbox is not None:
+        from outbox import OutboxSender
+        sender = OutboxSender(outbox, service, label_id=label_id, concurrency=send_concurrency,
+                              from_email=from_email, thread_cache=thread_cache)
+    else:
+        sender = ReplySender(service, label_id=label_id, concurrency=send_concurrency,
+                             from_email=from_email, thread_cache=thread_cache)
+    try:
+        for mid, msg, skipped in iter_triaged_messages(service, msg_ids, label_id=label_id,
+                                                       min_age_seconds=min_age_seconds, check_thread=True,
+                                                       thread_cache=thread_cache):
+            if skipped is not None:
+                yield skipped
+                continue
 
-        # prepare reply text
-        reply_text = template_fn(msg)
+            # prepare reply text
+            reply_text = template_fn(msg)
 
-        if dry_run:
-            results.append({'id': mid, 'action': 'would_send', 'reply_text': reply_text})
-            continue
+            if dry_run:
+                yield {'id': mid, 'action': 'would_send', 'reply_text': reply_text}
+                continue
+
+            # sends overlap; labels go out in one batchModify per DEFAULT_BATCH_SIZE replies
+            sender.submit(msg, reply_text)
+            if sender.pending >= DEFAULT_BATCH_SIZE:
+                yield from sender.flush()
+        if sender is not None:
+            yield from sender.flush()
+    finally:
+        if sender is not None:
+            sender.close()
+
+async def ensure_label_async(client, label_name="AutoReplied"):
+    """ensure_label for an AsyncGmailClient."""
+    for lab in await client.list_labels():
+        if lab.get('name') == label_name:
+            return lab['id']
+    body = {"name": label_name, "labelListVisibility": "labelShow", "messageListVisibility": "show"}
+    lab = await client.create_label(body)
+    return lab['id']
+
+async def process_unreplied_async(client, query='is:unread', reply_template=None, max_results=20,
+                                  min_age_seconds=60*60*6, label_name='AutoReplied', dry_run=False, from_email=None):
+    """
+    asyncio version of process_unreplied driving a gmail_async.AsyncGmailClient.
+    Every candidate runs as its own task (metadata triage -> thread check -> full
+    fetch -> send -> label), so fetches, thread checks and sends overlap up to the
+    client's concurrency limit; candidates of the same thread are handled one
+    after another, so a thread gets one reply. Same arguments and results (in list order).
+    """
+    import asyncio
+    template_fn = _template_fn(reply_template)
+    label_id = await ensure_label_async(client, label_name)
+    now_ms = int(time.time() * 1000)
+    thread_locks = {}
+    replied = set()
 
-        # send reply
-        sent = send_reply_and_label(service, msg, thread_id, reply_text, label_id=label_id, from_email=from_email)
-        results.append({'id': mid, 'action': 'sent', 'sent_id': sent.get('id')})
+    async def handle(mid):
+        meta = await client.get_message(mid, format='metadata', metadata_headers=TRIAGE_HEADERS)
+        skipped = triage_skip_reason(meta, label_id=label_id, min_age_seconds=min_age_seconds, now_ms=now_ms)
+        if skipped is not None:
+            return skipped
+        thread_id = meta.get('threadId')
+        # messages of one thread take turns, so only the first of them replies
+        async with thread_locks.setdefault(thread_id, asyncio.Lock()):
+            if thread_id in replied or _thread_has_sent(await client.get_thread(thread_id)):
+                return {'id': mid, 'skipped': 'thread_has_reply'}
+            msg = await client.get_message(mid, format='full')
+            reply_text = template_fn(msg)
+            if dry_run:
+                return {'id': mid, 'action': 'would_send', 'reply_text': reply_text}
+            sent = await client.send_message(make_reply_to(msg, reply_text, from_email=from_email), thread_id=thread_id)
+            replied.add(thread_id)
+        result = {'id': mid, 'action': 'sent', 'sent_id': sent.get('id')}
+        try:
+            await client.modify_message(mid, add_label_ids=[label_id])
+        except Exception as e:
+            result['label_error'] = str(e)
+        return result
+
+    async def guarded(mid):
+        try:
+            return await handle(mid)
+        except Exception as e:
+            return {'id': mid, 'skipped': 'error', 'error': str(e)}
 
-    return results
+    tasks = [asyncio.ensure_future(guarded(mid))
+             async for mid in client.iter_message_ids(query=query, limit=max_results)]
+    return list(await asyncio.gather(*tasks))
@@ -0,0 +1,87 @@
+# benchmarks/bench_extractive.py
+"""
+Compare summarizers.extractive_summarize with the previous implementation:
+checks the output is identical and times both on the fixture corpus.
+
+    python benchmarks/bench_extractive.py [--fixtures DIR] [--long-factor N] [--repeat N]
+
+Long emails are simulated by concatenating each fixture's text N times.
+"""
+import argparse
+import re
+import time
+from collections import defaultdict
+from mime_fixtures import FIXTURES_DIR, load_messages
+from gmail_utils import extract_plain_text_from_message
+import summarizers
+
+
+def legacy_extractive_summarize(text, max_sentences=3):
+    """extractive_summarize as it was before the vectorized engine."""
+    if not text:
+        return ""
+    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', text) if s.strip()]
+    words = re.findall(r'\b[a-zA-Z]+\b', text.lower())
+    stopwords = set([
+        'the','is','and','to','that','a','of','for','in','on','if','as','all','any','your','you','this','are',
+        'we','our','will','be','by','with','from','at','it','has','have','an'
+    ])
+    freq = defaultdict(int)
+    for w in words:
+        if w not in stopwords:
+            freq[w] += 1
+    scores = []
+    for i, s in enumerate(sentences):
+        wds = re.findall(r'\b[a-zA-Z]+\b', s.lower())
+        score = sum(freq.get(w, 0) for w in wds)
+        scores.append((i, s, score))
+    top = sorted(scores, key=lambda x: x[2], reverse=True)[:max_sentences]
+    top_sorted = sorted(top, key=lambda x: x[0])
+    return " ".join(t[1] for t in top_sorted)
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser.add_argument('--long-factor', type=int, default=20, help='Repeat each text N times for the long-email run')
+    parser.add_argument('--max-sentences', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5, help='Timings are best of N runs')
+    args = parser.parse_args()
+
+    texts = [extract_plain_text_from_message(msg) for _, _, msg in load_messages(args.fixtures)]
+    if not texts:
+        print("No .eml fixtures found in", args.fixtures)
+        return
+    k = args.max_sentences
+    numpy_module = summarizers.np
+    for label, corpus in [('fixtures', texts), (f'long x{args.long_factor}', [' '.join([t] * args.long_factor) for t in texts])]:
+        chars = sum(len(t) for t in corpus)
+        old_t, old = best_of(lambda: [legacy_extractive_summarize(t, k) for t in corpus], args.repeat)
+        rows = [('legacy', old_t, True)]
+        engines = [('numpy', numpy_module), ('pure python', None)] if numpy_module is not None else [('pure python', None)]
+        for name, module in engines:
+            summarizers.np = module
+            try:
+                one_t, one = best_of(lambda: [summarizers.extractive_summarize(t, k) for t in corpus], args.repeat)
+                many_t, many = best_of(lambda: summarizers.extractive_summarize_many(corpus, k), args.repeat)
+            finally:
+                summarizers.np = numpy_module
+            rows.append((f'{name} (one by one)', one_t, one == old))
+            rows.append((f'{name} (_many)', many_t, many == old))
+        print(f"{label}: {len(corpus)} texts, {chars / 1024:.0f} KB of text")
+        for name, elapsed, same in rows:
+            print(f"  {name:28} {elapsed * 1000:9.2f}ms  {old_t / max(elapsed, 1e-9):5.1f}x  identical={same}")
+
+
+if __name__ == "__main__":
+    main()
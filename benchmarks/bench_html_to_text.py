@@ -0,0 +1,103 @@
+# benchmarks/bench_html_to_text.py
+"""
+Compare gmail_utils' streaming HTML extraction with the previous
+BeautifulSoup(html.parser) implementation on the MIME fixtures.
+
+    python benchmarks/bench_html_to_text.py [--fixtures DIR] [--repeat N]
+
+Drop real exported .eml files into a directory and pass it with --fixtures
+to measure on your own mail.
+"""
+import argparse
+import difflib
+import time
+from mime_fixtures import FIXTURES_DIR, load_messages
+from gmail_utils import extract_plain_text_from_message, _safe_base64_decode
+
+
+def legacy_html_to_text(html):
+    from bs4 import BeautifulSoup
+    if not html:
+        return ''
+    soup = BeautifulSoup(html, 'html.parser')
+    for s in soup(['script', 'style']):
+        s.decompose()
+    text = soup.get_text(separator='\n')
+    lines = [line.strip() for line in text.splitlines()]
+    return '\n'.join([ln for ln in lines if ln])
+
+
+def legacy_extract(msg):
+    """
+    extract_plain_text_from_message as it was before the streaming parser
+    (plus the single-part text/html conversion, so both sides parse the same HTML).
+    """
+    payload = msg.get('payload', {})
+    parts = payload.get('parts')
+    if not parts:
+        body = _safe_base64_decode(payload.get('body', {}).get('data', ''))
+        return legacy_html_to_text(body) if payload.get('mimeType') == 'text/html' else body
+    text_parts, html_parts = [], []
+
+    def walk(parts_list):
+        for p in parts_list:
+            mime = p.get('mimeType', '')
+            if mime == 'text/plain':
+                text_parts.append(p)
+            elif mime == 'text/html':
+                html_parts.append(p)
+            elif p.get('parts'):
+                walk(p.get('parts'))
+    walk(parts)
+    if text_parts:
+        return "\n\n".join(_safe_base64_decode(p.get('body', {}).get('data', '')) for p in text_parts)
+    if html_parts:
+        return legacy_html_to_text("\n\n".join(_safe_base64_decode(p.get('body', {}).get('data', ''))
+                                               for p in html_parts))
+    return legacy_html_to_text(_safe_base64_decode(payload.get('body', {}).get('data', '')))
+
+
+def best_of(fn, arg, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser.add_argument('--repeat', type=int, default=5, help='Timings are best of N runs')
+    args = parser.parse_args()
+
+    messages = load_messages(args.fixtures)
+    if not messages:
+        print("No .eml fixtures found in", args.fixtures)
+        return
+    engines = [
+        ('bs4 (old)', legacy_extract),
+        ('stream', lambda m: extract_plain_text_from_message(m, max_html_bytes=None)),
+        ('stream+cap', extract_plain_text_from_message),
+    ]
+    print(f"{'fixture':32} {'KB':>7} " + ' '.join(f"{name:>11}" for name, _ in engines) + f" {'speedup':>8} {'same':>6}")
+    totals = [0.0] * len(engines)
+    for name, size, msg in messages:
+        timings, outputs = [], []
+        for i, (_, fn) in enumerate(engines):
+            elapsed, out = best_of(fn, msg, args.repeat)
+            timings.append(elapsed)
+            outputs.append(out)
+            totals[i] += elapsed
+        # how close the new output is to the old one (1.00 = identical lines)
+        same = difflib.SequenceMatcher(None, outputs[0].splitlines(), outputs[1].splitlines()).ratio()
+        print(f"{name[:32]:32} {size / 1024:7.1f} " + ' '.join(f"{t * 1000:9.2f}ms" for t in timings)
+              + f" {timings[0] / max(timings[1], 1e-9):7.1f}x {same:6.2f}")
+    print(f"{'total':32} {'':>7} " + ' '.join(f"{t * 1000:9.2f}ms" for t in totals)
+          + f" {totals[0] / max(totals[1], 1e-9):7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
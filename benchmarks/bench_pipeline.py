@@ -0,0 +1,192 @@
+# benchmarks/bench_pipeline.py
+"""
+Replay the pipeline offline against the fake Gmail service and report
+msgs/sec, p50/p95 latency and Gmail API call counts per scenario.
+
+    python benchmarks/bench_pipeline.py [--scenarios summarize,auto-reply,find-datetime,find-internal]
+        [--messages 500] [--latency 0.05] [--error-rate 0.01] [-- extra summarizer.py args]
+
+- summarize: summarizer.main (extractive, --no-cache); latency = time from start until each message is handled.
+- auto-reply: auto_responder.process_unreplied, sending for real into the fake; latency = time until each
+  reply has been sent.
+- find-datetime / find-internal: reply_by_datetime.find_candidates and reply_by_internal.find_by_internal
+  (--repeat lookups of random messages); latency = per lookup.
+Quota pacing is real (--quota-units-per-second), so the numbers include it.
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from mime_fixtures import FIXTURES_DIR
+from fake_gmail import FakeGmailService, load_fixture_messages, synthesize
+from gmail_utils import configure_quota, DEFAULT_UNITS_PER_SECOND
+import summarizer
+import auto_responder
+import reply_by_datetime
+import reply_by_internal
+
+SCENARIOS = ('summarize', 'auto-reply', 'find-datetime', 'find-internal')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _window_query(messages):
+    """after:/before: query (epoch seconds) spanning all the messages."""
+    stamps = [int(m['internalDate']) // 1000 for m in messages]
+    return f"after:{min(stamps) - 1} before:{max(stamps) + 1}"
+
+
+def run_summarize(service, messages, args):
+    # a throwaway IDF index keeps the synthetic mailbox out of the real one (tfidf / textrank modes)
+    tmp = tempfile.TemporaryDirectory()
+    argv = ['--query', _window_query(messages), '--max-results', str(len(messages)), '--no-cache',
+            '--idf-path', f'{tmp.name}/idf.sqlite3',
+            '--quota-units-per-second', str(args.quota_units_per_second)] + args.extra
+    summarizer_args = summarizer.build_parser().parse_args(argv)
+    stamps = []
+    handle = summarizer.handle_message
+    get_service = summarizer.get_gmail_service
+
+    def timed_handle(*a, **kw):
+        result = handle(*a, **kw)
+        stamps.append(time.perf_counter())
+        return result
+
+    summarizer.handle_message = timed_handle
+    summarizer.get_gmail_service = lambda: service
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            summarizer.main(summarizer_args)
+    finally:
+        summarizer.handle_message = handle
+        summarizer.get_gmail_service = get_service
+        tmp.cleanup()
+    return time.perf_counter() - start, [s - start for s in stamps]
+
+
+def run_auto_reply(service, messages, args):
+    # sent results are only yielded when ReplySender flushes (every DEFAULT_BATCH_SIZE
+    # messages), so the latency taken is when each send itself completes
+    latencies = []
+    send = service._messages_send
+
+    def timed_send(**kwargs):
+        request = send(**kwargs)
+        fn = request.fn
+
+        def timed():
+            result = fn()
+            latencies.append(time.perf_counter() - start)
+            return result
+        request.fn = timed
+        return request
+
+    service._messages_send = timed_send
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in auto_responder.iter_unreplied(service, query=_window_query(messages), max_results=len(messages),
+                                               min_age_seconds=0, dry_run=False,
+                                               send_concurrency=args.send_concurrency):
+            pass
+    return time.perf_counter() - start, latencies
+
+
+def _lookups(messages, args):
+    rng = random.Random(args.seed)
+    return [rng.choice(messages) for _ in range(args.repeat)]
+
+
+def run_find_datetime(service, messages, args):
+    query = _window_query(messages)
+    latencies = []
+    start = time.perf_counter()
+    for msg in _lookups(messages, args):
+        when = datetime.fromtimestamp(int(msg['internalDate']) / 1000, tz=timezone.utc)
+        t0 = time.perf_counter()
+        reply_by_datetime.find_candidates(service, when.strftime('%d %b %Y'), when.strftime('%H:%M'),
+                                          query=query, max_results=len(messages))
+        latencies.append(time.perf_counter() - t0)
+    return time.perf_counter() - start, latencies
+
+
+def run_find_internal(service, messages, args):
+    query = _window_query(messages)
+    latencies = []
+    start = time.perf_counter()
+    for msg in _lookups(messages, args):
+        t0 = time.perf_counter()
+        reply_by_internal.find_by_internal(service, int(msg['internalDate']), tol_ms=args.tol_ms, query=query,
+                                           max_results=len(messages))
+        latencies.append(time.perf_counter() - t0)
+    return time.perf_counter() - start, latencies
+
+
+RUNNERS = {'summarize': run_summarize, 'auto-reply': run_auto_reply,
+           'find-datetime': run_find_datetime, 'find-internal': run_find_internal}
+
+
+def main():
+    argv, extra = sys.argv[1:], []
+    if '--' in argv:
+        argv, extra = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='*.json (recorded) and *.eml messages to replay')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--messages', type=int, default=200, help='Mailbox size (fixtures are cloned to reach it)')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per HTTP round trip')
+    parser.add_argument('--jitter', type=float, default=0.2, help='+- fraction of --latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls failing with 429 / 500')
+    parser.add_argument('--quota-units-per-second', type=float, default=DEFAULT_UNITS_PER_SECOND)
+    parser.add_argument('--send-concurrency', type=int, default=auto_responder.DEFAULT_SEND_CONCURRENCY)
+    parser.add_argument('--repeat', type=int, default=20, help='Lookups per finder scenario')
+    parser.add_argument('--tol-ms', type=int, default=300000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, metavar='PATH', help='Also write the results as JSON')
+    args = parser.parse_args(argv)
+    args.extra = extra
+
+    templates = load_fixture_messages(args.fixtures)
+    if not templates:
+        print("No .json / .eml fixtures found in", args.fixtures)
+        return
+    messages = synthesize(templates, args.messages, seed=args.seed)
+    configure_quota(args.quota_units_per_second)
+
+    print(f"{len(messages)} messages from {len(templates)} fixtures, latency {args.latency * 1000:.0f}ms "
+          f"(+-{args.jitter:.0%}), error rate {args.error_rate:.1%}, quota {args.quota_units_per_second:g} units/s")
+    print(f"{'scenario':14} {'items':>6} {'seconds':>8} {'msgs/s':>8} {'p50':>9} {'p95':>9} {'trips':>6} {'errors':>6}  calls")
+    results = {}
+    for name in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+        # every scenario starts from a fresh mailbox so sends of one do not change the next
+        service = FakeGmailService(messages, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                   seed=args.seed)
+        seconds, latencies = RUNNERS[name](service, messages, args)
+        # finders: items = lookups, each searching the whole mailbox
+        items = len(latencies) if name.startswith('find') else len(messages)
+        searched = len(messages) * len(latencies) if name.startswith('find') else items
+        stats = service.stats()
+        r = {'items': items, 'seconds': seconds, 'msgs_per_s': searched / max(seconds, 1e-9),
+             'p50_s': percentile(latencies, 0.5) if latencies else None,
+             'p95_s': percentile(latencies, 0.95) if latencies else None, **stats}
+        results[name] = r
+        p50 = f"{r['p50_s'] * 1000:7.0f}ms" if latencies else f"{'-':>9}"
+        p95 = f"{r['p95_s'] * 1000:7.0f}ms" if latencies else f"{'-':>9}"
+        calls = ' '.join(f"{k}={v}" for k, v in sorted(stats['calls'].items()))
+        print(f"{name:14} {items:6} {seconds:8.2f} {r['msgs_per_s']:8.1f} {p50} {p95} "
+              f"{stats['round_trips']:6} {stats['errors_injected']:6}  {calls}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# benchmarks/bench_transformer_backends.py
+"""
+Compare the transformer summarization backends on CPU: load time, per-message
+latency (p50/p95), batched throughput, and ROUGE drift of each backend's
+summaries against the plain PyTorch ones.
+
+    python benchmarks/bench_transformer_backends.py [--fixtures DIR] [--backends pytorch,int8,onnx]
+
+Needs transformers + torch (and optimum[onnxruntime] for the onnx backend);
+backends that fail to load are reported and skipped.
+"""
+import argparse
+import re
+import time
+from collections import Counter
+from mime_fixtures import FIXTURES_DIR, load_messages
+from gmail_utils import extract_plain_text_from_message, SUMMARY_MAX_CHARS
+import summarizers
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _tokens(text):
+    return _WORD_RE.findall(text.lower())
+
+
+def _f1(overlap, n_candidate, n_reference):
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / n_candidate, overlap / n_reference
+    return 2 * precision * recall / (precision + recall)
+
+
+def _ngrams(tokens, n):
+    return Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def _lcs(a, b):
+    prev = [0] * (len(b) + 1)
+    for x in a:
+        cur = [0]
+        for j, y in enumerate(b):
+            cur.append(prev[j] + 1 if x == y else max(prev[j + 1], cur[j]))
+        prev = cur
+    return prev[-1]
+
+
+def rouge(candidate, reference):
+    """ROUGE-1/2/L F1 of candidate against reference (simple word tokens, no stemming)."""
+    c, r = _tokens(candidate), _tokens(reference)
+    if not c or not r:
+        return {'rouge1': float(c == r), 'rouge2': float(c == r), 'rougeL': float(c == r)}
+    out = {}
+    for n in (1, 2):
+        cn, rn = _ngrams(c, n), _ngrams(r, n)
+        if not cn or not rn:
+            out[f'rouge{n}'] = float(c == r)
+            continue
+        out[f'rouge{n}'] = _f1(sum((cn & rn).values()), max(1, sum(cn.values())), max(1, sum(rn.values())))
+    out['rougeL'] = _f1(_lcs(c, r), len(c), len(r))
+    return out
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_backend(backend, texts, args):
+    kwargs = dict(model_name=args.model_name, max_length=args.max_length, min_length=args.min_length,
+                  device=-1, backend=backend)
+    start = time.perf_counter()
+    summarizers.warm_up(args.model_name, device=-1, backend=backend)
+    load_s = time.perf_counter() - start
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        summarizers.transformer_summarize(text, **kwargs)
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    summaries = summarizers.transformer_summarize_many(texts, batch_size=args.batch_size, **kwargs)
+    batch_s = time.perf_counter() - start
+    # keep one model resident at a time so memory numbers are not skewed
+    summarizers.unload(backend=backend)
+    return {'load_s': load_s, 'p50_s': percentile(latencies, 0.5), 'p95_s': percentile(latencies, 0.95),
+            'msgs_per_s': len(texts) / max(batch_s, 1e-9), 'summaries': summaries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser.add_argument('--backends', default=','.join(summarizers.BACKENDS),
+                        help='Comma separated; the first one is the ROUGE reference')
+    parser.add_argument('--model-name', default=summarizers.DEFAULT_MODEL)
+    parser.add_argument('--max-length', type=int, default=130)
+    parser.add_argument('--min-length', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=None, help='torch.set_num_threads (default: torch decides)')
+    args = parser.parse_args()
+
+    texts = [extract_plain_text_from_message(msg, max_chars=SUMMARY_MAX_CHARS, strip_quotes=True)
+             for _, _, msg in load_messages(args.fixtures)]
+    texts = [t for t in texts if t.strip()]
+    if not texts:
+        print("No .eml fixtures with text found in", args.fixtures)
+        return
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    results = {}
+    for backend in backends:
+        try:
+            results[backend] = run_backend(backend, texts, args)
+        except Exception as e:
+            print(f"{backend}: skipped ({e})")
+    if not results:
+        return
+    reference = next(iter(results.values()))['summaries']
+    print(f"{len(texts)} texts, reference backend: {next(iter(results))}")
+    print(f"{'backend':10} {'load':>8} {'p50':>9} {'p95':>9} {'msgs/s':>8} {'R-1':>6} {'R-2':>6} {'R-L':>6}")
+    for backend, r in results.items():
+        scores = [rouge(s, ref) for s, ref in zip(r['summaries'], reference)]
+        mean = {k: sum(s[k] for s in scores) / len(scores) for k in ('rouge1', 'rouge2', 'rougeL')}
+        print(f"{backend:10} {r['load_s']:7.1f}s {r['p50_s'] * 1000:7.0f}ms {r['p95_s'] * 1000:7.0f}ms "
+              f"{r['msgs_per_s']:8.2f} {mean['rouge1']:6.3f} {mean['rouge2']:6.3f} {mean['rougeL']:6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+# benchmarks/fake_gmail.py
+"""
+In-memory stand-in for the googleapiclient Gmail service, for offline runs
+of the pipeline.
+
+It supports the users().messages() / threads() / labels() / history() /
+getProfile() call chains and new_batch_http_request() used by gmail_utils,
+auto_responder, thread_state and mailbox_mirror. Each HTTP round trip (a
+single call or a whole batch) can be given latency and can fail with a
+transient error (429 / 500) at a configurable rate. Sends and label
+changes update the mailbox, so a second auto-reply pass sees the first
+one's work.
+
+    python benchmarks/fake_gmail.py --record DIR [--query Q] [--limit N]
+
+saves real messages (needs token.json) as JSON fixtures for later offline replay.
+"""
+import argparse
+import copy
+import glob
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import format_datetime
+from datetime import datetime, timezone
+import httplib2
+from googleapiclient.errors import HttpError
+from mime_fixtures import FIXTURES_DIR, eml_to_gmail_message
+from mailbox_mirror import _parse_query, HIDDEN_LABELS
+
+SYSTEM_LABELS = ['INBOX', 'UNREAD', 'SENT', 'DRAFT', 'SPAM', 'TRASH', 'STARRED', 'IMPORTANT']
+# history().list historyTypes -> the record field holding those changes
+HISTORY_FIELDS = {'messageAdded': 'messagesAdded', 'messageDeleted': 'messagesDeleted',
+                  'labelAdded': 'labelsAdded', 'labelRemoved': 'labelsRemoved'}
+
+
+def load_fixture_messages(directory=FIXTURES_DIR):
+    """Return Gmail message resources from every *.json (recorded) and *.eml file in directory."""
+    out = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path) as f:
+            data = json.load(f)
+        out.extend(data if isinstance(data, list) else [data])
+    for path in sorted(glob.glob(os.path.join(directory, '*.eml'))):
+        with open(path, 'rb') as f:
+            name = os.path.splitext(os.path.basename(path))[0]
+            out.append(eml_to_gmail_message(f.read(), msg_id=name))
+    return out
+
+
+def synthesize(templates, n, seed=0, start_ms=None, spacing_ms=15 * 60 * 1000, thread_share=0.1):
+    """
+    Build n messages from the templates with fresh ids, spread over time
+    (newest first, spacing_ms apart, ending at start_ms) and with their Date
+    header matching internalDate. About thread_share of them join the thread
+    of the previous message.
+    """
+    rng = random.Random(seed)
+    start_ms = int(time.time() * 1000) - 7 * 86400 * 1000 if start_ms is None else start_ms
+    out = []
+    for i in range(n):
+        msg = copy.deepcopy(templates[i % len(templates)])
+        ms = start_ms - i * spacing_ms
+        msg['id'] = f'{i + 1:016x}'
+        msg['threadId'] = out[-1]['threadId'] if out and rng.random() < thread_share else msg['id']
+        msg['internalDate'] = str(ms)
+        msg['labelIds'] = ['INBOX', 'UNREAD']
+        date = format_datetime(datetime.fromtimestamp(ms / 1000, tz=timezone.utc))
+        headers = msg.setdefault('payload', {}).setdefault('headers', [])
+        headers[:] = [h for h in headers if h['name'].lower() != 'date'] + [{'name': 'Date', 'value': date}]
+        out.append(msg)
+    return out
+
+
+def _http_error(status):
+    resp = httplib2.Response({'status': status, 'retry-after': '0'})
+    resp.reason = 'injected'
+    body = json.dumps({'error': {'code': status, 'message': 'injected error'}}).encode()
+    return HttpError(resp, body)
+
+
+def _not_found():
+    resp = httplib2.Response({'status': 404})
+    resp.reason = 'Not Found'
+    return HttpError(resp, b'{"error": {"code": 404, "message": "Not Found"}}')
+
+
+class FakeRequest:
+    def __init__(self, service, method, fn):
+        self.service = service
+        self.method = method
+        self.fn = fn
+
+    def execute(self, http=None, num_retries=0):
+        self.service._round_trip()
+        return self.service._call(self)
+
+
+class FakeBatch:
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.items = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.items.append((request, callback or self.callback, request_id))
+
+    def execute(self, http=None):
+        self.service._round_trip()
+        for request, callback, request_id in self.items:
+            try:
+                response, exception = self.service._call(request), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class _Resource:
+    """users() / messages() / threads() / ... all resolve to bound call builders."""
+
+    def __init__(self, service, methods):
+        self._service = service
+        self._methods = methods
+
+    def __getattr__(self, name):
+        try:
+            return self._methods[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class FakeGmailService:
+    """
+    A mailbox of Gmail message resources behind the googleapiclient call chains.
+    - latency: seconds per HTTP round trip (jitter: +- fraction of it).
+    - error_rate: probability that a call (or a batch item) fails with 429 / 500.
+    - calls: Counter of API methods executed; round_trips: HTTP requests made.
+    - Calls run one at a time against the mailbox (latency is slept outside
+      the lock), so concurrent senders see consistent ids and history.
+    """
+
+    def __init__(self, messages, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._mailbox_lock = threading.Lock()
+        self._sent_ids = itertools.count(1)
+        self.calls = Counter()
+        self.round_trips = 0
+        self.errors_injected = 0
+        self.messages = {}
+        self.order = []
+        self.labels = {lab: {'id': lab, 'name': lab, 'type': 'system'} for lab in SYSTEM_LABELS}
+        self.history_id = 1000
+        self.history = []
+        for msg in messages:
+            self._store(copy.deepcopy(msg))
+        self.order.sort(key=lambda mid: -int(self.messages[mid].get('internalDate', 0)))
+
+    # ---------- plumbing ----------
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+            delay = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)) if self.latency else 0
+        if delay > 0:
+            time.sleep(delay)
+
+    def _call(self, request):
+        with self._lock:
+            self.calls[request.method] += 1
+            fail = self.error_rate and self._rng.random() < self.error_rate
+            if fail:
+                self.errors_injected += 1
+                status = self._rng.choice([429, 500])
+        if fail:
+            raise _http_error(status)
+        with self._mailbox_lock:
+            return request.fn()
+
+    def _request(self, method, fn):
+        return FakeRequest(self, method, fn)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def stats(self):
+        return {'round_trips': self.round_trips, 'calls': dict(self.calls), 'errors_injected': self.errors_injected}
+
+    def _record(self, msg, **changes):
+        """Append a history record for msg; like Gmail's, it lists the message under 'messages' too."""
+        ref = {'id': msg['id'], 'threadId': msg.get('threadId')}
+        self.history.append(dict({'id': str(self.history_id), 'messages': [ref]}, **changes))
+
+    def _store(self, msg):
+        self.history_id += 1
+        msg['historyId'] = str(self.history_id)
+        if msg['id'] not in self.messages:
+            self.order.insert(0, msg['id'])
+        self.messages[msg['id']] = msg
+        self._record(msg, messagesAdded=[{'message': {
+            'id': msg['id'], 'threadId': msg.get('threadId'), 'labelIds': list(msg.get('labelIds', []))}}])
+
+    def _relabel(self, msg_id, add=(), remove=()):
+        msg = self.messages[msg_id]
+        labels = [lab for lab in msg.get('labelIds', []) if lab not in remove]
+        labels += [lab for lab in add if lab not in labels]
+        msg['labelIds'] = labels
+        self.history_id += 1
+        msg['historyId'] = str(self.history_id)
+        ref = {'id': msg_id, 'threadId': msg.get('threadId'), 'labelIds': list(labels)}
+        changes = {}
+        if add:
+            changes['labelsAdded'] = [{'message': ref, 'labelIds': list(add)}]
+        if remove:
+            changes['labelsRemoved'] = [{'message': ref, 'labelIds': list(remove)}]
+        self._record(msg, **changes)
+
+    def _view(self, msg, format='full', metadata_headers=None):
+        if format == 'full':
+            return copy.deepcopy(msg)
+        out = {k: msg[k] for k in ('id', 'threadId', 'labelIds', 'internalDate', 'historyId', 'sizeEstimate', 'snippet')
+               if k in msg}
+        if format == 'metadata':
+            wanted = {h.lower() for h in metadata_headers or []}
+            headers = msg.get('payload', {}).get('headers', [])
+            out['payload'] = {'mimeType': msg.get('payload', {}).get('mimeType'),
+                              'headers': [h for h in headers if not wanted or h['name'].lower() in wanted]}
+        return out
+
+    def _matches(self, query):
+        rules = _parse_query(query, exact=False)
+        if rules is None:
+            # operators the local evaluator does not know (from:, label:, ...) match everything
+            rules = _parse_query(None)
+        for mid in self.order:
+            msg = self.messages[mid]
+            labels = set(msg.get('labelIds', []))
+            ms = int(msg.get('internalDate', 0))
+            if not rules['after_ms'] <= ms < rules['before_ms']:
+                continue
+            if any(lab not in labels for lab in rules['with']) or any(lab in labels for lab in rules['without']):
+                continue
+            if not rules['include_hidden'] and labels.intersection(HIDDEN_LABELS):
+                continue
+            yield mid
+
+    # ---------- API surface ----------
+    def users(self):
+        return _Resource(self, {
+            'messages': self._messages, 'threads': self._threads, 'labels': self._labels,
+            'history': self._history, 'getProfile': self._get_profile, 'watch': self._watch, 'stop': self._stop,
+        })
+
+    def _messages(self):
+        return _Resource(self, {
+            'list': self._messages_list, 'get': self._messages_get, 'send': self._messages_send,
+            'modify': self._messages_modify, 'batchModify': self._messages_batch_modify,
+            'attachments': lambda: _Resource(self, {'get': self._attachments_get}),
+        })
+
+    def _messages_list(self, userId='me', q=None, maxResults=100, pageToken=None, labelIds=None, **kwargs):
+        def fn():
+            ids = list(self._matches(q))
+            if labelIds:
+                ids = [mid for mid in ids if set(labelIds) <= set(self.messages[mid].get('labelIds', []))]
+            start = int(pageToken or 0)
+            page = ids[start:start + min(int(maxResults), 500)]
+            resp = {'messages': [{'id': mid, 'threadId': self.messages[mid].get('threadId')} for mid in page],
+                    'resultSizeEstimate': len(ids)}
+            if start + len(page) < len(ids):
+                resp['nextPageToken'] = str(start + len(page))
+            return resp
+        return self._request('messages.list', fn)
+
+    def _messages_get(self, userId='me', id=None, format='full', metadataHeaders=None, **kwargs):
+        def fn():
+            if id not in self.messages:
+                raise _not_found()
+            return self._view(self.messages[id], format, metadataHeaders)
+        return self._request('messages.get', fn)
+
+    def _attachments_get(self, userId='me', messageId=None, id=None, **kwargs):
+        return self._request('messages.attachments.get', lambda: {'size': 0, 'data': ''})
+
+    def _messages_send(self, userId='me', body=None, **kwargs):
+        def fn():
+            n = next(self._sent_ids)
+            msg = {'id': f'sent{n:012x}', 'threadId': body.get('threadId') or f'sent{n:012x}',
+                   'labelIds': ['SENT'], 'internalDate': str(int(time.time() * 1000)),
+                   'payload': {'mimeType': 'text/plain', 'headers': [], 'body': {'data': body.get('raw', '')}}}
+            self._store(msg)
+            return {'id': msg['id'], 'threadId': msg['threadId'], 'labelIds': ['SENT']}
+        return self._request('messages.send', fn)
+
+    def _messages_modify(self, userId='me', id=None, body=None, **kwargs):
+        def fn():
+            if id not in self.messages:
+                raise _not_found()
+            self._relabel(id, body.get('addLabelIds', []), body.get('removeLabelIds', []))
+            return self._view(self.messages[id], 'minimal')
+        return self._request('messages.modify', fn)
+
+    def _messages_batch_modify(self, userId='me', body=None, **kwargs):
+        def fn():
+            for mid in body.get('ids', []):
+                if mid in self.messages:
+                    self._relabel(mid, body.get('addLabelIds', []), body.get('removeLabelIds', []))
+            return ''
+        return self._request('messages.batchModify', fn)
+
+    def _threads(self):
+        return _Resource(self, {'get': self._threads_get})
+
+    def _threads_get(self, userId='me', id=None, format='full', metadataHeaders=None, **kwargs):
+        def fn():
+            msgs = [self.messages[mid] for mid in reversed(self.order) if self.messages[mid].get('threadId') == id]
+            if not msgs:
+                raise _not_found()
+            return {'id': id, 'historyId': max(m['historyId'] for m in msgs),
+                    'messages': [self._view(m, format, metadataHeaders) for m in msgs]}
+        return self._request('threads.get', fn)
+
+    def _labels(self):
+        return _Resource(self, {'list': self._labels_list, 'create': self._labels_create})
+
+    def _labels_list(self, userId='me', **kwargs):
+        return self._request('labels.list', lambda: {'labels': list(self.labels.values())})
+
+    def _labels_create(self, userId='me', body=None, **kwargs):
+        def fn():
+            lab = dict(body, id=f'Label_{len(self.labels)}', type='user')
+            self.labels[lab['id']] = lab
+            return lab
+        return self._request('labels.create', fn)
+
+    def _history(self):
+        return _Resource(self, {'list': self._history_list})
+
+    def _history_list(self, userId='me', startHistoryId=None, historyTypes=None, labelId=None, maxResults=100,
+                      pageToken=None, **kwargs):
+        def fn():
+            records = [r for r in self.history if int(r['id']) > int(startHistoryId)]
+            if historyTypes:
+                records = [r for r in (_only_fields(r, [HISTORY_FIELDS[t] for t in historyTypes]) for r in records) if r]
+            if labelId:
+                records = [r for r in records if _touches_label(r, labelId)]
+            start = int(pageToken or 0)
+            page = records[start:start + int(maxResults)]
+            resp = {'history': page, 'historyId': str(self.history_id)}
+            if start + len(page) < len(records):
+                resp['nextPageToken'] = str(start + len(page))
+            return resp
+        return self._request('history.list', fn)
+
+    def _get_profile(self, userId='me'):
+        return self._request('getProfile', lambda: {'emailAddress': 'me@example.com', 'historyId': str(self.history_id),
+                                                    'messagesTotal': len(self.messages)})
+
+    def _watch(self, userId='me', body=None):
+        return self._request('watch', lambda: {'historyId': str(self.history_id), 'expiration': '0'})
+
+    def _stop(self, userId='me'):
+        return self._request('stop', lambda: '')
+
+
+def _only_fields(record, fields):
+    """record with only the given change fields, or None if it has none of them."""
+    kept = {f: record[f] for f in fields if f in record}
+    return dict(kept, id=record['id'], messages=record['messages']) if kept else None
+
+
+def _touches_label(record, label_id):
+    """True if a change in record concerns a message carrying label_id (or adds / removes it)."""
+    for field in HISTORY_FIELDS.values():
+        for change in record.get(field, []):
+            if label_id in change.get('labelIds', []) or label_id in change['message'].get('labelIds', []):
+                return True
+    return False
+
+
+def record(directory, query=None, limit=100):
+    """Save the messages matching query from the real mailbox as <id>.json fixtures."""
+    from gmail_utils import get_gmail_service, iter_message_ids, iter_messages
+    service = get_gmail_service()
+    os.makedirs(directory, exist_ok=True)
+    n = 0
+    for mid, msg in iter_messages(service, iter_message_ids(service, query=query, limit=limit)):
+        if msg is None:
+            continue
+        with open(os.path.join(directory, f'{mid}.json'), 'w') as f:
+            json.dump(msg, f)
+        n += 1
+    print(f"Recorded {n} messages to {directory}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record real messages as JSON fixtures for the fake Gmail service")
+    parser.add_argument('--record', required=True, metavar='DIR')
+    parser.add_argument('--query', default=None)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+    record(args.record, query=args.query, limit=args.limit)
@@ -0,0 +1,326 @@
+# daemon.py
+import base64
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from googleapiclient.errors import HttpError
+from gmail_utils import get_gmail_service, configure_quota, execute, iter_history
+from summarizers import warm_up
+from summary_cache import SummaryCache
+from thread_state import ThreadStateCache
+from auto_responder import ensure_label, get_message_datetime_ms
+import summarizer
+
+DEFAULT_STATE_PATH = os.path.join('.cache', 'daemon_state.json')
+DEFAULT_POLL_INTERVAL = 60
+# watches expire after 7 days; Google recommends renewing once a day
+WATCH_RENEW_SECONDS = 24 * 60 * 60
+
+
+class Notifier:
+    """
+    Wake-up channel for the daemon. notify() is called by whatever learns about
+    new mail (the push receiver, or a test); wait() blocks until then or until
+    the timeout, so a bare Notifier means plain history polling.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def notify(self, history_id=None):
+        self._queue.put(history_id)
+
+    def wait(self, timeout=None):
+        """Return True if woken by a notification, False on timeout. Queued notifications are coalesced."""
+        try:
+            self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return True
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PushReceiver(Notifier):
+    """
+    Notifier fed by Gmail push notifications (users.watch -> Cloud Pub/Sub).
+    A small HTTP server accepts Pub/Sub push deliveries on `path`; point the
+    push subscription at http://host:port/<path>?token=<token>.
+    """
+
+    def __init__(self, host='0.0.0.0', port=8080, path='/gmail/push', token=None):
+        super().__init__()
+        self.path = path
+        self.token = token
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def _handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                path, _, qs = self.path.partition('?')
+                if path != receiver.path:
+                    return self._reply(404)
+                if receiver.token and parse_qs(qs).get('token', [None])[0] != receiver.token:
+                    return self._reply(403)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                try:
+                    history_id = parse_push(body)
+                except ValueError:
+                    # ack anyway: Pub/Sub would redeliver a malformed message forever
+                    return self._reply(204)
+                receiver.notify(history_id)
+                self._reply(204)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def parse_push(body):
+    """Return the historyId carried by a Pub/Sub push body; ValueError if malformed."""
+    try:
+        envelope = json.loads(body)
+        data = json.loads(base64.b64decode(envelope['message']['data']))
+        return data['historyId']
+    except Exception as e:
+        raise ValueError("not a Gmail Pub/Sub notification") from e
+
+
+class MailDaemon:
+    """
+    Resident summarizer / auto-responder.
+    - The Gmail service, label id, caches and model are set up once and reused.
+    - Each wake-up (push notification, or poll_interval elapsed) replays
+      users().history().list from the saved checkpoint and processes only the
+      messages added to the inbox since.
+    - With --auto-reply, messages younger than min_age_seconds are deferred
+      and processed once they are old enough; they are saved with the
+      checkpoint, so a restart does not lose them.
+    """
+
+    def __init__(self, service, args, notifier=None, state_path=DEFAULT_STATE_PATH,
+                 poll_interval=DEFAULT_POLL_INTERVAL, topic=None):
+        self.service = service
+        self.args = args
+        self.notifier = notifier or Notifier()
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+        self.topic = topic
+        self.processed = 0
+        self.label_id = ensure_label(service, label_name=args.label_name)
+        self.cache = None if args.no_cache else SummaryCache()
+        self.thread_cache = None if args.no_cache else ThreadStateCache()
+        self.sender = summarizer.make_reply_sender(service, args, self.label_id, thread_cache=self.thread_cache)
+        # --workers: one long-lived pool, so worker models are loaded once, not per wake-up
+        self.pool = summarizer.make_summary_pool(args)
+        if args.mode == 'transformer' and self.pool is None:
+            warm_up(args.model_name, device=args.device, backend=args.backend)
+        self.history_id, self._deferred = self._load_state()
+        self._watch_renew_at = 0
+        self._stop = threading.Event()
+
+    # ---------- checkpoint ----------
+    def _load_state(self):
+        """Return (history_id, {deferred message id: ready_at}) from the state file."""
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            return state.get('history_id'), state.get('deferred', {})
+        return None, {}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        if os.path.dirname(self.state_path):
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'history_id': self.history_id, 'deferred': self._deferred}, f)
+        os.replace(tmp, self.state_path)
+
+    def _profile_history_id(self):
+        return execute(self.service, self.service.users().getProfile(userId='me'), 'getProfile')['historyId']
+
+    # ---------- Gmail ----------
+    def start_watch(self):
+        """(Re)register users.watch for the inbox on self.topic; no-op when polling."""
+        if not self.topic:
+            return None
+        body = {'topicName': self.topic, 'labelIds': ['INBOX'], 'labelFilterBehavior': 'include'}
+        resp = execute(self.service, self.service.users().watch(userId='me', body=body), 'watch')
+        self._watch_renew_at = time.time() + WATCH_RENEW_SECONDS
+        return resp
+
+    def new_message_ids(self):
+        """
+        Return (ids, checkpoint): messages added to the inbox since the stored
+        historyId (oldest first, excluding our own sent mail and drafts) and the
+        historyId to store once they are handled.
+        """
+        if self.history_id is None:
+            return [], self._profile_history_id()
+        ids = []
+        latest = int(self.history_id)
+        try:
+            for record in iter_history(self.service, self.history_id, history_types=['messageAdded'],
+                                       label_id='INBOX'):
+                latest = max(latest, int(record.get('id', 0)))
+                for item in record.get('messagesAdded', []):
+                    labels = item['message'].get('labelIds', [])
+                    if 'INBOX' in labels and 'SENT' not in labels and 'DRAFT' not in labels:
+                        ids.append(item['message']['id'])
+        except HttpError as e:
+            if getattr(e.resp, 'status', None) != 404:
+                raise
+            print("History checkpoint expired; continuing from the current mailbox state.")
+            return [], self._profile_history_id()
+        return list(dict.fromkeys(ids)), str(latest)
+
+    # ---------- processing ----------
+    def process_new(self):
+        """Handle new and due deferred messages; returns how many were processed."""
+        ids, checkpoint = self.new_message_ids()
+        deferred_before = dict(self._deferred)
+        now = time.time()
+        due = [mid for mid, at in self._deferred.items() if at <= now]
+        ids = due + [mid for mid in ids if mid not in self._deferred]
+        handled = 0
+        if ids:
+            if self.thread_cache is not None:
+                self.thread_cache.refresh(self.service)
+            for mid, msg, text, summary in summarizer.iter_summaries(self.service, self.args, self.label_id,
+                                                                     cache=self.cache, msg_ids=ids, pool=self.pool):
+                if msg is None:
+                    print(f"Failed to fetch message {mid}, skipping.")
+                    continue
+                if self._defer(mid, msg, now):
+                    continue
+                summarizer.handle_message(self.service, mid, msg, text, summary, self.args, self.label_id,
+                                          thread_cache=self.thread_cache, sender=self.sender)
+                handled += 1
+                if self.sender is not None and self.sender.pending >= self.args.batch_size:
+                    summarizer.report_sends(self.sender.flush())
+            if self.sender is not None:
+                # replies are sent and labelled before the checkpoint moves past them
+                summarizer.report_sends(self.sender.flush())
+        # dropped only now, so a failed cycle retries them
+        for mid in due:
+            del self._deferred[mid]
+        self.processed += handled
+        # only move the checkpoint once the messages it covers were handled or
+        # saved as deferred (in the same write)
+        if checkpoint != self.history_id or self._deferred != deferred_before:
+            self.history_id = checkpoint
+            self._save_state()
+        return handled
+
+    def _defer(self, mid, msg, now):
+        if not self.args.auto_reply or not self.args.min_age_seconds:
+            return False
+        received = get_message_datetime_ms(msg)
+        if not received:
+            return False
+        ready_at = received / 1000.0 + self.args.min_age_seconds
+        if ready_at <= now:
+            return False
+        self._deferred[mid] = ready_at
+        return True
+
+    def _next_timeout(self):
+        timeout = self.poll_interval
+        if self._deferred:
+            timeout = min(timeout, max(0.0, min(self._deferred.values()) - time.time()))
+        if self.topic:
+            timeout = min(timeout, max(0.0, self._watch_renew_at - time.time()))
+        return timeout
+
+    # ---------- loop ----------
+    def run(self):
+        """Serve until stop() is called (or Ctrl+C)."""
+        self.notifier.start()
+        try:
+            self.start_watch()
+            while not self._stop.is_set():
+                try:
+                    if self.topic and time.time() >= self._watch_renew_at:
+                        self.start_watch()
+                    self.process_new()
+                except Exception as e:
+                    # keep serving; the next wake-up retries from the same checkpoint
+                    print("Daemon cycle failed:", e)
+                self.notifier.wait(timeout=self._next_timeout())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.notifier.stop()
+            if self.sender is not None:
+                summarizer.report_sends(self.sender.close())
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+
+    def stop(self):
+        self._stop.set()
+        self.notifier.notify()
+
+
+def build_parser():
+    parser = summarizer.build_parser()
+    parser.description = "Resident Gmail summarizer + auto-responder reacting to new mail"
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='Seconds between history polls (a safety net when --push-port is used)')
+    parser.add_argument('--push-port', type=int, default=None,
+                        help='Listen for Pub/Sub push notifications on this port instead of polling only')
+    parser.add_argument('--push-host', type=str, default='0.0.0.0')
+    parser.add_argument('--push-path', type=str, default='/gmail/push')
+    parser.add_argument('--push-token', type=str, default=None,
+                        help='Shared secret expected as ?token= on push deliveries')
+    parser.add_argument('--topic', type=str, default=None,
+                        help='Pub/Sub topic for users.watch (projects/<project>/topics/<topic>)')
+    parser.add_argument('--state', type=str, default=DEFAULT_STATE_PATH, help='Where the history checkpoint is kept')
+    # new mail is the point of the daemon; defer by --min-age-seconds only when asked
+    parser.set_defaults(min_age_seconds=0)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    configure_quota(args.quota_units_per_second)
+    notifier = None
+    if args.push_port:
+        notifier = PushReceiver(args.push_host, args.push_port, args.push_path, token=args.push_token)
+    daemon = MailDaemon(get_gmail_service(), args, notifier=notifier, state_path=args.state,
+                        poll_interval=args.poll_interval, topic=args.topic)
+    print("Watching for new mail (Ctrl+C to stop)...")
+    daemon.run()
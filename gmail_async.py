@@ -0,0 +1,204 @@
+# gmail_async.py
+import asyncio
+import queue
+import threading
+from google.auth.transport.requests import Request
+from gmail_utils import RETRYABLE_STATUSES, NON_IDEMPOTENT_METHODS, MAX_PAGE_SIZE, QUOTA_UNITS, backoff_delay, get_quota_scheduler
+
+GMAIL_API = 'https://gmail.googleapis.com/gmail/v1/users/me'
+DEFAULT_CONCURRENCY = 10
+
+
+class GmailAPIError(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"Gmail API error {status}: {body[:300]}")
+        self.status = status
+        self.body = body
+
+
+class AsyncGmailClient:
+    """
+    asyncio Gmail client talking to the REST endpoints directly (httpx), reusing
+    the OAuth credentials from gmail_utils.get_credentials.
+    - At most `concurrency` requests are in flight at once (semaphore).
+    - One pooled keep-alive connection set is shared by all calls.
+    - Calls are paced by a gmail_utils.QuotaScheduler (the process-wide one
+      unless scheduler= is given).
+    - 429 / 5xx responses are retried with jittered exponential backoff.
+    Use as `async with AsyncGmailClient(creds) as client: ...`.
+    """
+
+    def __init__(self, creds, concurrency=DEFAULT_CONCURRENCY, timeout=30.0, max_retries=4, scheduler=None):
+        try:
+            import httpx
+        except Exception as e:
+            raise RuntimeError("httpx not installed or failed to import. Install httpx to use the async client.") from e
+        self.creds = creds
+        self.max_retries = max_retries
+        self.scheduler = scheduler or get_quota_scheduler()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._refresh_lock = asyncio.Lock()
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self._http = httpx.AsyncClient(base_url=GMAIL_API, timeout=timeout, limits=limits)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def _token(self):
+        async with self._refresh_lock:
+            if not self.creds.valid:
+                # google-auth refresh is blocking; keep it off the event loop
+                await asyncio.to_thread(self.creds.refresh, Request())
+            return self.creds.token
+
+    async def request(self, method, path, params=None, json=None, quota='messages.get'):
+        """Issue one API call (costing QUOTA_UNITS[quota]) and return the decoded JSON body."""
+        attempt = 0
+        while True:
+            await self.scheduler.acquire_async(QUOTA_UNITS.get(quota, 5))
+            headers = {'Authorization': f"Bearer {await self._token()}"}
+            async with self._semaphore:
+                resp = await self._http.request(method, path, params=params, json=json, headers=headers)
+            if resp.status_code < 400:
+                return resp.json() if resp.content else {}
+            retryable = resp.status_code in RETRYABLE_STATUSES or (
+                resp.status_code == 403 and 'ratelimitexceeded' in resp.text.lower())
+            if quota in NON_IDEMPOTENT_METHODS and resp.status_code >= 500:
+                # the send may have gone through; a retry could send it twice
+                retryable = False
+            if resp.status_code == 401 and attempt == 0:
+                # token revoked/expired early: force a refresh once
+                self.creds.token = None
+                retryable = True
+            if not retryable or attempt >= self.max_retries:
+                raise GmailAPIError(resp.status_code, resp.text)
+            retry_after = resp.headers.get('Retry-After')
+            delay = backoff_delay(attempt, float(retry_after) if retry_after and retry_after.isdigit() else None)
+            self.scheduler.pause(delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # ---------- messages ----------
+    async def iter_message_ids(self, query=None, limit=None, page_size=100):
+        """Async generator of message ids matching query, following page tokens."""
+        token = None
+        n = 0
+        while True:
+            params = {'maxResults': min(page_size, MAX_PAGE_SIZE)}
+            if query:
+                params['q'] = query
+            if token:
+                params['pageToken'] = token
+            resp = await self.request('GET', '/messages', params=params, quota='messages.list')
+            for m in resp.get('messages', []):
+                if limit is not None and n >= limit:
+                    return
+                n += 1
+                yield m['id']
+            token = resp.get('nextPageToken')
+            if not token:
+                return
+
+    async def list_message_ids(self, query=None, limit=100):
+        return [mid async for mid in self.iter_message_ids(query=query, limit=limit)]
+
+    async def get_message(self, msg_id, format='full', metadata_headers=None):
+        params = [('format', format)] + [('metadataHeaders', h) for h in (metadata_headers or [])]
+        return await self.request('GET', f'/messages/{msg_id}', params=params)
+
+    async def get_messages(self, ids, format='full', metadata_headers=None):
+        """Fetch messages concurrently; returns them in id order (None for failures)."""
+        async def one(mid):
+            try:
+                return await self.get_message(mid, format=format, metadata_headers=metadata_headers)
+            except GmailAPIError:
+                return None
+        return await asyncio.gather(*(one(mid) for mid in ids))
+
+    async def send_message(self, raw, thread_id=None):
+        body = {'raw': raw}
+        if thread_id:
+            body['threadId'] = thread_id
+        return await self.request('POST', '/messages/send', json=body, quota='messages.send')
+
+    async def modify_message(self, msg_id, add_label_ids=(), remove_label_ids=()):
+        body = {'addLabelIds': list(add_label_ids), 'removeLabelIds': list(remove_label_ids)}
+        return await self.request('POST', f'/messages/{msg_id}/modify', json=body, quota='messages.modify')
+
+    # ---------- threads / labels ----------
+    async def get_thread(self, thread_id, format='minimal'):
+        return await self.request('GET', f'/threads/{thread_id}', params={'format': format}, quota='threads.get')
+
+    async def list_labels(self):
+        resp = await self.request('GET', '/labels', quota='labels.list')
+        return resp.get('labels', [])
+
+    async def create_label(self, body):
+        return await self.request('POST', '/labels', json=body, quota='labels.create')
+
+
+def iter_messages_background(creds, query=None, limit=None, format='full', concurrency=DEFAULT_CONCURRENCY):
+    """
+    Synchronous generator for the CLIs: an event loop on a background thread lists
+    and fetches messages concurrently, while the caller consumes (id, message)
+    pairs in list order. Fetching stays at most a few windows ahead of the consumer.
+    """
+    out = queue.Queue(maxsize=concurrency * 4)
+    done = object()
+    stop = threading.Event()
+
+    async def produce():
+        async with AsyncGmailClient(creds, concurrency=concurrency) as client:
+            window = []
+            async for mid in client.iter_message_ids(query=query, limit=limit):
+                if stop.is_set():
+                    break
+                window.append((mid, asyncio.ensure_future(client.get_messages([mid], format=format))))
+                if len(window) >= concurrency * 2:
+                    mid0, fut = window.pop(0)
+                    await _put(out, (mid0, (await fut)[0]), stop)
+            for mid0, fut in window:
+                await _put(out, (mid0, (await fut)[0]), stop)
+
+    def run():
+        result = done
+        try:
+            asyncio.run(produce())
+        except Exception as e:
+            result = e
+        # the consumer may already be gone; never block on a full queue here
+        while not stop.is_set():
+            try:
+                out.put(result, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = out.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+async def _put(q, item, stop):
+    # hand results to the consuming thread without blocking the event loop
+    while not stop.is_set():
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            await asyncio.sleep(0.01)
@@ -1,12 +1,20 @@
 # gmail_utils.py
 import base64
+import codecs
 import os
+import random
 import re
-from bs4 import BeautifulSoup
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from html.parser import HTMLParser
+from itertools import islice
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 SCOPES = [
     'https://www.googleapis.com/auth/gmail.readonly',
@@ -14,42 +22,435 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.send'
 ]
 
+# Gmail accepts at most 100 calls per batch request, but recommends <= 50
+# to avoid per-user rate limiting.
+MAX_BATCH_SIZE = 100
+DEFAULT_BATCH_SIZE = 50
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# a 5xx on these may come back after Gmail already acted on the call: only
+# rate-limit rejections are retried for them, never server errors
+NON_IDEMPOTENT_METHODS = ('messages.send',)
+# messages().list returns at most 500 ids per page
+MAX_PAGE_SIZE = 500
 
-def get_gmail_service(credentials_path='credentials.json', token_path='token.json'):
+# Gmail API quota units per call (https://developers.google.com/gmail/api/reference/quota)
+QUOTA_UNITS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.send': 100,
+    'messages.modify': 5,
+    'messages.batchModify': 50,
+    'messages.attachments.get': 5,
+    'threads.get': 10,
+    'threads.list': 10,
+    'labels.list': 1,
+    'labels.create': 5,
+    'history.list': 2,
+    'getProfile': 1,
+    'watch': 100,
+    'stop': 50,
+}
+# HTML bodies are only converted up to this many bytes (newsletters can be several MB)
+DEFAULT_HTML_MAX_BYTES = 256 * 1024
+# elements whose content is never rendered as text. <head> itself is not skipped:
+# its other children carry no text except <title>, which is kept, and a <head>
+# left unclosed would otherwise swallow the whole body
+_HTML_SKIP_TAGS = frozenset(['script', 'style', 'template'])
+# how much text the summarizers are given per message (quoted history excluded)
+SUMMARY_MAX_CHARS = 20000
+# base64 characters decoded per step by iter_message_text (a multiple of 4)
+TEXT_DECODE_BLOCK = 64 * 1024
+# a reply attribution ("On <date>, <who> wrote:") or an Outlook reply separator
+_QUOTE_HEADER_RE = re.compile(r'^(On\b.*\bwrote:|-{2,}\s*Original Message\s*-{2,})$', re.IGNORECASE)
+# per-user limit is 250 units/second; leave a little headroom by default
+DEFAULT_UNITS_PER_SECOND = 240
+MAX_RETRIES = 5
+
+
+class QuotaScheduler:
+    """
+    Token bucket over Gmail quota units, shared by every thread using a service.
+    acquire(units) blocks just long enough to keep the average rate at
+    units_per_second (bursts up to `burst` units pass immediately), so callers
+    run flat out right up to the quota ceiling instead of failing at it.
+    pause(seconds) holds everyone back, e.g. after a 429 with Retry-After.
+    """
+
+    def __init__(self, units_per_second=DEFAULT_UNITS_PER_SECOND, burst=None):
+        self.rate = float(units_per_second)
+        self.burst = float(burst if burst is not None else units_per_second)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.units_used = 0
+
+    def _reserve(self, units):
+        # take the units now (balance may go negative) and return how long to wait
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= units
+            self.units_used += units
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def acquire(self, units):
+        wait = self._reserve(units)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, units):
+        import asyncio
+        wait = self._reserve(units)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_default_scheduler = QuotaScheduler()
+_service_schedulers = weakref.WeakKeyDictionary()
+
+def get_quota_scheduler(service=None):
+    """Scheduler registered for service (see set_quota_scheduler), else the process-wide default."""
+    if service is not None:
+        try:
+            return _service_schedulers.get(service, _default_scheduler)
+        except TypeError:
+            pass
+    return _default_scheduler
+
+def set_quota_scheduler(service, scheduler):
+    """Give service its own quota budget (e.g. one per mailbox)."""
+    _service_schedulers[service] = scheduler
+
+def configure_quota(units_per_second, burst=None):
+    """Replace the process-wide default budget."""
+    global _default_scheduler
+    _default_scheduler = QuotaScheduler(units_per_second, burst=burst)
+    return _default_scheduler
+
+def backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt: Retry-After if given, else jittered exponential."""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 1)
+    return min(64, 2 ** attempt) + random.uniform(0, 1)
+
+def _retry_after(exc):
+    """Retry-After of an HttpError in seconds, or None."""
+    resp = getattr(exc, 'resp', None)
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def execute(service, request, method, http=None, max_retries=MAX_RETRIES):
+    """
+    Execute one API request under the quota scheduler, retrying transient errors
+    (429 / 5xx / rate limit) with jittered exponential backoff honoring Retry-After.
+    method: key into QUOTA_UNITS, e.g. 'messages.get'. Sends are only retried
+    on rate limiting (see NON_IDEMPOTENT_METHODS).
+    """
+    scheduler = get_quota_scheduler(service)
+    attempt = 0
+    while True:
+        scheduler.acquire(QUOTA_UNITS.get(method, 5))
+        try:
+            return request.execute(http=http) if http else request.execute()
+        except HttpError as e:
+            if not _is_retryable(e, method) or attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt, _retry_after(e))
+            scheduler.pause(delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+def get_credentials(credentials_path='credentials.json', token_path='token.json', interactive=True):
+    """
+    Load (refreshing or running the OAuth flow if needed) the user credentials.
+    interactive=False raises RuntimeError instead of opening a browser login,
+    for unattended runs.
+    """
     creds = None
     if os.path.exists(token_path):
         creds = Credentials.from_authorized_user_file(token_path, SCOPES)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
+        elif not interactive:
+            raise RuntimeError(f"{token_path} is missing or has no refresh token; run once interactively to authorize it.")
         else:
             flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
         with open(token_path, 'w') as f:
             f.write(creds.to_json())
+    return creds
+
+def get_gmail_service(credentials_path='credentials.json', token_path='token.json', interactive=True):
+    creds = get_credentials(credentials_path, token_path, interactive=interactive)
     service = build('gmail', 'v1', credentials=creds)
     return service
 
-def list_message_ids(service, query=None, max_results=10):
-    """Return list of message ids matching query (None means all)."""
-    results = service.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-    return [m['id'] for m in results.get('messages', [])]
+def _new_http(service):
+    """
+    Return a fresh authorized Http bound to the service's credentials, for use
+    from a worker thread (httplib2 connections are not thread-safe).
+    Returns None when the service carries no credentials (e.g. a test double).
+    """
+    creds = getattr(getattr(service, '_http', None), 'credentials', None)
+    if creds is None:
+        return None
+    import google_auth_httplib2
+    import httplib2
+    return google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+
+def list_message_ids(service, query=None, max_results=10, mirror=None):
+    """Return list of message ids matching query (None means all), following pages up to max_results."""
+    return list(iter_message_ids(service, query=query, limit=max_results, page_size=MAX_PAGE_SIZE,
+                                 prefetch=False, mirror=mirror))
+
+def iter_message_ids(service, query=None, limit=None, page_size=100, prefetch=True, mirror=None):
+    """
+    Yield message ids matching query, following nextPageToken lazily.
+    - limit: stop after this many ids (None means no limit).
+    - page_size: ids requested per messages().list call (capped at 500).
+    - prefetch: request the next page in a background thread while the
+      caller is still working through the current one.
+    - mirror: optional MailboxMirror; queries it can evaluate locally are
+      answered without touching the network.
+    """
+    if mirror is not None and mirror.can_answer(query):
+        yield from mirror.iter_ids(query, limit=limit)
+        return
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    http = _new_http(service) if prefetch else None
+
+    def fetch(token, remaining):
+        n = page_size if remaining is None else min(page_size, remaining)
+        req = service.users().messages().list(userId='me', q=query, maxResults=n, pageToken=token)
+        return execute(service, req, 'messages.list', http=http)
+
+    def submit(token, remaining):
+        if executor is None:
+            fut = Future()
+            fut.set_result(fetch(token, remaining))
+            return fut
+        return executor.submit(fetch, token, remaining)
+
+    fetched = 0
+    try:
+        future = submit(None, limit)
+        while future is not None:
+            resp = future.result()
+            ids = [m['id'] for m in resp.get('messages', [])]
+            if limit is not None:
+                ids = ids[:limit - fetched]
+            fetched += len(ids)
+            token = resp.get('nextPageToken')
+            future = None
+            if token and (limit is None or fetched < limit):
+                future = submit(token, None if limit is None else limit - fetched)
+            for mid in ids:
+                yield mid
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def get_message(service, msg_id, mirror=None):
+    """Fetch message payload (full format), from mirror when it has the message."""
+    if mirror is not None:
+        msg = mirror.get(msg_id)
+        if msg is not None:
+            return msg
+    msg = execute(service, service.users().messages().get(userId='me', id=msg_id, format='full'), 'messages.get')
+    if mirror is not None:
+        mirror.store([msg])
+    return msg
+
+def execute_batched(service, keys, make_request, batch_size=DEFAULT_BATCH_SIZE, max_retries=3,
+                    method='messages.get'):
+    """
+    Run make_request(key) for every key through Gmail batch requests
+    (one HTTP round trip per batch_size calls), paced by the quota scheduler
+    (each call in a batch costs QUOTA_UNITS[method]).
+    - Returns responses in the same order as keys.
+    - Calls failing with a transient error (429 / 5xx / rate limit) are retried
+      in a later batch with jittered exponential backoff honoring Retry-After.
+    - Calls that still fail (or fail permanently, e.g. 404) are returned as None.
+    """
+    scheduler = get_quota_scheduler(service)
+    keys = list(keys)
+    batch_size = max(1, min(int(batch_size), MAX_BATCH_SIZE))
+    results = [None] * len(keys)
+    pending = list(range(len(keys)))
+    attempt = 0
+    while pending:
+        retry = []
+        retry_after = []
+
+        def callback(request_id, response, exception):
+            idx = int(request_id)
+            if exception is None:
+                results[idx] = response
+            elif _is_retryable(exception):
+                retry.append(idx)
+                retry_after.append(_retry_after(exception))
 
-def get_message(service, msg_id):
-    """Fetch message payload (full format)."""
-    return service.users().messages().get(userId='me', id=msg_id, format='full').execute()
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for idx in chunk:
+                batch.add(make_request(keys[idx]), request_id=str(idx))
+            scheduler.acquire(QUOTA_UNITS.get(method, 5) * len(chunk))
+            try:
+                batch.execute()
+            except HttpError as e:
+                # the whole batch was rejected (e.g. 429): retry all of it
+                if not _is_retryable(e):
+                    raise
+                retry.extend(chunk)
+                retry_after.append(_retry_after(e))
 
-def extract_plain_text_from_message(msg):
+        if not retry or attempt >= max_retries:
+            break
+        delay = backoff_delay(attempt, max((r for r in retry_after if r is not None), default=None))
+        scheduler.pause(delay)
+        time.sleep(delay)
+        attempt += 1
+        pending = sorted(retry)
+    return results
+
+def get_messages(service, ids, format='full', batch_size=DEFAULT_BATCH_SIZE, max_retries=3, mirror=None,
+                 metadata_headers=None):
+    """
+    Fetch many messages with Gmail batch requests (see execute_batched).
+    - Returns message resources in the same order as ids; None for messages
+      that could not be fetched.
+    - mirror: optional MailboxMirror serving full-format messages it already holds;
+      only the misses are fetched (and then stored in it).
+    - metadata_headers: with format='metadata', only return these headers.
+    """
+    ids = list(ids)
+    kwargs = {'metadataHeaders': list(metadata_headers)} if metadata_headers else {}
+
+    def make_request(msg_id):
+        return service.users().messages().get(userId='me', id=msg_id, format=format, **kwargs)
+
+    if mirror is None or format != 'full':
+        return execute_batched(service, ids, make_request, batch_size=batch_size, max_retries=max_retries)
+    results = mirror.get_many(ids)
+    missing = [idx for idx, msg in enumerate(results) if msg is None]
+    if missing:
+        fetched = execute_batched(service, [ids[idx] for idx in missing], make_request,
+                                  batch_size=batch_size, max_retries=max_retries)
+        for idx, msg in zip(missing, fetched):
+            results[idx] = msg
+        mirror.store([msg for msg in fetched if msg is not None])
+    return results
+
+def iter_messages(service, ids, format='full', batch_size=DEFAULT_BATCH_SIZE, mirror=None, metadata_headers=None):
+    """
+    Yield (id, message) pairs for an iterable of ids (e.g. iter_message_ids),
+    fetching batch_size messages per batch request so work can start on the
+    first batch while later ids are still being listed. message is None if
+    it could not be fetched.
+    """
+    ids = iter(ids)
+    while True:
+        chunk = list(islice(ids, batch_size))
+        if not chunk:
+            return
+        msgs = get_messages(service, chunk, format=format, batch_size=batch_size, mirror=mirror,
+                            metadata_headers=metadata_headers)
+        for mid, msg in zip(chunk, msgs):
+            yield mid, msg
+
+def iter_history(service, start_history_id, history_types=None, label_id=None):
+    """
+    Yield history records (users().history().list) newer than start_history_id,
+    following pages (only changes touching label_id, if given). Raises HttpError
+    404 when start_history_id is too old and a full sync is required.
+    """
+    token = None
+    while True:
+        kwargs = {'userId': 'me', 'startHistoryId': str(start_history_id), 'maxResults': MAX_PAGE_SIZE}
+        if history_types:
+            kwargs['historyTypes'] = list(history_types)
+        if label_id:
+            kwargs['labelId'] = label_id
+        if token:
+            kwargs['pageToken'] = token
+        resp = execute(service, service.users().history().list(**kwargs), 'history.list')
+        for record in resp.get('history', []):
+            yield record
+        token = resp.get('nextPageToken')
+        if not token:
+            return
+
+def _is_retryable(exc, method=None):
+    """True for transient Gmail API errors worth retrying (for method, when given)."""
+    if not isinstance(exc, HttpError):
+        return False
+    status = getattr(exc.resp, 'status', None)
+    if method in NON_IDEMPOTENT_METHODS and status is not None and status >= 500:
+        return False
+    if status in RETRYABLE_STATUSES:
+        return True
+    # per-user rate limits come back as 403 with a rateLimitExceeded reason
+    return status == 403 and 'ratelimitexceeded' in str(exc).lower()
+
+def extract_plain_text_from_message(msg, max_html_bytes=DEFAULT_HTML_MAX_BYTES, max_chars=None,
+                                    strip_quotes=False, service=None):
     """
     Extract best-effort plain text from a Gmail message payload.
     Handles multipart, text/plain, and text/html fallback.
+    See iter_message_text for the keyword arguments.
+    """
+    return ''.join(iter_message_text(msg, service=service, max_chars=max_chars, strip_quotes=strip_quotes,
+                                     max_html_bytes=max_html_bytes))
+
+def iter_message_text(msg, service=None, max_chars=None, strip_quotes=False,
+                      max_html_bytes=DEFAULT_HTML_MAX_BYTES):
     """
-    payload = msg.get('payload', {})
-    parts = payload.get('parts')
-    if not parts:
-        # single-part message (body in payload['body']['data'])
-        body = payload.get('body', {}).get('data', '')
-        return _safe_base64_decode(body)
+    Lazily yield the text of a message in pieces.
+    - text/plain parts are preferred, else text/html (converted), else the bare body.
+    - Plain parts are base64-decoded a block at a time, and nothing more is
+      decoded once max_chars characters have been yielded.
+    - Bodies Gmail only references by body.attachmentId are fetched through
+      service when reached (skipped when service is None).
+    - strip_quotes drops quoted reply history: '>' lines, <blockquote>s and
+      everything after an "On ... wrote:" / "Original Message" line.
+    """
+    text_parts, html_parts = _text_parts(msg.get('payload', {}))
+    if text_parts:
+        pieces = _iter_plain_parts(msg, text_parts, service)
+    else:
+        datas = (_part_data(msg, p, service) for p in html_parts)
+        skip_tags = _HTML_SKIP_TAGS | {'blockquote'} if strip_quotes else _HTML_SKIP_TAGS
+        pieces = iter([_html_parts_to_text(datas, max_html_bytes, skip_tags=skip_tags)])
+    if strip_quotes:
+        pieces = _strip_quoted(pieces)
+    remaining = max_chars
+    for piece in pieces:
+        if remaining is not None:
+            piece = piece[:remaining]
+            remaining -= len(piece)
+        if piece:
+            yield piece
+        if remaining is not None and remaining <= 0:
+            return
+
+def _text_parts(payload):
+    # single-part message: the body lives in payload['body']
+    if not payload.get('parts'):
+        return ([], [payload]) if payload.get('mimeType') == 'text/html' else ([payload], [])
     # Walk parts to find 'text/plain' first, else 'text/html'
     text_parts = []
     html_parts = []
@@ -62,38 +463,157 @@ def extract_plain_text_from_message(msg):
                 html_parts.append(p)
             elif p.get('parts'):
                 walk(p.get('parts'))
-    walk(parts)
-    if text_parts:
-        return "\n\n".join(_safe_base64_decode(p.get('body', {}).get('data', '')) for p in text_parts)
-    if html_parts:
-        combined = "\n\n".join(_safe_base64_decode(p.get('body', {}).get('data', '')) for p in html_parts)
-        return html_to_text(combined)
+    walk(payload['parts'])
     # fallback: try direct body
-    body = payload.get('body', {}).get('data', '')
-    return html_to_text(_safe_base64_decode(body))
+    return text_parts, html_parts or ([] if text_parts else [payload])
 
-def _safe_base64_decode(data):
+def _part_data(msg, part, service=None):
+    body = part.get('body', {})
+    if body.get('data') or not body.get('attachmentId') or service is None:
+        return body.get('data', '')
+    # large bodies are stored like attachments; download only when actually read
+    req = service.users().messages().attachments().get(userId='me', messageId=msg['id'], id=body['attachmentId'])
+    return execute(service, req, 'messages.attachments.get').get('data', '')
+
+def _iter_plain_parts(msg, parts, service):
+    for i, part in enumerate(parts):
+        if i:
+            yield "\n\n"
+        yield from _iter_base64_text(_part_data(msg, part, service))
+
+def _iter_base64_text(data, block=TEXT_DECODE_BLOCK):
+    # decode block by block so an abandoned iteration never decodes the rest
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for start in range(0, len(data), block):
+        chunk = data[start:start + block]
+        final = start + block >= len(data)
+        if final and len(chunk) % 4:
+            chunk += "=" * (4 - len(chunk) % 4)
+        try:
+            raw = base64.urlsafe_b64decode(chunk)
+        except Exception:
+            # misaligned (e.g. stray whitespace): decode the rest in one go
+            yield decoder.decode(_decode_base64_bytes(data[start:]), final=True)
+            return
+        text = decoder.decode(raw, final=final)
+        if text:
+            yield text
+
+def _strip_quoted(pieces):
+    """Filter a stream of text pieces line by line, dropping quoted reply history."""
+    pending = ''
+    held = None
+    for piece in pieces:
+        lines = (pending + piece).split('\n')
+        pending = lines.pop()
+        out = []
+        for line in lines:
+            if held is not None:
+                # attributions are often wrapped: "On Mon, ... Alice <" / "alice@x.com> wrote:"
+                if _QUOTE_HEADER_RE.match(held.strip() + ' ' + line.strip()):
+                    if out:
+                        yield ''.join(out)
+                    return
+                out.append(held + '\n')
+                held = None
+            stripped = line.strip()
+            if _QUOTE_HEADER_RE.match(stripped):
+                if out:
+                    yield ''.join(out)
+                return
+            if stripped.startswith('On ') and not stripped.endswith(':'):
+                held = line
+            elif not stripped.startswith('>'):
+                out.append(line + '\n')
+        if out:
+            yield ''.join(out)
+    if held is not None:
+        if _QUOTE_HEADER_RE.match(held.strip() + ' ' + pending.strip()):
+            return
+        yield held + '\n'
+    stripped = pending.strip()
+    if pending and not _QUOTE_HEADER_RE.match(stripped) and not stripped.startswith('>'):
+        yield pending
+
+def _html_parts_to_text(datas, max_bytes=None, skip_tags=_HTML_SKIP_TAGS):
+    # feed the parts one after another instead of concatenating them first
+    extractor = _HTMLTextExtractor(skip_tags)
+    budget = max_bytes
+    for i, data in enumerate(datas):
+        raw = _decode_base64_bytes(data, max_bytes=budget)
+        if i:
+            extractor.feed("\n\n")
+        extractor.feed(raw.decode('utf-8', errors='replace'))
+        if budget is not None:
+            budget -= len(raw)
+            # stop before pulling (and possibly downloading) the next part
+            if budget <= 0:
+                break
+    return extractor.text()
+
+def _decode_base64_bytes(data, max_bytes=None):
     if not data:
-        return ''
+        return b''
+    if max_bytes is not None:
+        # every 4 base64 characters carry 3 bytes: only decode what the cap allows
+        data = data[:-(-max_bytes // 3) * 4]
     data = data.replace('-', '+').replace('_', '/')
     padding = len(data) % 4
     if padding:
         data += "=" * (4 - padding)
     try:
-        decoded = base64.b64decode(data).decode('utf-8', errors='replace')
-        return decoded
+        raw = base64.b64decode(data)
     except Exception:
-        return ''
+        return b''
+    return raw if max_bytes is None else raw[:max_bytes]
+
+def _safe_base64_decode(data):
+    return _decode_base64_bytes(data).decode('utf-8', errors='replace')
+
+class _HTMLTextExtractor(HTMLParser):
+    """
+    Streaming HTML -> text: collects text nodes as the tokenizer emits them,
+    without building a tree, and drops everything inside skip_tags.
+    """
+
+    def __init__(self, skip_tags=_HTML_SKIP_TAGS):
+        super().__init__(convert_charrefs=True)
+        self.skip_tags = skip_tags
+        self._chunks = []
+        self._skipping = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self._skipping.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        pass
 
-def html_to_text(html):
+    def handle_endtag(self, tag):
+        if tag in self._skipping:
+            while self._skipping.pop() != tag:
+                pass
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._chunks.append(data)
+
+    def text(self):
+        self.close()
+        # one text node per line, whitespace collapsed, blank lines dropped
+        lines = (line.strip() for line in '\n'.join(self._chunks).splitlines())
+        return '\n'.join(ln for ln in lines if ln)
+
+def html_to_text(html, max_bytes=None):
+    """
+    Convert HTML to plain text (one line per text node, script/style/template dropped;
+    the <title> is kept, as the BeautifulSoup version did).
+    - max_bytes: only the first max_bytes of UTF-8 input are parsed.
+    """
     if not html:
         return ''
-    soup = BeautifulSoup(html, 'html.parser')
-    # remove scripts/styles
-    for s in soup(['script', 'style']):
-        s.decompose()
-    text = soup.get_text(separator='\n')
-    # collapse whitespace
-    lines = [line.strip() for line in text.splitlines()]
-    cleaned = '\n'.join([ln for ln in lines if ln])
-    return cleaned
+    if max_bytes is not None and len(html) > max_bytes:
+        html = html.encode('utf-8')[:max_bytes].decode('utf-8', errors='ignore')
+    extractor = _HTMLTextExtractor()
+    extractor.feed(html)
+    return extractor.text()
@@ -31,19 +31,26 @@ class App:
     def fetch_summarize(self):
         try:
             self.status.config(text="Fetching messages...")
-            from gmail_utils import get_gmail_service, list_message_ids, get_message, extract_plain_text_from_message
+            from gmail_utils import get_gmail_service, iter_message_ids, iter_messages, extract_plain_text_from_message, SUMMARY_MAX_CHARS
             from summarizers import extractive_summarize
+            from summary_cache import SummaryCache, summary_params
+            cache = SummaryCache()
+            params = summary_params('extractive', max_sentences=3)
             service = get_gmail_service()
-            ids = list_message_ids(service, query='is:unread', max_results=5)
-            if not ids:
-                self.out.insert(tk.END, "No unread messages found.\n")
-            for mid in ids:
-                msg = get_message(service, mid)
-                text = extract_plain_text_from_message(msg)
-                summary = extractive_summarize(text, max_sentences=3)
+            ids = iter_message_ids(service, query='is:unread', limit=5)
+            seen = 0
+            for mid, msg in iter_messages(service, ids):
+                seen += 1
+                if msg is None:
+                    continue
+                text = extract_plain_text_from_message(msg, max_chars=SUMMARY_MAX_CHARS, strip_quotes=True, service=service)
+                summary = cache.summarize(text, 'extractive', params,
+                                          lambda t: extractive_summarize(t, max_sentences=3))
                 self.out.insert(tk.END, "="*60 + "\n")
                 self.out.insert(tk.END, f"Message ID: {mid}\n")
                 self.out.insert(tk.END, f"Summary:\n{summary}\n\n")
+            if not seen:
+                self.out.insert(tk.END, "No unread messages found.\n")
             self.status.config(text="Done fetching.")
         except Exception as e:
             messagebox.showerror("Error", str(e))
@@ -54,9 +61,11 @@ class App:
         try:
             self.status.config(text="Running auto-responder (dry-run)...")
             from auto_responder import process_unreplied
+            from thread_state import ThreadStateCache
             from gmail_utils import get_gmail_service
             service = get_gmail_service()
-            res = process_unreplied(service, query='is:unread', reply_template=None, max_results=5, dry_run=True)
+            res = process_unreplied(service, query='is:unread', reply_template=None, max_results=5, dry_run=True,
+                                    thread_cache=ThreadStateCache())
             self.out.insert(tk.END, "Auto-responder dry-run results:\n")
             self.out.insert(tk.END, str(res) + "\n")
             self.status.config(text="Auto-responder dry-run complete.")
@@ -71,9 +80,11 @@ class App:
                 return
             self.status.config(text="Running auto-responder (sending)...")
             from auto_responder import process_unreplied
+            from thread_state import ThreadStateCache
             from gmail_utils import get_gmail_service
             service = get_gmail_service()
-            res = process_unreplied(service, query='is:unread', reply_template=None, max_results=5, dry_run=False)
+            res = process_unreplied(service, query='is:unread', reply_template=None, max_results=5, dry_run=False,
+                                    thread_cache=ThreadStateCache())
             self.out.insert(tk.END, "Auto-responder sent results:\n")
             self.out.insert(tk.END, str(res) + "\n")
             self.status.config(text="Auto-responder send complete.")
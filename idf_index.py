@@ -0,0 +1,72 @@
+# idf_index.py
+import math
+import os
+import sqlite3
+import threading
+from summarizers import document_terms
+
+DEFAULT_IDF_PATH = os.path.join('.cache', 'idf.sqlite3')
+# summarizer modes that weight words with the IDF table
+IDF_MODES = ('tfidf', 'textrank')
+
+
+class IDFIndex:
+    """
+    Corpus-level document frequencies (SQLite) for the tfidf/textrank summaries.
+    add_documents() counts each message once, by id, so the table grows
+    incrementally as runs see new mail; weights() turns the counts into
+    smoothed IDF weights: ln((1 + N) / (1 + df)) + 1.
+    """
+
+    def __init__(self, path=DEFAULT_IDF_PATH):
+        self.path = path
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS df (term TEXT PRIMARY KEY, df INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY)")
+        self._conn.commit()
+
+    @property
+    def n_docs(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add_documents(self, docs):
+        """Count the terms of (doc_id, text) pairs not seen before; returns how many were new."""
+        added = 0
+        with self._lock:
+            for doc_id, text in docs:
+                if self._conn.execute("INSERT OR IGNORE INTO docs (doc_id) VALUES (?)", (doc_id,)).rowcount == 0:
+                    continue
+                self._conn.executemany(
+                    "INSERT INTO df (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(t,) for t in document_terms(text)]
+                )
+                added += 1
+            self._conn.commit()
+        return added
+
+    def weights(self, terms):
+        """Return {term: idf} for terms; terms never seen get the highest weight."""
+        terms = list(dict.fromkeys(terms))
+        df = {}
+        with self._lock:
+            n = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            for start in range(0, len(terms), 500):
+                chunk = terms[start:start + 500]
+                df.update(self._conn.execute(
+                    "SELECT term, df FROM df WHERE term IN (%s)" % ','.join('?' * len(chunk)), chunk
+                ).fetchall())
+        return {t: math.log((1 + n) / (1 + df.get(t, 0))) + 1 for t in terms}
+
+    def stats(self):
+        with self._lock:
+            docs = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            terms = self._conn.execute("SELECT COUNT(*) FROM df").fetchone()[0]
+        return {'documents': docs, 'terms': terms}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
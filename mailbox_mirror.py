@@ -0,0 +1,268 @@
+# mailbox_mirror.py
+import calendar
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from googleapiclient.errors import HttpError
+from gmail_utils import execute, iter_message_ids, iter_messages, get_messages, iter_history, extract_plain_text_from_message
+
+DEFAULT_MIRROR_PATH = os.path.join('.cache', 'mailbox.sqlite3')
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# Gmail leaves these out of messages().list unless asked for explicitly
+HIDDEN_LABELS = ('SPAM', 'TRASH')
+_AGE_UNITS = {'d': 86400, 'm': 86400 * 30, 'y': 86400 * 365}
+
+
+class MailboxMirror:
+    """
+    Local copy of the mailbox (SQLite): full message resources plus headers,
+    extracted text, labels, threadId and internalDate.
+    The first sync() downloads everything; later syncs replay only the changes
+    reported by users().history().list since the stored historyId.
+    Pass it as mirror= to gmail_utils' list/get helpers to serve reads locally.
+    """
+
+    def __init__(self, path=DEFAULT_MIRROR_PATH):
+        self.path = path
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id TEXT PRIMARY KEY, thread_id TEXT, internal_date INTEGER, label_ids TEXT,"
+            " headers TEXT, text TEXT, resource TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_internal_date ON messages (internal_date)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    # ---------- state ----------
+    @property
+    def history_id(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = 'history_id'").fetchone()
+        return row[0] if row else None
+
+    def _set_history_id(self, history_id):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('history_id', ?)",
+                               (str(history_id),))
+            self._conn.commit()
+
+    # ---------- reads ----------
+    def get(self, msg_id):
+        """Return the stored full-format message resource, or None."""
+        return self.get_many([msg_id])[0]
+
+    def get_many(self, ids):
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT id, label_ids, resource FROM messages WHERE id IN (%s)" % ','.join('?' * len(chunk)),
+                    chunk
+                ).fetchall()
+                for mid, label_ids, resource in rows:
+                    msg = json.loads(resource)
+                    msg['labelIds'] = json.loads(label_ids)
+                    found[mid] = msg
+        return [found.get(mid) for mid in ids]
+
+    def get_text(self, msg_id):
+        """Return the extracted plain text stored for msg_id, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM messages WHERE id = ?", (msg_id,)).fetchone()
+        return row[0] if row else None
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    # ---------- writes ----------
+    def store(self, msgs):
+        """Insert or replace full-format message resources."""
+        rows = []
+        for msg in msgs:
+            headers = msg.get('payload', {}).get('headers', [])
+            rows.append((
+                msg['id'], msg.get('threadId'), int(msg.get('internalDate', '0') or 0),
+                json.dumps(msg.get('labelIds', [])),
+                json.dumps({h['name'].lower(): h['value'] for h in headers}),
+                extract_plain_text_from_message(msg), json.dumps(msg)
+            ))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (id, thread_id, internal_date, label_ids, headers, text, resource)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM messages WHERE id = ?", [(mid,) for mid in ids])
+            self._conn.commit()
+
+    def update_labels(self, msg_id, add=(), remove=()):
+        """Apply a label change to a stored message (no-op if it is not mirrored)."""
+        with self._lock:
+            row = self._conn.execute("SELECT label_ids FROM messages WHERE id = ?", (msg_id,)).fetchone()
+            if row is None:
+                return
+            labels = [lab for lab in json.loads(row[0]) if lab not in remove]
+            labels += [lab for lab in add if lab not in labels]
+            self._conn.execute("UPDATE messages SET label_ids = ? WHERE id = ?", (json.dumps(labels), msg_id))
+            self._conn.commit()
+
+    # ---------- sync ----------
+    def sync(self, service, full_sync_query=None):
+        """
+        Bring the mirror up to date. Does a full sync the first time (or when the
+        stored historyId has expired), otherwise applies history deltas only.
+        full_sync_query optionally limits what the initial download covers.
+        Returns a dict describing what changed.
+        """
+        history_id = self.history_id
+        if history_id is None:
+            return self.full_sync(service, query=full_sync_query)
+        try:
+            return self._incremental_sync(service, history_id)
+        except HttpError as e:
+            if getattr(e.resp, 'status', None) == 404:
+                return self.full_sync(service, query=full_sync_query)
+            raise
+
+    def full_sync(self, service, query=None):
+        # take the historyId first so changes made during the download are replayed next time
+        profile = execute(service, service.users().getProfile(userId='me'), 'getProfile')
+        with self._lock:
+            self._conn.execute("DELETE FROM messages")
+            self._conn.commit()
+        added = 0
+        batch = []
+        for _, msg in iter_messages(service, iter_message_ids(service, query=query)):
+            if msg is None:
+                continue
+            batch.append(msg)
+            if len(batch) >= 100:
+                self.store(batch)
+                added += len(batch)
+                batch = []
+        self.store(batch)
+        added += len(batch)
+        self._set_history_id(profile['historyId'])
+        return {'mode': 'full', 'added': added, 'deleted': 0, 'label_changes': 0}
+
+    def _incremental_sync(self, service, history_id):
+        added, deleted = [], set()
+        label_changes = 0
+        latest = int(history_id)
+        for record in iter_history(service, history_id, history_types=HISTORY_TYPES):
+            latest = max(latest, int(record.get('id', 0)))
+            for item in record.get('messagesAdded', []):
+                added.append(item['message']['id'])
+            for item in record.get('messagesDeleted', []):
+                deleted.add(item['message']['id'])
+            for item in record.get('labelsAdded', []):
+                self.update_labels(item['message']['id'], add=item.get('labelIds', []))
+                label_changes += 1
+            for item in record.get('labelsRemoved', []):
+                self.update_labels(item['message']['id'], remove=item.get('labelIds', []))
+                label_changes += 1
+        to_fetch = list(dict.fromkeys(mid for mid in added if mid not in deleted))
+        fetched = [m for m in get_messages(service, to_fetch) if m is not None] if to_fetch else []
+        self.store(fetched)
+        self.delete(deleted)
+        self._set_history_id(latest)
+        return {'mode': 'incremental', 'added': len(fetched), 'deleted': len(deleted),
+                'label_changes': label_changes}
+
+    # ---------- local query evaluation ----------
+    def can_answer(self, query):
+        """True if query only uses operators the mirror evaluates locally."""
+        return _parse_query(query) is not None
+
+    def iter_ids(self, query=None, limit=None):
+        """Yield ids matching query, newest first (like messages().list)."""
+        rules = _parse_query(query)
+        if rules is None:
+            raise ValueError(f"query not supported by the local mirror: {query!r}")
+        sql = "SELECT id, label_ids FROM messages WHERE internal_date >= ? AND internal_date < ?"
+        params = (rules['after_ms'], rules['before_ms'])
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY internal_date DESC", params).fetchall()
+        n = 0
+        for mid, label_ids in rows:
+            if limit is not None and n >= limit:
+                return
+            labels = set(json.loads(label_ids))
+            if any(lab not in labels for lab in rules['with']) or any(lab in labels for lab in rules['without']):
+                continue
+            if not rules['include_hidden'] and labels.intersection(HIDDEN_LABELS):
+                continue
+            n += 1
+            yield mid
+
+
+def _parse_date_ms(value):
+    # Gmail accepts after:/before: as YYYY/MM/DD (or YYYY-MM-DD) or as epoch seconds.
+    # Dates are taken as UTC midnight here, while Gmail uses the account's timezone.
+    if value.isdigit():
+        return int(value) * 1000
+    m = re.match(r'^(\d{4})[/-](\d{1,2})[/-](\d{1,2})$', value)
+    if not m:
+        return None
+    return calendar.timegm((int(m.group(1)), int(m.group(2)), int(m.group(3)), 0, 0, 0)) * 1000
+
+
+def _parse_query(query, exact=True):
+    """
+    Translate the small subset of Gmail search syntax the mirror supports
+    (is:unread/read/starred/important, in:inbox/sent, after:, before:,
+    newer_than:, older_than:) into filter rules. Returns None for anything else.
+    - after:/before: are only answered as epoch seconds; date forms are resolved
+      in the account's timezone by Gmail, so those queries go to Gmail.
+    - exact=False also accepts date forms (as UTC midnight) and in:spam/trash,
+      which the mirror cannot answer (full_sync leaves spam and trash out) but an
+      in-memory mailbox can.
+    """
+    rules = {'with': set(), 'without': set(), 'after_ms': 0, 'before_ms': 2 ** 62, 'include_hidden': False}
+    now_ms = int(time.time() * 1000)
+    for term in (query or '').split():
+        key, _, value = term.lower().partition(':')
+        if key == 'is' and value in ('unread', 'starred', 'important'):
+            rules['with'].add(value.upper())
+        elif key == 'is' and value == 'read':
+            rules['without'].add('UNREAD')
+        elif key == 'in' and value in ('inbox', 'sent'):
+            rules['with'].add(value.upper())
+        elif key == 'in' and value in ('spam', 'trash') and not exact:
+            rules['with'].add(value.upper())
+            rules['include_hidden'] = True
+        elif key in ('after', 'before'):
+            ms = _parse_date_ms(value)
+            if ms is None or (exact and not value.isdigit()):
+                return None
+            if key == 'after':
+                rules['after_ms'] = max(rules['after_ms'], ms)
+            else:
+                rules['before_ms'] = min(rules['before_ms'], ms)
+        elif key in ('newer_than', 'older_than'):
+            m = re.match(r'^(\d+)([dmy])$', value)
+            if not m:
+                return None
+            ms = now_ms - int(m.group(1)) * _AGE_UNITS[m.group(2)] * 1000
+            if key == 'newer_than':
+                rules['after_ms'] = max(rules['after_ms'], ms)
+            else:
+                rules['before_ms'] = min(rules['before_ms'], ms)
+        else:
+            return None
+    return rules
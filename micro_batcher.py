@@ -0,0 +1,110 @@
+# micro_batcher.py
+import asyncio
+
+
+class QueueFull(Exception):
+    """Raised by MicroBatcher.submit when accepting the texts would exceed max_queue."""
+
+
+class MicroBatcher:
+    """
+    Funnel concurrent requests into batched calls of a blocking batch function.
+    - submit(texts) queues each text and waits for its result; texts from
+      different requests end up in the same fn(batch) call.
+    - The worker takes up to max_batch_size texts, waiting at most max_wait_ms
+      after the first one for more to arrive, and runs fn in a thread (one
+      batch at a time: meanwhile the next batch fills up).
+    - Backpressure: submit raises QueueFull once max_queue texts are waiting.
+    - Requests that time out (or whose client went away) are dropped from the
+      queue instead of being computed.
+    """
+
+    def __init__(self, fn, max_batch_size=16, max_wait_ms=10, max_queue=256):
+        self.fn = fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self._queue = None
+        self._worker = None
+        self.batches = 0
+        self.items = 0
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start the worker on the running event loop (submit does it on first use)."""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, texts, timeout=None):
+        """
+        Return fn's results for texts (in order). Raises QueueFull when the
+        queue is full and asyncio.TimeoutError after timeout seconds.
+        """
+        self.start()
+        texts = list(texts)
+        if self._queue.qsize() + len(texts) > self.max_queue:
+            raise QueueFull(f"{self._queue.qsize()} texts already waiting (max {self.max_queue})")
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            fut = loop.create_future()
+            self._queue.put_nowait((text, fut))
+            futures.append(fut)
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures), timeout)
+        except BaseException:
+            for fut in futures:
+                fut.cancel()
+            raise
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return [(text, fut) for text, fut in batch if not fut.done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                results = await asyncio.to_thread(self.fn, [text for text, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    def stats(self):
+        return {'pending': self.pending, 'batches': self.batches, 'items': self.items,
+                'avg_batch': round(self.items / self.batches, 2) if self.batches else 0.0}
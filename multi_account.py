@@ -0,0 +1,154 @@
+# multi_account.py
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from googleapiclient.discovery import build
+from gmail_utils import get_credentials, set_quota_scheduler, QuotaScheduler, DEFAULT_UNITS_PER_SECOND
+from auto_responder import process_unreplied, ensure_label
+from summary_cache import SummaryCache
+from thread_state import ThreadStateCache
+import summarizer
+
+
+def discover_token_files(paths):
+    """Expand directories to the *.json token files inside them; keep files as given."""
+    tokens = []
+    for p in paths:
+        if os.path.isdir(p):
+            tokens.extend(sorted(glob.glob(os.path.join(p, '*.json'))))
+        else:
+            tokens.append(p)
+    return tokens
+
+
+def _account_name(token_path):
+    return os.path.splitext(os.path.basename(token_path))[0]
+
+
+def run_account(token_path, task, opts, summarizer_args=None):
+    """
+    Process one mailbox and return its report dict. Runs in a worker thread or
+    process; every account gets its own service and its own quota bucket, since
+    Gmail's per-user limit applies to each mailbox separately.
+    """
+    started = time.time()
+    report = {'account': _account_name(token_path), 'token': token_path, 'task': task, 'ok': False}
+    try:
+        creds = get_credentials(opts['credentials'], token_path, interactive=False)
+        service = build('gmail', 'v1', credentials=creds)
+        set_quota_scheduler(service, QuotaScheduler(opts['quota_units_per_second']))
+        thread_cache_path = os.path.join('.cache', f"threads-{report['account']}.sqlite3")
+
+        if task == 'auto-reply':
+            results = process_unreplied(service, query=opts['query'], max_results=opts['max_results'],
+                                        min_age_seconds=opts['min_age_seconds'], label_name=opts['label_name'],
+                                        dry_run=opts['dry_run'], thread_cache=ThreadStateCache(thread_cache_path))
+            counts = Counter(r.get('action') or 'skipped:' + r.get('skipped', '?') for r in results)
+        else:
+            args = summarizer_args
+            label_id = ensure_label(service, label_name=args.label_name) if args.triage else None
+            cache = None if args.no_cache else SummaryCache()
+            results = []
+            for mid, msg, _, summary in summarizer.iter_summaries(service, args, label_id, cache=cache, creds=creds):
+                if msg is None:
+                    results.append({'id': mid, 'skipped': 'fetch_failed'})
+                else:
+                    results.append({'id': mid, 'summary': summary})
+            counts = Counter('summarized' if 'summary' in r else 'skipped:' + r['skipped'] for r in results)
+
+        report.update(ok=True, counts=dict(counts), results=results)
+    except Exception as e:
+        report['error'] = f"{type(e).__name__}: {e}"
+    report['elapsed_seconds'] = round(time.time() - started, 2)
+    return report
+
+
+def run_accounts(token_paths, task, opts, summarizer_args=None, workers=4, processes=False):
+    """Run task over all accounts concurrently; returns reports in token_paths order."""
+    pool_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    reports = {}
+    with pool_cls(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(run_account, t, task, opts, summarizer_args): t for t in token_paths}
+        for fut in as_completed(futures):
+            report = fut.result()
+            reports[futures[fut]] = report
+            status = 'ok' if report['ok'] else 'FAILED: ' + report.get('error', '')
+            print(f"[{report['account']}] {status} ({report['elapsed_seconds']}s) {report.get('counts', '')}")
+    return [reports[t] for t in token_paths]
+
+
+def summarize_reports(reports):
+    """Aggregate per-account reports into one summary dict."""
+    totals = Counter()
+    for r in reports:
+        totals.update(r.get('counts', {}))
+    return {
+        'accounts': len(reports),
+        'succeeded': sum(1 for r in reports if r['ok']),
+        'failed': [r['account'] for r in reports if not r['ok']],
+        'totals': dict(totals),
+        'slowest_seconds': max((r['elapsed_seconds'] for r in reports), default=0),
+    }
+
+
+def main(args, summarizer_argv):
+    token_paths = discover_token_files(args.tokens)
+    if not token_paths:
+        print("No token files found.")
+        return
+    summarizer_args = summarizer.build_parser().parse_args(summarizer_argv) if args.task == 'summarize' else None
+    if summarizer_args is not None and summarizer_args.async_io:
+        print("Note: --async-io is ignored for multi-account runs (quota is paced per account service).")
+        summarizer_args.async_io = False
+    opts = {
+        'credentials': args.credentials,
+        'quota_units_per_second': args.quota_units_per_second,
+        'query': args.query,
+        'max_results': args.max_results,
+        'min_age_seconds': args.min_age_seconds,
+        'label_name': args.label_name,
+        'dry_run': args.dry_run,
+    }
+    started = time.time()
+    reports = run_accounts(token_paths, args.task, opts, summarizer_args=summarizer_args,
+                           workers=args.workers, processes=args.processes)
+    summary = summarize_reports(reports)
+    summary['wall_seconds'] = round(time.time() - started, 2)
+    print("=" * 60)
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'summary': summary, 'accounts': reports}, f, indent=2)
+        print("Full report written to", args.report)
+
+
+if __name__ == "__main__":
+    argv, summarizer_argv = sys.argv[1:], []
+    if '--' in argv:
+        argv, summarizer_argv = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+    parser = argparse.ArgumentParser(
+        description="Run the auto-responder or summarizer over many mailboxes concurrently. "
+                    "Arguments after -- are passed to summarizer.py (summarize task).")
+    parser.add_argument('--tokens', nargs='+', required=True,
+                        help='Authorized token.json files, or directories containing them (one per mailbox)')
+    parser.add_argument('--credentials', type=str, default='credentials.json')
+    parser.add_argument('--task', choices=['auto-reply', 'summarize'], default='auto-reply')
+    parser.add_argument('--workers', type=int, default=8, help='Mailboxes processed concurrently')
+    parser.add_argument('--processes', action='store_true',
+                        help='Use a process pool instead of threads (better for CPU-heavy summarization)')
+    parser.add_argument('--quota-units-per-second', type=float, default=DEFAULT_UNITS_PER_SECOND,
+                        help='Gmail quota budget per mailbox')
+    parser.add_argument('--query', type=str, default='is:unread')
+    parser.add_argument('--max-results', type=int, default=20)
+    parser.add_argument('--min-age-seconds', type=int, default=60*60*6)
+    parser.add_argument('--label-name', type=str, default='AutoReplied')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=True)
+    parser.add_argument('--no-dry-run', dest='dry_run', action='store_false')
+    parser.add_argument('--report', type=str, default=None, help='Write the full JSON report here')
+    args = parser.parse_args(argv)
+    main(args, summarizer_argv)
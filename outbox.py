@@ -0,0 +1,295 @@
+# outbox.py
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from gmail_utils import (
+    get_gmail_service, configure_quota, DEFAULT_UNITS_PER_SECOND, execute, backoff_delay, _new_http
+)
+from auto_responder import (
+    ensure_label, add_label, make_reply_to, is_thread_replied, DEFAULT_SEND_CONCURRENCY
+)
+
+DEFAULT_OUTBOX_PATH = os.path.join('.cache', 'outbox.sqlite3')
+DEFAULT_MAX_ATTEMPTS = 5
+# a job left 'sending' this long belongs to a drain that died mid-send
+SENDING_TIMEOUT_SECONDS = 600
+
+# job states:
+#   pending -> sending -> sent -> done      (done = reply sent AND original labelled)
+#   pending -> sending -> pending (retry later) ... -> failed (after max_attempts)
+
+
+class Outbox:
+    """
+    Persistent queue of auto-replies (SQLite), keyed by the id of the message
+    being replied to, so a reply is enqueued and sent at most once however
+    often the producer sees the message - and at most once per thread.
+    - enqueue() stores the ready-to-send reply; generation and sending are decoupled.
+    - drain() sends due jobs concurrently, retrying failures with backoff, and
+      marks a job done only once the original message carries the label.
+    - A crash between send and label leaves the job 'sent': the next drain
+      only labels it. A crash mid-send leaves it 'sending': the next drain
+      checks the thread for a reply before deciding to send again.
+    """
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " msg_id TEXT PRIMARY KEY, thread_id TEXT, raw TEXT NOT NULL, state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, claim TEXT, claimed_at REAL,"
+            " sent_id TEXT, last_error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_attempt_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_thread ON outbox (thread_id)")
+        self._conn.commit()
+
+    # ---------- producer side ----------
+    def enqueue(self, orig_msg, reply_text, from_email=None):
+        """
+        Queue a reply to orig_msg. Returns None when queued, else why not:
+        'already_in_outbox' (this message) or 'thread_already_queued' (another
+        message of its thread has a live or finished job; failed ones do not count).
+        """
+        raw = make_reply_to(orig_msg, reply_text, from_email=from_email)
+        thread_id = orig_msg.get('threadId')
+        now = time.time()
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM outbox WHERE msg_id = ?", (orig_msg['id'],)).fetchone():
+                return 'already_in_outbox'
+            if thread_id and self._conn.execute("SELECT 1 FROM outbox WHERE thread_id = ? AND state != 'failed'",
+                                                (thread_id,)).fetchone():
+                return 'thread_already_queued'
+            self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (msg_id, thread_id, raw, state, next_attempt_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, 'pending', ?, ?, ?)",
+                (orig_msg['id'], thread_id, raw, now, now, now)
+            )
+            self._conn.commit()
+        return None
+
+    def has(self, msg_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM outbox WHERE msg_id = ?", (msg_id,)).fetchone() is not None
+
+    # ---------- state changes ----------
+    def _set(self, msg_id, **fields):
+        fields['updated_at'] = time.time()
+        cols = ', '.join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE outbox SET {cols} WHERE msg_id = ?", list(fields.values()) + [msg_id])
+            self._conn.commit()
+
+    def _claim(self, limit=None):
+        """Atomically move due pending jobs to 'sending' for this drain; returns [(msg_id, thread_id, raw, attempts)]."""
+        claim, now = uuid.uuid4().hex, time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET state = 'sending', claim = ?, claimed_at = ?, updated_at = ? WHERE msg_id IN ("
+                " SELECT msg_id FROM outbox WHERE state = 'pending' AND next_attempt_at <= ?"
+                " ORDER BY created_at LIMIT ?)",
+                (claim, now, now, now, -1 if limit is None else int(limit))
+            )
+            self._conn.commit()
+            return self._conn.execute(
+                "SELECT msg_id, thread_id, raw, attempts FROM outbox WHERE claim = ? AND state = 'sending'"
+                " ORDER BY created_at", (claim,)
+            ).fetchall()
+
+    def _recover(self, service):
+        """Resolve jobs a dead drain left 'sending': sent if their thread has a reply, else pending again."""
+        cutoff = time.time() - SENDING_TIMEOUT_SECONDS
+        with self._lock:
+            stale = self._conn.execute("SELECT msg_id, thread_id FROM outbox WHERE state = 'sending' AND claimed_at < ?",
+                                       (cutoff,)).fetchall()
+        for msg_id, thread_id in stale:
+            if thread_id and is_thread_replied(service, thread_id):
+                self._set(msg_id, state='sent', claim=None)
+            else:
+                self._set(msg_id, state='pending', claim=None)
+        return len(stale)
+
+    # ---------- consumer side ----------
+    def drain(self, service, label_id=None, concurrency=DEFAULT_SEND_CONCURRENCY, limit=None, thread_cache=None):
+        """
+        Send due jobs (up to limit), concurrency at a time, then label every sent
+        job's original message and mark it done in the same step. Returns one result
+        per job sent or attempted: {'id', 'action': 'sent', 'sent_id'} (plus
+        'label_error' while its label is still missing) or
+        {'id', 'action': 'send_failed', 'error', 'attempts'} ('gave_up': True once
+        max_attempts is reached). A retried job whose thread already has a reply
+        counts as sent (sent_id None): the failed attempt did go out.
+        """
+        self._recover(service)
+        jobs = self._claim(limit)
+        results = []
+        if jobs:
+            local = threading.local()
+
+            def send(job):
+                msg_id, thread_id, raw, attempts = job
+                # an earlier attempt may have failed after Gmail accepted the reply
+                if attempts and thread_id and is_thread_replied(service, thread_id):
+                    return {}
+                if not hasattr(local, 'http'):
+                    local.http = _new_http(service)
+                body = {'raw': raw, 'threadId': thread_id}
+                return execute(service, service.users().messages().send(userId='me', body=body), 'messages.send',
+                               http=local.http)
+
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                futures = [(job, executor.submit(send, job)) for job in jobs]
+                for (msg_id, thread_id, _, attempts), fut in futures:
+                    try:
+                        sent = fut.result()
+                    except Exception as e:
+                        attempts += 1
+                        gave_up = attempts >= self.max_attempts
+                        self._set(msg_id, state='failed' if gave_up else 'pending', attempts=attempts, claim=None,
+                                  next_attempt_at=time.time() + backoff_delay(attempts), last_error=str(e))
+                        result = {'id': msg_id, 'action': 'send_failed', 'error': str(e), 'attempts': attempts}
+                        if gave_up:
+                            result['gave_up'] = True
+                        results.append(result)
+                        continue
+                    # recorded before anything else: from here on the job is never sent again
+                    self._set(msg_id, state='sent', sent_id=sent.get('id'), attempts=attempts + 1, claim=None)
+                    if thread_cache is not None:
+                        thread_cache.put(thread_id, True)
+                    results.append({'id': msg_id, 'action': 'sent', 'sent_id': sent.get('id')})
+        errors = self._label_sent(service, label_id)
+        for r in results:
+            if r['id'] in errors:
+                r['label_error'] = errors[r['id']]
+        return results
+
+    def _label_sent(self, service, label_id):
+        """Label the originals of all 'sent' jobs (including earlier drains') and mark them done; returns {id: error}."""
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute("SELECT msg_id FROM outbox WHERE state = 'sent'")]
+        if not ids:
+            return {}
+        errors = add_label(service, ids, label_id) if label_id else {}
+        done = [mid for mid in ids if mid not in errors]
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("UPDATE outbox SET state = 'done', updated_at = ? WHERE msg_id = ? AND state = 'sent'",
+                                   [(now, mid) for mid in done])
+            for mid, error in errors.items():
+                self._conn.execute("UPDATE outbox SET last_error = ?, updated_at = ? WHERE msg_id = ?",
+                                   (f"label: {error}", now, mid))
+            self._conn.commit()
+        return errors
+
+    def retry_failed(self):
+        """Give 'failed' jobs another max_attempts tries; returns how many were requeued."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute("UPDATE outbox SET state = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ?"
+                                     " WHERE state = 'failed'", (now, now))
+            self._conn.commit()
+        return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxSender:
+    """
+    Drop-in for auto_responder.ReplySender backed by an Outbox: submit()
+    enqueues, flush() drains (or only enqueues when send=False, leaving the
+    sending to `python outbox.py`).
+    """
+
+    def __init__(self, outbox, service, label_id=None, concurrency=DEFAULT_SEND_CONCURRENCY, from_email=None,
+                 thread_cache=None, send=True):
+        self.outbox = outbox
+        self.service = service
+        self.label_id = label_id
+        self.concurrency = concurrency
+        self.from_email = from_email
+        self.thread_cache = thread_cache
+        self.send = send
+        self._submitted = []
+        self._threads = set()
+
+    @property
+    def pending(self):
+        return len(self._submitted)
+
+    def submit(self, orig_msg, reply_text):
+        thread_id = orig_msg.get('threadId')
+        if thread_id in self._threads:
+            self._submitted.append({'id': orig_msg['id'], 'skipped': 'thread_already_queued'})
+            return
+        skipped = self.outbox.enqueue(orig_msg, reply_text, from_email=self.from_email)
+        if skipped is None:
+            self._threads.add(thread_id)
+        self._submitted.append({'id': orig_msg['id'], 'action': 'queued'} if skipped is None
+                               else {'id': orig_msg['id'], 'skipped': skipped})
+
+    def flush(self):
+        submitted, self._submitted = self._submitted, []
+        if not self.send:
+            return submitted
+        sent = self.outbox.drain(self.service, label_id=self.label_id, concurrency=self.concurrency,
+                                 thread_cache=self.thread_cache)
+        return [r for r in submitted if 'skipped' in r] + sent
+
+    def close(self):
+        return self.flush()
+
+
+def main(args):
+    outbox = Outbox(args.outbox, max_attempts=args.max_attempts)
+    if args.retry_failed:
+        print("Requeued failed jobs:", outbox.retry_failed())
+    if args.stats:
+        print("Outbox:", outbox.stats())
+        return
+    configure_quota(args.quota_units_per_second)
+    service = get_gmail_service()
+    label_id = ensure_label(service, label_name=args.label_name)
+    while True:
+        for r in outbox.drain(service, label_id=label_id, concurrency=args.concurrency, limit=args.limit):
+            if r['action'] == 'sent':
+                print(f"Sent reply to {r['id']}: message id {r['sent_id']}" +
+                      (f" (label failed: {r['label_error']})" if 'label_error' in r else ""))
+            else:
+                print(f"Failed to send reply to {r['id']} (attempt {r['attempts']}): {r['error']}" +
+                      (" - giving up" if r.get('gave_up') else ""))
+        print("Outbox:", outbox.stats())
+        if not args.loop:
+            return
+        time.sleep(args.loop)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Send the auto-replies queued in the outbox")
+    parser.add_argument('--outbox', type=str, default=DEFAULT_OUTBOX_PATH)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_SEND_CONCURRENCY, help='Replies sent at the same time')
+    parser.add_argument('--limit', type=int, default=None, help='Send at most N replies per drain (spreads sends out with --loop)')
+    parser.add_argument('--loop', type=float, default=None, help='Keep draining every N seconds')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Give up on a reply after N failed sends')
+    parser.add_argument('--retry-failed', action='store_true', help='Requeue replies that were given up on')
+    parser.add_argument('--stats', action='store_true', help='Only print how many jobs are in each state')
+    parser.add_argument('--label-name', type=str, default='AutoReplied')
+    parser.add_argument('--quota-units-per-second', type=float, default=DEFAULT_UNITS_PER_SECOND)
+    return parser
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
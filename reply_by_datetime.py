@@ -1,8 +1,12 @@
 # reply_by_datetime.py
 import argparse
 import re
-from gmail_utils import get_gmail_service, list_message_ids, get_message, extract_plain_text_from_message
-from summarizers import extractive_summarize, transformer_summarize
+from gmail_utils import get_gmail_service, iter_message_ids, iter_messages, extract_plain_text_from_message, SUMMARY_MAX_CHARS
+from summarizers import extractive_summarize, tfidf_summarize, transformer_summarize, BACKENDS
+from idf_index import IDFIndex, IDF_MODES, DEFAULT_IDF_PATH
+from summary_cache import SummaryCache, summary_params
+from mailbox_mirror import MailboxMirror, DEFAULT_MIRROR_PATH
+from thread_state import ThreadStateCache
 from auto_responder import ensure_label, send_reply_and_label, is_automated_message, is_thread_replied, get_message_datetime_ms
 
 # Heuristic match on the "Date" header (human readable) and/or internalDate
@@ -22,12 +26,13 @@ def message_matches_datetime(headers, target_date_str, target_time_str):
                 return True
     return False
 
-def find_candidates(service, date_str, time_str, query='after:2025/11/27 before:2025/11/29', max_results=50):
+def find_candidates(service, date_str, time_str, query='after:2025/11/27 before:2025/11/29', max_results=50, mirror=None):
     """Searches messages in the date window and returns list of matching message resources."""
-    msg_ids = list_message_ids(service, query=query, max_results=max_results)
+    msg_ids = iter_message_ids(service, query=query, limit=max_results, mirror=mirror)
     matches = []
-    for mid in msg_ids:
-        msg = get_message(service, mid)
+    for _, msg in iter_messages(service, msg_ids, mirror=mirror):
+        if msg is None:
+            continue
         headers = msg.get('payload', {}).get('headers', [])
         if message_matches_datetime(headers, date_str, time_str):
             matches.append(msg)
@@ -59,19 +64,24 @@ def build_reply_from_summary(original_msg, summary_text, your_name="Anvit"):
 
 def main(args):
     service = get_gmail_service()
+    mirror = None
+    if args.mirror:
+        mirror = MailboxMirror(args.mirror)
+        print("Mailbox mirror sync:", mirror.sync(service))
     # narrow the query span to include the date around Nov 28
     # You can edit the query if your mailbox uses different dates
     date_query = args.query
     print("Searching messages with query:", date_query)
     candidates = find_candidates(service, date_str=args.date_substr, time_str=args.time_substr,
-                                 query=date_query, max_results=args.max_results)
+                                 query=date_query, max_results=args.max_results, mirror=mirror)
 
     if not candidates:
         print("No message found that matches the date/time heuristics. Listing top messages in the date range for inspection...")
         # fallback: list top messages found by the query and show their Date/Subject
-        ids = list_message_ids(service, query=date_query, max_results=args.max_results)
-        for mid in ids:
-            m = get_message(service, mid)
+        ids = iter_message_ids(service, query=date_query, limit=args.max_results, mirror=mirror)
+        for mid, m in iter_messages(service, ids, format='metadata', mirror=mirror):
+            if m is None:
+                continue
             headers = m.get('payload', {}).get('headers', [])
             date_hdr = next((h['value'] for h in headers if h['name'].lower()=='date'), 'N/A')
             subj = next((h['value'] for h in headers if h['name'].lower()=='subject'), 'N/A')
@@ -80,6 +90,12 @@ def main(args):
 
     print(f"Found {len(candidates)} candidate(s). We'll inspect them now.")
     label_id = ensure_label(service, label_name=args.label_name)
+    cache = None if args.no_cache else SummaryCache()
+    idf = IDFIndex(args.idf_path) if args.mode in IDF_MODES else None
+    thread_cache = None
+    if not args.no_cache:
+        thread_cache = ThreadStateCache()
+        thread_cache.refresh(service)
 
     for msg in candidates:
         mid = msg.get('id')
@@ -95,19 +111,30 @@ def main(args):
         if is_automated_message(msg.get('payload', {})):
             print("Skipping: detected as automated message.")
             continue
-        if is_thread_replied(service, msg.get('threadId')):
+        if is_thread_replied(service, msg.get('threadId'), cache=thread_cache, history_id=msg.get('historyId')):
             print("Skipping: thread already has a SENT message.")
             continue
 
-        text = extract_plain_text_from_message(msg)
+        text = extract_plain_text_from_message(msg, max_chars=SUMMARY_MAX_CHARS, strip_quotes=True, service=service)
         # summarize (extractive by default)
         if args.mode == 'extractive':
-            summary = extractive_summarize(text, max_sentences=args.max_sentences)
+            summarize = lambda t: extractive_summarize(t, max_sentences=args.max_sentences)
+        elif args.mode in IDF_MODES:
+            idf.add_documents([(mid, text)])
+            summarize = lambda t: tfidf_summarize(t, idf=idf, max_sentences=args.max_sentences,
+                                                  textrank=args.mode == 'textrank')
+        else:
+            summarize = lambda t: transformer_summarize(t, model_name=args.model_name,
+                                                        max_length=args.max_length, min_length=args.min_length,
+                                                        chunk_overlap_tokens=args.chunk_overlap_tokens,
+                                                        device=args.device, backend=args.backend)
+        if cache is None:
+            summary = summarize(text)
         else:
-            summary = transformer_summarize(text, model_name=args.model_name,
-                                            max_length=args.max_length, min_length=args.min_length,
-                                            chunk_overlap_tokens=args.chunk_overlap_tokens,
-                                            device=args.device)
+            params = summary_params(args.mode, model_name=args.model_name, max_length=args.max_length,
+                                    min_length=args.min_length, max_sentences=args.max_sentences,
+                                    chunk_overlap_tokens=args.chunk_overlap_tokens, backend=args.backend)
+            summary = cache.summarize(text, args.mode, params, summarize)
         print("\n--- Generated Summary ---\n")
         print(summary)
         print("\n-------------------------\n")
@@ -121,6 +148,8 @@ def main(args):
 
         # send and label
         sent = send_reply_and_label(service, msg, msg['threadId'], reply_body, label_id=label_id, from_email=None)
+        if thread_cache is not None:
+            thread_cache.put(msg['threadId'], True)
         print("Sent reply message id:", sent.get('id'))
 
 if __name__ == "__main__":
@@ -130,13 +159,18 @@ if __name__ == "__main__":
     parser.add_argument('--date-substr', type=str, default='Nov 28', help='Substring to match in Date header (e.g. "Nov 28")')
     parser.add_argument('--time-substr', type=str, default='9:45', help='Substring to match in Date header time (e.g. "9:45")')
     parser.add_argument('--max-results', type=int, default=50)
-    parser.add_argument('--mode', type=str, choices=['extractive','transformer'], default='extractive')
+    parser.add_argument('--mode', type=str, choices=['extractive','tfidf','textrank','transformer'], default='extractive')
+    parser.add_argument('--idf-path', type=str, default=DEFAULT_IDF_PATH)
     parser.add_argument('--max-sentences', type=int, default=3)
     parser.add_argument('--model-name', type=str, default='sshleifer/distilbart-cnn-12-6')
     parser.add_argument('--max-length', type=int, default=130)
     parser.add_argument('--min-length', type=int, default=30)
     parser.add_argument('--chunk-overlap-tokens', type=int, default=128)
     parser.add_argument('--device', type=int, default=-1)
+    parser.add_argument('--backend', type=str, choices=list(BACKENDS), default='pytorch')
+    parser.add_argument('--mirror', nargs='?', const=DEFAULT_MIRROR_PATH, default=None,
+                        help='Serve messages from a local mailbox mirror, syncing only changes (optional path)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the local summary / thread-state caches')
     parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=True, help='Do not actually send replies')
     parser.add_argument('--no-dry-run', dest='dry_run', action='store_false', help='Actually send replies')
     parser.add_argument('--label-name', type=str, default='AutoReplied')
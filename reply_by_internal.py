@@ -1,18 +1,18 @@
 # reply_by_internal.py
 import argparse
-from gmail_utils import get_gmail_service, list_message_ids, get_message, extract_plain_text_from_message
-from summarizers import extractive_summarize
+from gmail_utils import get_gmail_service, extract_plain_text_from_message, SUMMARY_MAX_CHARS
+from summarizers import extractive_summarize, tfidf_summarize
+from idf_index import IDFIndex, IDF_MODES, DEFAULT_IDF_PATH
+from summary_cache import SummaryCache, summary_params
+from mailbox_mirror import MailboxMirror, DEFAULT_MIRROR_PATH
+from thread_state import ThreadStateCache
+from time_index import find_by_internal_date
 from auto_responder import ensure_label, send_reply_and_label, is_automated_message, is_thread_replied
 
-def find_by_internal(service, target_ms, tol_ms=300000, query='after:2025/11/27 before:2025/11/29', max_results=200):
-    ids = list_message_ids(service, query=query, max_results=max_results)
-    matches = []
-    for mid in ids:
-        m = get_message(service, mid)
-        internal = int(m.get('internalDate', '0'))
-        if abs(internal - target_ms) <= tol_ms:
-            matches.append((m, internal))
-    return matches
+def find_by_internal(service, target_ms, tol_ms=300000, query='after:2025/11/27 before:2025/11/29', max_results=200, mirror=None):
+    """Messages whose internalDate is within tol_ms of target_ms (see time_index.find_by_internal_date)."""
+    return find_by_internal_date(service, target_ms, tol_ms=tol_ms, query=query,
+                                 max_results=max_results, mirror=mirror)
 
 def build_reply_from_summary(original_msg, summary_text, your_name="Anvit"):
     headers = original_msg.get('payload', {}).get('headers', [])
@@ -33,13 +33,24 @@ def build_reply_from_summary(original_msg, summary_text, your_name="Anvit"):
 
 def main(args):
     service = get_gmail_service()
+    mirror = None
+    if args.mirror:
+        mirror = MailboxMirror(args.mirror)
+        print("Mailbox mirror sync:", mirror.sync(service))
     print("Searching messages with query:", args.query)
-    matches = find_by_internal(service, args.target_ms, tol_ms=args.tolerance_ms, query=args.query, max_results=args.max_results)
+    matches = find_by_internal(service, args.target_ms, tol_ms=args.tolerance_ms, query=args.query, max_results=args.max_results,
+                               mirror=mirror)
     if not matches:
         print("No matches found by internalDate within tolerance.")
         return
     print(f"Found {len(matches)} candidate(s).")
     label_id = ensure_label(service, label_name=args.label_name)
+    cache = None if args.no_cache else SummaryCache()
+    idf = IDFIndex(args.idf_path) if args.mode in IDF_MODES else None
+    thread_cache = None
+    if not args.no_cache:
+        thread_cache = ThreadStateCache()
+        thread_cache.refresh(service)
     for m, internal in matches:
         mid = m.get('id')
         print("="*60)
@@ -54,12 +65,22 @@ def main(args):
         if is_automated_message(m.get('payload', {})):
             print("Skipping: automated message")
             continue
-        if is_thread_replied(service, m.get('threadId')):
+        if is_thread_replied(service, m.get('threadId'), cache=thread_cache, history_id=m.get('historyId')):
             print("Skipping: thread already has a SENT message")
             continue
 
-        text = extract_plain_text_from_message(m)
-        summary = extractive_summarize(text, max_sentences=args.max_sentences)
+        text = extract_plain_text_from_message(m, max_chars=SUMMARY_MAX_CHARS, strip_quotes=True, service=service)
+        if args.mode in IDF_MODES:
+            idf.add_documents([(mid, text)])
+            summarize = lambda t: tfidf_summarize(t, idf=idf, max_sentences=args.max_sentences,
+                                                  textrank=args.mode == 'textrank')
+        else:
+            summarize = lambda t: extractive_summarize(t, max_sentences=args.max_sentences)
+        if cache is None:
+            summary = summarize(text)
+        else:
+            params = summary_params(args.mode, max_sentences=args.max_sentences)
+            summary = cache.summarize(text, args.mode, params, summarize)
         print("\n--- Summary ---\n")
         print(summary)
         print("\n--- Reply preview (first 800 chars) ---\n")
@@ -69,6 +90,8 @@ def main(args):
             print("DRY RUN: not sending.")
             continue
         sent = send_reply_and_label(service, m, m['threadId'], reply_body, label_id=label_id, from_email=None)
+        if thread_cache is not None:
+            thread_cache.put(m['threadId'], True)
         print("Sent reply id:", sent.get('id'))
 
 if __name__ == "__main__":
@@ -77,7 +100,12 @@ if __name__ == "__main__":
     parser.add_argument('--tolerance-ms', type=int, default=300000, help='Tolerance window in ms (default 5 minutes)')
     parser.add_argument('--query', type=str, default='after:2025/11/27 before:2025/11/29')
     parser.add_argument('--max-results', type=int, default=200)
+    parser.add_argument('--mode', type=str, choices=['extractive','tfidf','textrank'], default='extractive')
     parser.add_argument('--max-sentences', type=int, default=3)
+    parser.add_argument('--idf-path', type=str, default=DEFAULT_IDF_PATH)
+    parser.add_argument('--mirror', nargs='?', const=DEFAULT_MIRROR_PATH, default=None,
+                        help='Serve messages from a local mailbox mirror, syncing only changes (optional path)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the local summary / thread-state caches')
     parser.add_argument('--label-name', type=str, default='AutoReplied')
     parser.add_argument('--your-name', type=str, default='Anvit')
     parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=True)
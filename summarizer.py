@@ -1,10 +1,23 @@
 # summarizer.py
 import argparse
-from gmail_utils import get_gmail_service, list_message_ids, get_message, extract_plain_text_from_message
-from summarizers import extractive_summarize, transformer_summarize
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from gmail_utils import (
+    get_gmail_service, get_credentials, configure_quota, DEFAULT_UNITS_PER_SECOND,
+    iter_message_ids, iter_messages, extract_plain_text_from_message, SUMMARY_MAX_CHARS
+)
+from summarizers import extractive_summarize_many, tfidf_summarize_many, transformer_summarize_many, warm_up, BACKENDS
+from summary_cache import SummaryCache, summary_params
+from idf_index import IDFIndex, IDF_MODES, DEFAULT_IDF_PATH
+from mailbox_mirror import MailboxMirror, DEFAULT_MIRROR_PATH
+from thread_state import ThreadStateCache
+from outbox import Outbox, OutboxSender, DEFAULT_OUTBOX_PATH
 from auto_responder import (
     ensure_label, is_thread_replied, is_automated_message,
-    get_message_datetime_ms, send_reply_and_label
+    get_message_datetime_ms, send_reply_and_label, iter_triaged_messages, ReplySender, DEFAULT_SEND_CONCURRENCY
 )
 
 def build_reply_from_summary(original_msg, summary_text, your_name="Anvit"):
@@ -33,7 +46,7 @@ def build_reply_from_summary(original_msg, summary_text, your_name="Anvit"):
     ]
     return "\n".join(body_lines)
 
-def should_auto_reply(msg, service, min_age_seconds):
+def should_auto_reply(msg, service, min_age_seconds, thread_cache=None):
     """
     Run safety checks before auto-replying:
     - Skip if automated mailing (no-reply, list, auto-submitted etc.)
@@ -47,7 +60,7 @@ def should_auto_reply(msg, service, min_age_seconds):
 
     # Thread replied?
     thread_id = msg.get('threadId')
-    if is_thread_replied(service, thread_id):
+    if is_thread_replied(service, thread_id, cache=thread_cache, history_id=msg.get('historyId')):
         return False, "thread_has_reply"
 
     # Age check
@@ -59,97 +72,382 @@ def should_auto_reply(msg, service, min_age_seconds):
 
     return True, "ok"
 
-def main(args):
-    service = get_gmail_service()
+def summarize_texts(texts, args, cache=None, idf=None):
+    """
+    Summarize a batch of texts with the mode selected on the command line (through cache if given).
+    idf is the IDFIndex used by the tfidf/textrank modes.
+    """
+    def compute(batch):
+        if args.mode == 'extractive':
+            return extractive_summarize_many(batch, max_sentences=args.max_sentences)
+        if args.mode in IDF_MODES:
+            return tfidf_summarize_many(batch, idf=idf, max_sentences=args.max_sentences,
+                                        textrank=args.mode == 'textrank')
+        return transformer_summarize_many(
+            batch,
+            model_name=args.model_name,
+            max_length=args.max_length,
+            min_length=args.min_length,
+            chunk_overlap_tokens=args.chunk_overlap_tokens,
+            device=args.device,
+            batch_size=args.batch_size,
+            backend=args.backend
+        )
 
-    # Ensure AutoReplied label exists (for marking after sending)
-    label_id = ensure_label(service, label_name=args.label_name)
+    if cache is None:
+        return compute(texts)
+    return cache.summarize_many(texts, args.mode, _cache_params(args), compute)
 
-    # fetch message ids matching query
-    msg_ids = list_message_ids(service, query=args.query, max_results=args.max_results)
-    if not msg_ids:
-        print("No messages found.")
+def _cache_params(args):
+    return summary_params(args.mode, model_name=args.model_name, max_length=args.max_length,
+                          min_length=args.min_length, max_sentences=args.max_sentences,
+                          chunk_overlap_tokens=args.chunk_overlap_tokens, backend=args.backend)
+
+# ---------- process-pool summarization stage (--workers) ----------
+_worker_idf = None
+
+def _init_summary_worker(args, torch_threads):
+    """Pool initializer: load the model (or open the IDF table) once per worker process."""
+    global _worker_idf
+    if args.mode == 'transformer':
+        if args.device == -1:
+            # N workers each running torch on every core would just fight over them
+            try:
+                import torch
+                torch.set_num_threads(torch_threads)
+            except Exception:
+                pass
+        warm_up(args.model_name, device=args.device, backend=args.backend)
+    elif args.mode in IDF_MODES:
+        _worker_idf = IDFIndex(args.idf_path)
+
+def _summarize_in_worker(texts, args):
+    return summarize_texts(texts, args, idf=_worker_idf)
+
+def make_summary_pool(args):
+    """
+    Return a process pool for the summarization stage, or None when
+    args.workers is 0 (summarize in the calling process).
+    Workers are spawned rather than forked: the parent already runs Gmail
+    prefetch / quota threads, and torch does not survive a fork well.
+    """
+    workers = getattr(args, 'workers', 0) or 0
+    if workers < 1:
+        return None
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_summary_worker, initargs=(args, torch_threads))
+
+def _submit_summaries(pool, texts, args, cache=None):
+    """
+    Start summarizing texts on pool; returns (future, collect) where collect()
+    blocks for the summaries in order. Cache lookups and writes stay in this
+    process, only the misses are shipped to a worker.
+    """
+    lookup = None if cache is None else cache.lookup_many(texts, args.mode, _cache_params(args))
+    todo = texts if lookup is None else [texts[i] for i in lookup[2].values()]
+    if todo:
+        fut = pool.submit(_summarize_in_worker, todo, args)
+    else:
+        fut = Future()
+        fut.set_result([])
+    if lookup is None:
+        return fut, fut.result
+    return fut, lambda: cache.fill_many(lookup, fut.result())
+
+def handle_message(service, mid, msg, text, summary, args, label_id, thread_cache=None, sender=None):
+    """
+    Print one message with its summary and, if enabled, auto-reply to it.
+    With a ReplySender the reply is queued on it (see report_sends) instead of sent here.
+    """
+    print("="*80)
+    print(f"Message id: {mid}")
+    print("Original (first 800 chars):\n")
+    print(text[:800])
+    print("\n--- Summary ---\n")
+    print(summary)
+    print("\n")
+
+    # If auto-reply not enabled, continue
+    if not args.auto_reply:
         return
 
-    # iterate messages
-    for mid in msg_ids:
-        msg = get_message(service, mid)
-        text = extract_plain_text_from_message(msg)
-        print("="*80)
-        print(f"Message id: {mid}")
-        print("Original (first 800 chars):\n")
-        print(text[:800])
-        print("\n--- Summary ---\n")
-
-        # create summary
-        if args.mode == 'extractive':
-            summary = extractive_summarize(text, max_sentences=args.max_sentences)
+    # Safety checks
+    ok, reason = should_auto_reply(msg, service, args.min_age_seconds, thread_cache=thread_cache)
+    if not ok:
+        print(f"Skipping auto-reply: {reason}")
+        return
+
+    # Build reply text: if user provided a custom template string, use it with {summary}
+    if args.reply_template:
+        if "{summary}" in args.reply_template:
+            reply_text = args.reply_template.format(summary=summary)
         else:
-            summary = transformer_summarize(
-                text,
-                model_name=args.model_name,
-                max_length=args.max_length,
-                min_length=args.min_length,
-                chunk_overlap_tokens=args.chunk_overlap_tokens,
-                device=args.device
-            )
-        print(summary)
-        print("\n")
-
-        # If auto-reply not enabled, continue
-        if not args.auto_reply:
+            # if template has no placeholder, append summary
+            reply_text = args.reply_template + "\n\n" + summary
+    else:
+        # default template that includes the generated summary
+        reply_text = build_reply_from_summary(msg, summary, your_name=args.your_name)
+
+    # Dry-run: show what we'd send
+    if args.dry_run:
+        print("DRY RUN - would send reply (not actually sent).")
+        print("Reply body preview:\n")
+        print(reply_text[:1000])
+        return
+
+    if sender is not None:
+        sender.submit(msg, reply_text)
+        print("Auto-reply queued.")
+        return
+
+    # Send reply and add label (sends in the thread)
+    try:
+        sent = send_reply_and_label(service, msg, msg['threadId'], reply_text, label_id=label_id, from_email=None)
+        if thread_cache is not None:
+            thread_cache.put(msg['threadId'], True)
+        print(f"Sent auto-reply message id: {sent.get('id')}")
+    except Exception as e:
+        print("Failed to send auto-reply:", e)
+
+def report_sends(results):
+    """Print the outcome of a ReplySender.flush()."""
+    for r in results:
+        if r.get('action') == 'sent':
+            print(f"Sent auto-reply to {r['id']}: message id {r['sent_id']}")
+            if 'label_error' in r:
+                print(f"Warning: reply to {r['id']} sent but labelling failed: {r['label_error']}")
+        elif r.get('action') == 'send_failed':
+            print(f"Failed to send auto-reply to {r['id']}: {r['error']}")
+        elif r.get('action') == 'queued':
+            print(f"Auto-reply to {r['id']} queued in the outbox")
+        else:
+            print(f"Skipping auto-reply to {r['id']}: {r['skipped']}")
+
+def make_reply_sender(service, args, label_id, thread_cache=None):
+    """
+    Reply stage for --auto-reply --no-dry-run runs: an OutboxSender with --outbox,
+    else a ReplySender; None for dry runs and one-by-one sends.
+    """
+    if not args.auto_reply or args.dry_run:
+        return None
+    if args.outbox:
+        return OutboxSender(Outbox(args.outbox), service, label_id=label_id, concurrency=max(1, args.send_concurrency),
+                            thread_cache=thread_cache, send=not args.enqueue_only)
+    if args.send_concurrency < 1:
+        return None
+    return ReplySender(service, label_id=label_id, concurrency=args.send_concurrency, thread_cache=thread_cache)
+
+def triaged_messages(service, msg_ids, args, label_id, mirror=None):
+    """
+    Yield (id, message) for messages that pass the metadata-only triage
+    (automated mail, and already auto-replied ones when --auto-reply is on);
+    only those are downloaded in full.
+    """
+    for mid, msg, skipped in iter_triaged_messages(service, msg_ids,
+                                                   label_id=label_id if args.auto_reply else None,
+                                                   mirror=mirror):
+        if skipped is not None and skipped['skipped'] != 'fetch_failed':
+            print(f"Skipping message {mid}: {skipped['skipped']}")
             continue
+        yield mid, msg
 
-        # Safety checks
-        ok, reason = should_auto_reply(msg, service, args.min_age_seconds)
-        if not ok:
-            print(f"Skipping auto-reply: {reason}")
+def iter_summaries(service, args, label_id=None, cache=None, mirror=None, creds=None, msg_ids=None, pool=None):
+    """
+    Run the fetch -> extract -> summarize pipeline for args.query (or for the
+    given msg_ids) and yield (id, message, text, summary) in list order.
+    message/text/summary are None for messages that could not be fetched.
+    - pool: optional make_summary_pool() executor. Batches are then summarized
+      in worker processes while this one keeps fetching and extracting (and the
+      caller replies), with at most 2 batches per worker in flight.
+    """
+    # the IDF table learns from every message seen, run after run
+    idf = IDFIndex(args.idf_path) if args.mode in IDF_MODES else None
+    listing = msg_ids is None
+    if listing:
+        # stream message ids matching query (pages are prefetched in the background)
+        # and fetch them in batched round trips, so work starts on the first batch
+        msg_ids = iter_message_ids(service, query=args.query, limit=args.max_results, mirror=mirror)
+    if args.async_io and listing:
+        # list and fetch on an asyncio client in the background, overlapping with summarization
+        from gmail_async import iter_messages_background
+        messages = iter_messages_background(creds or get_credentials(), query=args.query, limit=args.max_results,
+                                            concurrency=args.concurrency)
+    elif args.triage:
+        messages = triaged_messages(service, msg_ids, args, label_id, mirror=mirror)
+    else:
+        messages = iter_messages(service, msg_ids, mirror=mirror)
+    batches = _extracted_batches(service, messages, args, idf)
+    if pool is None:
+        for fetched in batches:
+            texts = [text for _, msg, text in fetched if msg is not None]
+            yield from _with_summaries(fetched, summarize_texts(texts, args, cache=cache, idf=idf))
+        return
+    in_flight = deque()
+    max_in_flight = 2 * max(1, getattr(args, 'workers', 1))
+    try:
+        for fetched in batches:
+            texts = [text for _, msg, text in fetched if msg is not None]
+            in_flight.append((fetched,) + _submit_summaries(pool, texts, args, cache=cache))
+            # hand back finished batches in order; block only once the window is full
+            while in_flight and (len(in_flight) >= max_in_flight or in_flight[0][1].done()):
+                fetched, _, collect = in_flight.popleft()
+                yield from _with_summaries(fetched, collect())
+        while in_flight:
+            fetched, _, collect = in_flight.popleft()
+            yield from _with_summaries(fetched, collect())
+    finally:
+        # the caller stopped early: drop batches no worker has picked up yet
+        for _, fut, _ in in_flight:
+            fut.cancel()
+
+DIGEST_HEADERS = ('from', 'subject', 'date')
+
+def iter_digest(service, args, label_id=None, cache=None, mirror=None, pool=None):
+    """
+    Yield one digest entry per message matching args.query, as soon as its
+    summary is ready: {'id', 'threadId', 'from', 'subject', 'date', 'snippet', 'summary'}
+    ({'id', 'error': 'fetch_failed'} for messages that could not be fetched).
+    Closing the generator stops fetching and summarizing.
+    """
+    for mid, msg, _, summary in iter_summaries(service, args, label_id, cache=cache, mirror=mirror, pool=pool):
+        if msg is None:
+            yield {'id': mid, 'error': 'fetch_failed'}
             continue
+        hd = {h['name'].lower(): h['value'] for h in msg.get('payload', {}).get('headers', [])}
+        entry = {'id': mid, 'threadId': msg.get('threadId')}
+        entry.update((name, hd.get(name)) for name in DIGEST_HEADERS)
+        entry['snippet'] = msg.get('snippet')
+        entry['summary'] = summary
+        yield entry
+
+def _with_summaries(fetched, summaries):
+    summaries = iter(summaries)
+    for mid, msg, text in fetched:
+        yield mid, msg, text, (next(summaries) if msg is not None else None)
 
-        # Build reply text: if user provided a custom template string, use it with {summary}
-        if args.reply_template:
-            if "{summary}" in args.reply_template:
-                reply_text = args.reply_template.format(summary=summary)
+def _extracted_batches(service, messages, args, idf=None):
+    """Yield lists of (id, message, text), args.batch_size messages at a time (text is None if not fetched)."""
+    while True:
+        # summarize args.batch_size messages at a time so transformer inference runs batched
+        batch = list(islice(messages, args.batch_size))
+        if not batch:
+            return
+        fetched = []
+        for mid, msg in batch:
+            if msg is None:
+                fetched.append((mid, None, None))
             else:
-                # if template has no placeholder, append summary
-                reply_text = args.reply_template + "\n\n" + summary
-        else:
-            # default template that includes the generated summary
-            reply_text = build_reply_from_summary(msg, summary, your_name=args.your_name)
-
-        # Dry-run: show what we'd send
-        if args.dry_run:
-            print("DRY RUN - would send reply (not actually sent).")
-            print("Reply body preview:\n")
-            print(reply_text[:1000])
-            continue
+                # only the leading --max-chars of the message, without quoted history, is read
+                text = extract_plain_text_from_message(msg, max_chars=args.max_chars,
+                                                       strip_quotes=not args.keep_quotes, service=service)
+                fetched.append((mid, msg, text))
+        if idf is not None:
+            # committed before the batch is summarized, so pool workers see the counts too
+            idf.add_documents((mid, text) for mid, msg, text in fetched if msg is not None)
+        yield fetched
+
+def main(args):
+    configure_quota(args.quota_units_per_second)
+    service = get_gmail_service()
 
-        # Send reply and add label (sends in the thread)
-        try:
-            sent = send_reply_and_label(service, msg, msg['threadId'], reply_text, label_id=label_id, from_email=None)
-            print(f"Sent auto-reply message id: {sent.get('id')}")
-        except Exception as e:
-            print("Failed to send auto-reply:", e)
+    # Ensure AutoReplied label exists (for marking after sending)
+    label_id = ensure_label(service, label_name=args.label_name)
 
-if __name__ == "__main__":
+    cache = None if args.no_cache else SummaryCache()
+    thread_cache = None
+    if args.auto_reply and not args.no_cache:
+        thread_cache = ThreadStateCache()
+        thread_cache.refresh(service)
+    mirror = None
+    if args.mirror:
+        mirror = MailboxMirror(args.mirror)
+        print("Mailbox mirror sync:", mirror.sync(service))
+
+    # with --workers every worker process loads its own model in the pool initializer
+    pool = make_summary_pool(args)
+    # load the transformer once up front; every message below reuses it.
+    # With the cache on it is loaded lazily instead, on the first cache miss.
+    if args.mode == 'transformer' and cache is None and pool is None:
+        warm_up(args.model_name, device=args.device, backend=args.backend)
+
+    sender = make_reply_sender(service, args, label_id, thread_cache=thread_cache)
+    seen = 0
+    try:
+        for mid, msg, text, summary in iter_summaries(service, args, label_id, cache=cache, mirror=mirror, pool=pool):
+            seen += 1
+            if msg is None:
+                print(f"Failed to fetch message {mid}, skipping.")
+                continue
+            handle_message(service, mid, msg, text, summary, args, label_id, thread_cache=thread_cache, sender=sender)
+            # label the replies of each batch with one batchModify
+            if sender is not None and sender.pending >= args.batch_size:
+                report_sends(sender.flush())
+    finally:
+        if sender is not None:
+            report_sends(sender.close())
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if not seen:
+        print("No messages found.")
+    if cache is not None:
+        print("Summary cache:", cache.stats())
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Gmail summarizer + optional auto-responder")
     parser.add_argument('--query', type=str, default='is:unread', help='Gmail search query (e.g. "is:unread")')
     parser.add_argument('--max-results', type=int, default=5)
-    parser.add_argument('--mode', type=str, choices=['extractive','transformer'], default='extractive')
+    parser.add_argument('--mode', type=str, choices=['extractive','tfidf','textrank','transformer'], default='extractive',
+                        help='tfidf/textrank weight words by how rare they are across your mailbox (textrank needs scipy)')
+    parser.add_argument('--idf-path', type=str, default=DEFAULT_IDF_PATH, help='Where the tfidf/textrank word statistics are kept')
     parser.add_argument('--max-sentences', type=int, default=3)
     parser.add_argument('--model-name', type=str, default='sshleifer/distilbart-cnn-12-6')
     parser.add_argument('--max-length', type=int, default=130)
     parser.add_argument('--min-length', type=int, default=30)
     # transformer chunking args (only relevant for transformer mode)
-    parser.add_argument('--chunk-overlap-tokens', type=int, default=128)
+    parser.add_argument('--chunk-overlap-tokens', type=int, default=128,
+                        help='Max tokens of whole trailing sentences repeated at the start of the next chunk')
     parser.add_argument('--device', type=int, default=-1, help='-1 for CPU, 0 for cuda:0 etc.')
+    parser.add_argument('--backend', type=str, choices=list(BACKENDS), default='pytorch',
+                        help='Transformer inference backend: int8 (dynamic quantization) and onnx (needs optimum[onnxruntime]) are CPU only')
+    parser.add_argument('--mirror', nargs='?', const=DEFAULT_MIRROR_PATH, default=None,
+                        help='Serve messages from a local mailbox mirror, syncing only changes (optional path)')
+    parser.add_argument('--triage', action='store_true',
+                        help='Check headers/labels first and skip automated (and already auto-replied) mail before downloading bodies')
+    parser.add_argument('--async-io', action='store_true',
+                        help='Fetch messages with the asyncio Gmail client (requires httpx), overlapping with summarization')
+    parser.add_argument('--concurrency', type=int, default=10, help='Max in-flight Gmail requests with --async-io')
+    parser.add_argument('--quota-units-per-second', type=float, default=DEFAULT_UNITS_PER_SECOND,
+                        help='Gmail API quota budget to pace calls against (per-user limit is 250)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the local summary / thread-state caches')
+    parser.add_argument('--max-chars', type=int, default=SUMMARY_MAX_CHARS,
+                        help='Summarize at most this many characters of each message')
+    parser.add_argument('--keep-quotes', action='store_true',
+                        help='Keep quoted reply history ("> ..." / "On ... wrote:") in the text to summarize')
+    parser.add_argument('--batch-size', type=int, default=8, help='Messages summarized per batch (transformer inference is batched)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Summarize batches on N worker processes (each loads its own model); 0 summarizes in-process')
     # auto-reply flags
     parser.add_argument('--auto-reply', action='store_true', help='Enable sending auto-replies after summarizing')
     parser.add_argument('--dry-run', action='store_true', default=True, help='If set, do not actually send replies (default True). Use --no-dry-run to send')
     parser.add_argument('--no-dry-run', dest='dry_run', action='store_false', help='Disable dry-run and actually send replies')
+    parser.add_argument('--send-concurrency', type=int, default=DEFAULT_SEND_CONCURRENCY,
+                        help='Replies sent at the same time (labels are then added per batch); 0 sends one by one')
+    parser.add_argument('--outbox', nargs='?', const=DEFAULT_OUTBOX_PATH, default=None,
+                        help='Queue replies in a persistent outbox (sent at most once per message, safe to restart; optional path)')
+    parser.add_argument('--enqueue-only', action='store_true',
+                        help='With --outbox: only queue replies, `python outbox.py` sends them')
     parser.add_argument('--min-age-seconds', type=int, default=60*60*6, help='Only auto-reply to messages older than this (seconds)')
     parser.add_argument('--reply-template', type=str, default=None, help='Optional reply template. Use {summary} placeholder to include generated summary')
     parser.add_argument('--label-name', type=str, default='AutoReplied', help='Label name to add to messages after replying')
     parser.add_argument('--your-name', type=str, default='Anvit', help='Name to sign replies with')
+    return parser
+
+if __name__ == "__main__":
+    parser = build_parser()
     args = parser.parse_args()
+    # the async client lists and fetches on its own, bypassing triage and the mirror
+    if args.async_io and (args.triage or args.mirror):
+        parser.error('--async-io cannot be combined with --triage or --mirror')
     main(args)
@@ -1,8 +1,28 @@
 # summarizers.py
-from collections import defaultdict
+from collections import Counter, defaultdict, namedtuple, OrderedDict
+from itertools import chain
+import heapq
+import os
 import re
+import threading
 
 # ---------- Extractive summarizer (lightweight, no heavy deps) ----------
+try:
+    import numpy as np
+except Exception:  # optional: the pure-Python scorer gives identical results
+    np = None
+
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+# words are what r'\b[a-zA-Z]+\b' matches in lowercased text
+_NON_ASCII_WORD_RE = re.compile(r'[^\W\x00-\x7f]')
+STOPWORDS = frozenset([
+    'the','is','and','to','that','a','of','for','in','on','if','as','all','any','your','you','this','are',
+    'we','our','will','be','by','with','from','at','it','has','have','an'
+])
+_STOPWORDS_BYTES = frozenset(w.encode('ascii') for w in STOPWORDS)
+# ASCII bytes that are not word characters (\w) -> space; NUL is kept as the separator
+_NON_WORD_TO_SPACE = bytes(c if chr(c).isalnum() or c in (0, 0x5f) else 0x20 for c in range(128)) + bytes(range(128, 256))
+
 def extractive_summarize(text, max_sentences=3):
     """
     Frequency-based extractive summarizer:
@@ -10,112 +30,484 @@ def extractive_summarize(text, max_sentences=3):
     - scores by word frequency (ignores a small stoplist)
     - returns top-ranked sentences in original order
     """
-    if not text:
-        return ""
+    return extractive_summarize_many([text], max_sentences=max_sentences)[0]
 
-    # naive sentence split
-    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', text) if s.strip()]
-    # lowercase words
-    words = re.findall(r'\b[a-zA-Z]+\b', text.lower())
-    stopwords = set([
-        'the','is','and','to','that','a','of','for','in','on','if','as','all','any','your','you','this','are',
-        'we','our','will','be','by','with','from','at','it','has','have','an'
-    ])
-    freq = defaultdict(int)
-    for w in words:
-        if w not in stopwords:
-            freq[w] += 1
-    # score sentences
-    scores = []
-    for i, s in enumerate(sentences):
-        wds = re.findall(r'\b[a-zA-Z]+\b', s.lower())
-        score = sum(freq.get(w, 0) for w in wds)
-        scores.append((i, s, score))
-    # top sentences by score
-    top = sorted(scores, key=lambda x: x[2], reverse=True)[:max_sentences]
-    # sort back to original order
-    top_sorted = sorted(top, key=lambda x: x[0])
-    return " ".join(t[1] for t in top_sorted)
+def extractive_summarize_many(texts, max_sentences=3):
+    """
+    extractive_summarize for a batch of texts, in one pass:
+    - all sentences are tokenized in a single scan and words mapped to integer ids
+    - word frequencies and sentence scores are bincounts (NumPy if installed, else pure Python)
+    - the top sentences are picked by partial selection; equal scores go to the earlier sentence
+    """
+    texts = list(texts)
+    sentences = []
+    bounds = []
+    for text in texts:
+        start = len(sentences)
+        if text:
+            sentences.extend(s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s.strip())
+        bounds.append((start, len(sentences)))
+    if not sentences:
+        return ["" for _ in texts]
 
-# ---------- Transformer-based abstractive summarizer ----------
-# put this in summarizers.py replacing the previous transformer_summarize
-def transformer_summarize(text, model_name='sshleifer/distilbart-cnn-12-6',
-                          max_length=130, min_length=30, chunk_overlap_tokens=128, device=-1):
+    tokens = _tokenize(sentences)
+    vocab = {t: i for i, t in enumerate(dict.fromkeys(tokens))}
+    # stopwords and pieces that are not words count for nothing
+    stop_ids = [i for t, i in vocab.items() if t in _STOPWORDS_BYTES or not t.isalpha()]
+    sep = vocab.get(b'\x00', -1)
+    if np is not None:
+        ids = np.fromiter(map(vocab.__getitem__, tokens), dtype=np.intp, count=len(tokens))
+        scores = _sentence_scores_numpy(ids, sep, stop_ids, len(vocab), bounds)
+    else:
+        scores = _sentence_scores_python(list(map(vocab.__getitem__, tokens)), sep, stop_ids, bounds)
+
+    out = []
+    for (start, end), doc_scores in zip(bounds, scores):
+        n = end - start
+        # same count as sorted(...)[:max_sentences]
+        k = len(range(n)[:max_sentences])
+        chosen = _top_k(doc_scores, k)
+        out.append(" ".join(sentences[start + i] for i in chosen))
+    return out
+
+def _tokenize(sentences):
     """
-    Token-aware chunking for transformer summarization.
-    - Splits by tokenizer tokens (not characters).
-    - Summarizes each chunk and then (optionally) summarizes the concatenated chunk summaries.
-    - device: -1 -> CPU, otherwise cuda device id (0,1,...)
+    Lowercase word candidates of all sentences in one scan, as bytes, with a
+    b'\\x00' token between sentences. The candidates that are all letters are
+    exactly what r'\b[a-zA-Z]+\b' finds.
     """
+    if any('\x00' in s for s in sentences):
+        sentences = [s.replace('\x00', ' ') for s in sentences]
+    joined = '\x00'.join(sentences).lower()
+    if not joined.isascii():
+        # non-ASCII word characters become '_' and the rest '?' (non-word), which
+        # keeps every word boundary where it was
+        joined = _NON_ASCII_WORD_RE.sub('_', joined)
+    joined = joined.encode('ascii', 'replace').replace(b'\x00', b' \x00 ')
+    # with every non-word byte turned into a space, a piece is a word iff it is all
+    # letters; the others (e.g. b'x1') are left in and given no weight by the caller
+    return joined.translate(_NON_WORD_TO_SPACE).split()
+
+def _sentence_scores_numpy(ids, sep, stop_ids, vocab_size, bounds):
+    is_sep = ids == sep
+    sent = np.cumsum(is_sep)
+    ids = ids[~is_sep]
+    sent = sent[~is_sep]
+    # token ranges of each text (sentence indices are sorted)
+    edges = np.searchsorted(sent, [start for start, _ in bounds] + [bounds[-1][1]])
+    scores = []
+    for d, (start, end) in enumerate(bounds):
+        doc_ids = ids[edges[d]:edges[d + 1]]
+        freq = np.bincount(doc_ids, minlength=vocab_size)
+        freq[stop_ids] = 0
+        scores.append(np.bincount(sent[edges[d]:edges[d + 1]] - start, weights=freq[doc_ids],
+                                  minlength=end - start))
+    return scores
+
+def _sentence_scores_python(ids, sep, stop_ids, bounds):
+    # split the id stream back into sentences
+    per_sentence = [[]]
+    for i in ids:
+        if i == sep:
+            per_sentence.append([])
+        else:
+            per_sentence[-1].append(i)
+    scores = []
+    for start, end in bounds:
+        doc = per_sentence[start:end]
+        freq = Counter(chain.from_iterable(doc))
+        for i in stop_ids:
+            freq.pop(i, None)
+        scores.append([sum(map(freq.__getitem__, sent)) for sent in doc])
+    return scores
+
+def _top_k(scores, k):
+    """Indices of the k best scores (earlier index wins ties), in index order."""
+    n = len(scores)
+    if k >= n:
+        return range(n)
+    if k <= 0:
+        return []
+    if np is not None and isinstance(scores, np.ndarray):
+        threshold = np.partition(scores, n - k)[n - k]
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        return np.sort(np.concatenate([above, ties])).tolist()
+    return sorted(heapq.nsmallest(k, range(n), key=lambda i: (-scores[i], i)))
+
+# ---------- TF-IDF / TextRank extractive summarizer ----------
+TEXTRANK_DAMPING = 0.85
+
+def document_terms(text):
+    """Distinct scoring words of text (the ones extractive_summarize counts), as str."""
     if not text:
-        return ""
+        return set()
+    return {t.decode('ascii') for t in set(_tokenize([text])) if t.isalpha() and t not in _STOPWORDS_BYTES}
+
+def tfidf_summarize(text, idf=None, max_sentences=3, textrank=False):
+    return tfidf_summarize_many([text], idf=idf, max_sentences=max_sentences, textrank=textrank)[0]
+
+def tfidf_summarize_many(texts, idf=None, max_sentences=3, textrank=False):
+    """
+    Extractive summaries with words weighted by inverse document frequency,
+    so words found in most emails (greetings, signatures, disclaimers) count for little.
+    - idf: an idf_index.IDFIndex; None weighs every word 1
+    - textrank=False: sentence score = sum of tf * idf over its words
+    - textrank=True: PageRank over the sentences' TF-IDF cosine-similarity graph (needs scipy)
+    Sentence splitting, tokenization and tie-breaking are those of extractive_summarize.
+    """
+    if np is None:
+        raise RuntimeError("numpy not installed or failed to import. Install numpy to use the tfidf/textrank modes.")
+    texts = list(texts)
+    sentences = []
+    bounds = []
+    for text in texts:
+        start = len(sentences)
+        if text:
+            sentences.extend(s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s.strip())
+        bounds.append((start, len(sentences)))
+    if not sentences:
+        return ["" for _ in texts]
 
+    tokens = _tokenize(sentences)
+    vocab = {t: i for i, t in enumerate(dict.fromkeys(tokens))}
+    words = [t.decode('ascii') if t.isalpha() and t not in _STOPWORDS_BYTES else None for t in vocab]
+    known = idf.weights([w for w in words if w is not None]) if idf is not None else {}
+    weight = np.array([0.0 if w is None else known.get(w, 1.0) for w in words])
+
+    ids = np.fromiter(map(vocab.__getitem__, tokens), dtype=np.intp, count=len(tokens))
+    sep = vocab.get(b'\x00', -1)
+    is_sep = ids == sep
+    sent = np.cumsum(is_sep)[~is_sep]
+    ids = ids[~is_sep]
+    edges = np.searchsorted(sent, [start for start, _ in bounds] + [bounds[-1][1]])
+    out = []
+    for d, (start, end) in enumerate(bounds):
+        n = end - start
+        doc_ids = ids[edges[d]:edges[d + 1]]
+        doc_sent = sent[edges[d]:edges[d + 1]] - start
+        if textrank:
+            scores = _textrank_scores(doc_ids, doc_sent, weight, n, len(vocab))
+        else:
+            tf = np.bincount(doc_ids, minlength=len(vocab))
+            scores = np.bincount(doc_sent, weights=(tf * weight)[doc_ids], minlength=n)
+        chosen = _top_k(scores, len(range(n)[:max_sentences]))
+        out.append(" ".join(sentences[start + i] for i in chosen))
+    return out
+
+def _textrank_scores(doc_ids, doc_sent, weight, n, vocab_size, max_iter=100, tol=1e-6):
+    try:
+        from scipy import sparse
+    except Exception as e:
+        raise RuntimeError("scipy not installed or failed to import. Install scipy to use the textrank mode.") from e
+    if n < 2:
+        return np.ones(n)
+    # sentence x word TF-IDF matrix (duplicate entries are summed), rows scaled to unit length
+    x = sparse.csr_matrix((weight[doc_ids], (doc_sent, doc_ids)), shape=(n, vocab_size))
+    norms = np.sqrt(np.asarray(x.multiply(x).sum(axis=1)).ravel())
+    self_sim = (norms > 0).astype(float)
+    norms[norms == 0] = 1.0
+    x = sparse.diags(1.0 / norms) @ x
+    xt = x.T.tocsr()
+    # The similarity graph S = X X^T - diag is never built (it is dense for long
+    # threads); every product with it goes through X instead: S v = X (X^T v) - self_sim * v.
+    out_weight = x @ (xt @ np.ones(n)) - self_sim
+    dangling = out_weight <= 1e-12
+    out_weight[dangling] = 1.0
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        # rank <- (1 - d) / n + d * (S D^-1 rank + dangling mass spread evenly); S is symmetric
+        v = np.where(dangling, 0.0, rank / out_weight)
+        spread = x @ (xt @ v) - self_sim * v
+        new = (1 - TEXTRANK_DAMPING) / n + TEXTRANK_DAMPING * (spread + rank[dangling].sum() / n)
+        if np.abs(new - rank).sum() < tol:
+            return new
+        rank = new
+    return rank
+
+# ---------- Transformer model registry ----------
+DEFAULT_MODEL = 'sshleifer/distilbart-cnn-12-6'
+# Inference backends for the same model:
+# - pytorch: the model as published (fp32 unless dtype says otherwise)
+# - int8: PyTorch dynamic int8 quantization of the Linear layers (CPU only)
+# - onnx: ONNX Runtime through optimum, decoder with KV cache (CPU only);
+#   the export is kept under ONNX_CACHE_DIR so it only happens once
+BACKENDS = ('pytorch', 'int8', 'onnx')
+ONNX_CACHE_DIR = os.path.join('.cache', 'onnx')
+# Loaded models are shared process-wide, keyed by (model_name, device, dtype, backend),
+# so only the first call pays the load. Least recently used entries are evicted
+# once more than MAX_LOADED_MODELS are resident.
+MAX_LOADED_MODELS = 2
+LoadedModel = namedtuple('LoadedModel', ['tokenizer', 'model', 'pipeline'])
+_loaded_models = OrderedDict()
+_loaded_models_lock = threading.Lock()
+
+def _load_model(model_name, device, dtype, backend='pytorch'):
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r} (expected one of {', '.join(BACKENDS)})")
+    if backend != 'pytorch' and device != -1:
+        raise ValueError(f"the {backend} backend runs on CPU only (device=-1)")
     try:
         from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, pipeline
-        import math
     except Exception as e:
         raise RuntimeError("transformers not installed or failed to import. Install transformers and torch to use this function.") from e
 
-    # load tokenizer & model
     tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    if backend == 'onnx':
+        model = _load_onnx_model(model_name)
+        return LoadedModel(tokenizer, model, pipeline('summarization', model=model, tokenizer=tokenizer))
+    kwargs = {}
+    if dtype is not None:
+        import torch
+        kwargs['torch_dtype'] = getattr(torch, dtype)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name, **kwargs)
+    if backend == 'int8':
+        import torch
+        model = torch.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+    summarizer = pipeline('summarization', model=model, tokenizer=tokenizer, device=device)
+    return LoadedModel(tokenizer, model, summarizer)
+
+def _load_onnx_model(model_name):
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except Exception as e:
+        raise RuntimeError("optimum not installed or failed to import. Install optimum[onnxruntime] to use the onnx backend.") from e
+    export_dir = os.path.join(ONNX_CACHE_DIR, model_name.replace('/', '--'))
+    if os.path.isdir(export_dir):
+        return ORTModelForSeq2SeqLM.from_pretrained(export_dir, use_cache=True)
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True)
+    model.save_pretrained(export_dir)
+    return model
+
+def get_model(model_name=DEFAULT_MODEL, device=-1, dtype=None, backend='pytorch'):
+    """
+    Return the cached LoadedModel(tokenizer, model, pipeline), loading it on first use.
+    - device: -1 -> CPU, otherwise cuda device id (0,1,...)
+    - dtype: optional torch dtype name (e.g. 'float16'); None keeps the model default.
+    - backend: one of BACKENDS; int8 and onnx need device=-1.
+    """
+    key = (model_name, int(device), dtype, backend)
+    with _loaded_models_lock:
+        entry = _loaded_models.get(key)
+        if entry is not None:
+            _loaded_models.move_to_end(key)
+            return entry
+        entry = _load_model(model_name, int(device), dtype, backend)
+        _loaded_models[key] = entry
+        while len(_loaded_models) > max(1, MAX_LOADED_MODELS):
+            _loaded_models.popitem(last=False)
+        return entry
 
-    # set device for pipeline
-    device_id = -1 if device == -1 else int(device)
-    summarizer = pipeline('summarization', model=model, tokenizer=tokenizer, device=device_id)
+def warm_up(model_name=DEFAULT_MODEL, device=-1, dtype=None, backend='pytorch'):
+    """Load a model ahead of the first summarize call (e.g. at process start)."""
+    get_model(model_name, device=device, dtype=dtype, backend=backend)
 
+def unload(model_name=None, device=None, dtype=None, backend=None):
+    """
+    Drop cached models. With no arguments everything is unloaded; otherwise only
+    entries matching the given model_name/device/dtype/backend. Returns the number removed.
+    """
+    with _loaded_models_lock:
+        keys = [k for k in _loaded_models
+                if (model_name is None or k[0] == model_name)
+                and (device is None or k[1] == int(device))
+                and (dtype is None or k[2] == dtype)
+                and (backend is None or k[3] == backend)]
+        for k in keys:
+            del _loaded_models[k]
+    if keys and any(k[1] != -1 for k in keys):
+        try:
+            import torch
+            torch.cuda.empty_cache()
+        except Exception:
+            pass
+    return len(keys)
+
+def loaded_models():
+    """Return the (model_name, device, dtype, backend) keys currently resident, least recently used first."""
+    with _loaded_models_lock:
+        return list(_loaded_models)
+
+# ---------- Transformer-based abstractive summarizer ----------
+def _token_limit(tokenizer):
     # model max length for encoder (tokenizer/model config)
     # many encoder-decoder models use `model.config.max_position_embeddings` or `tokenizer.model_max_length`
     token_limit = getattr(tokenizer, "model_max_length", None)
     if token_limit is None:
         token_limit = 1024
-    # keep some headroom for special tokens
-    token_limit = int(token_limit)
+    return int(token_limit)
 
-    # tokenise whole text into ids (fast)
-    all_ids = tokenizer.encode(text, add_special_tokens=False)
+# transformer chunks break at sentence ends and at line breaks (emails are often unpunctuated lines)
+_CHUNK_SPLIT_RE = re.compile(r'(?<=[.!?])\s+|\s*\n\s*')
 
-    # if it fits, do single-pass
-    if len(all_ids) <= token_limit:
-        out = summarizer(text, max_length=max_length, min_length=min_length, do_sample=False)
-        return out[0]['summary_text']
+def _chunk_ids(tokenizer, text, budget, chunk_overlap_tokens):
+    """
+    Split text into chunks of at most budget token ids, on sentence boundaries.
+    - Sentences are tokenized once, in one batched call, and chunks are built
+      from their ids: nothing is decoded back to text and re-encoded.
+    - A text needing n chunks gets n chunks of about the same size rather than
+      n-1 full ones and a short tail.
+    - Overlap is the trailing whole sentences of the previous chunk fitting in
+      chunk_overlap_tokens: none when the last sentence alone is longer, and
+      never half a sentence. A sentence longer than budget is cut by tokens.
+    Returns a list of id lists (without special tokens).
+    """
+    sentences = [s for s in _CHUNK_SPLIT_RE.split(text) if s and not s.isspace()]
+    if not sentences:
+        return []
+    # a leading space keeps word-initial tokens the same as in running text
+    encoded = tokenizer([sentences[0]] + [' ' + s for s in sentences[1:]], add_special_tokens=False)['input_ids']
+    total = sum(len(ids) for ids in encoded)
+    if total <= budget:
+        return [list(chain.from_iterable(encoded))]
+    overlap_budget = min(chunk_overlap_tokens, budget // 2)
+    pieces = []
+    for ids in encoded:
+        if len(ids) <= budget:
+            pieces.append(ids)
+            continue
+        step = budget - overlap_budget
+        pieces.extend(ids[i:i + budget] for i in range(0, len(ids) - overlap_budget, step))
+    n_chunks = -(-total // (budget - overlap_budget))
+    target = min(budget, -(-total // n_chunks) + overlap_budget)
 
-    # otherwise chunk by token ids with overlap
     chunks = []
-    start = 0
-    chunk_size = token_limit - 16  # small safety margin
-    overlap = min(chunk_overlap_tokens, chunk_size//2)
-    while start < len(all_ids):
-        end = min(start + chunk_size, len(all_ids))
-        chunk_ids = all_ids[start:end]
-        chunk_text = tokenizer.decode(chunk_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
-        chunks.append(chunk_text)
-        if end == len(all_ids):
-            break
-        start = end - overlap
-
-    # summarize each chunk
-    chunk_summaries = []
-    for c in chunks:
+    current, size = [], 0
+    for ids in pieces:
+        if current and size + len(ids) > target:
+            chunks.append(current)
+            carried, carried_size = [], 0
+            for prev in reversed(current):
+                if carried_size + len(prev) > overlap_budget or carried_size + len(prev) + len(ids) > budget:
+                    break
+                carried.insert(0, prev)
+                carried_size += len(prev)
+            if len(carried) == len(current):
+                # the whole previous chunk fits in the overlap: carrying it would only repeat it
+                carried, carried_size = [], 0
+            current, size = carried, carried_size
+        current.append(ids)
+        size += len(ids)
+    chunks.append(current)
+    return [list(chain.from_iterable(chunk)) for chunk in chunks]
+
+def _generate(loaded, id_lists, max_length, min_length):
+    """Run model.generate on a batch of id lists; returns the generated ids without special tokens."""
+    import torch
+    tokenizer, model = loaded.tokenizer, loaded.model
+    inputs = [tokenizer.build_inputs_with_special_tokens(ids) for ids in id_lists]
+    width = max(len(ids) for ids in inputs)
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    input_ids = torch.full((len(inputs), width), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(inputs), width), dtype=torch.long)
+    for i, ids in enumerate(inputs):
+        input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[i, :len(ids)] = 1
+    device = getattr(model, 'device', None)
+    if device is not None:
+        input_ids, attention_mask = input_ids.to(device), attention_mask.to(device)
+    out = model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                         max_length=max_length, min_length=min_length, do_sample=False)
+    special = set(tokenizer.all_special_ids)
+    return [[t for t in seq if t not in special] for seq in out.tolist()]
+
+def _summarize_batched(loaded, items, batch_size, max_length, min_length, retry_shorter=False):
+    """
+    Generate a summary (as token ids) for each id list in items, in input order.
+    Items are sorted by length first so each padded batch holds similar lengths.
+    retry_shorter: on failure, retry item by item with shorter generation parameters.
+    """
+    order = sorted(range(len(items)), key=lambda i: len(items[i]))
+    batch_size = max(1, int(batch_size))
+    result = [None] * len(items)
+    for start in range(0, len(order), batch_size):
+        idxs = order[start:start + batch_size]
         try:
-            s = summarizer(c, max_length=max_length, min_length=min_length, do_sample=False)
-            chunk_summaries.append(s[0]['summary_text'])
+            outs = _generate(loaded, [items[i] for i in idxs], max_length, min_length)
         except Exception:
-            # fallback: shorter generation parameters if a chunk still fails
-            s = summarizer(c, max_length=max(60, max_length//2), min_length=10, do_sample=False)
-            chunk_summaries.append(s[0]['summary_text'])
-
-    # if only one chunk summary, return it
-    if len(chunk_summaries) == 1:
-        return chunk_summaries[0]
-
-    # combine chunk summaries and do a final (short) summarization pass
-    combined = " ".join(chunk_summaries)
-    # if combined is still big, limit by tokenizing & trimming
-    combined_ids = tokenizer.encode(combined, add_special_tokens=False)
-    if len(combined_ids) > token_limit:
-        combined_ids = combined_ids[:token_limit - 2]
-        combined = tokenizer.decode(combined_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
-
-    final = summarizer(combined, max_length=max_length, min_length=min_length, do_sample=False)
-    return final[0]['summary_text']
+            if not retry_shorter:
+                raise
+            outs = []
+            for i in idxs:
+                try:
+                    outs.extend(_generate(loaded, [items[i]], max_length, min_length))
+                except Exception:
+                    # fallback: shorter generation parameters if a chunk still fails
+                    outs.extend(_generate(loaded, [items[i]], max(60, max_length//2), 10))
+        for i, ids in zip(idxs, outs):
+            result[i] = ids
+    return result
+
+def transformer_summarize_many(texts, model_name=DEFAULT_MODEL, max_length=130, min_length=30,
+                               chunk_overlap_tokens=128, device=-1, dtype=None, batch_size=8, backend='pytorch'):
+    """
+    Batched version of transformer_summarize for many texts.
+    - Collects the chunks (token ids, see _chunk_ids) of all texts, sorts them by
+      length to minimize padding and runs them through model.generate in batches
+      of batch_size.
+    - Texts that needed several chunks get a final combine pass, also batched,
+      unless their chunk summaries together already fit in max_length tokens.
+    - Returns one summary per input text, in order ("" for empty texts).
+    """
+    texts = list(texts)
+    results = [""] * len(texts)
+    if not any(texts):
+        return results
+
+    loaded = get_model(model_name, device=device, dtype=dtype, backend=backend)
+    tokenizer = loaded.tokenizer
+    budget = _token_limit(tokenizer) - tokenizer.num_special_tokens_to_add(pair=False)
+
+    # first pass: every chunk of every text
+    owners = []
+    chunk_items = []
+    for idx, text in enumerate(texts):
+        if not text:
+            continue
+        for ids in _chunk_ids(tokenizer, text, budget, chunk_overlap_tokens):
+            owners.append(idx)
+            chunk_items.append(ids)
+    chunk_summaries = _summarize_batched(loaded, chunk_items, batch_size, max_length, min_length,
+                                         retry_shorter=True)
+
+    per_text = defaultdict(list)
+    for idx, summary in zip(owners, chunk_summaries):
+        per_text[idx].append(summary)
+
+    decode = lambda ids: tokenizer.decode(ids, skip_special_tokens=True, clean_up_tokenization_spaces=True).strip()
+    # second pass: combine chunk summaries for texts that were split
+    combine_idx = []
+    combine_items = []
+    for idx, summaries in per_text.items():
+        if len(summaries) == 1:
+            results[idx] = decode(summaries[0])
+            continue
+        combined = " ".join(decode(ids) for ids in summaries)
+        if sum(len(ids) for ids in summaries) <= max_length:
+            # already as short as a combined summary would be: skip the extra generate
+            results[idx] = combined
+            continue
+        combine_idx.append(idx)
+        combine_items.append(tokenizer(combined, add_special_tokens=False)['input_ids'][:budget])
+    if combine_items:
+        for idx, summary in zip(combine_idx, _summarize_batched(loaded, combine_items, batch_size,
+                                                                max_length, min_length)):
+            results[idx] = decode(summary)
+    return results
+
+def transformer_summarize(text, model_name=DEFAULT_MODEL,
+                          max_length=130, min_length=30, chunk_overlap_tokens=128, device=-1, dtype=None,
+                          backend='pytorch'):
+    """
+    Token-aware chunking for transformer summarization.
+    - Splits by tokenizer tokens (not characters).
+    - Summarizes each chunk and then (optionally) summarizes the concatenated chunk summaries.
+    - device: -1 -> CPU, otherwise cuda device id (0,1,...)
+    - backend: 'pytorch', 'int8' or 'onnx' (see BACKENDS; the last two are CPU only)
+    - The model is loaded once per (model_name, device, dtype, backend) and reused (see get_model).
+    """
+    if not text:
+        return ""
+    return transformer_summarize_many([text], model_name=model_name, max_length=max_length,
+                                      min_length=min_length, chunk_overlap_tokens=chunk_overlap_tokens,
+                                      device=device, dtype=dtype, batch_size=1, backend=backend)[0]
@@ -0,0 +1,164 @@
+# summary_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join('.cache', 'summaries.sqlite3')
+DEFAULT_MAX_ENTRIES = 20000
+# hits only note their new last_used; it is written with the next put (or after this many hits)
+TOUCH_FLUSH_EVERY = 256
+# parameters that change the output of each summarizer mode
+MODE_PARAMS = {
+    'extractive': ('max_sentences',),
+    'tfidf': ('max_sentences',),
+    'textrank': ('max_sentences',),
+    'transformer': ('model_name', 'max_length', 'min_length', 'chunk_overlap_tokens', 'backend'),
+}
+
+
+def summary_params(mode, **params):
+    """
+    Keep only the parameters that affect mode's output, so e.g. an extractive
+    summary cached by summarizer.py is reused by the reply_by_* scripts and the
+    GUI regardless of their transformer settings.
+    """
+    keep = MODE_PARAMS.get(mode)
+    if keep is None:
+        return dict(params)
+    return {k: params.get(k) for k in keep}
+
+
+class SummaryCache:
+    """
+    Local on-disk cache of generated summaries (SQLite).
+    Summaries are deterministic (extractive, or transformer with do_sample=False),
+    so they are keyed by a hash of the extracted text plus every summarizer
+    parameter that affects the output. Least recently used entries are evicted
+    once more than max_entries are stored.
+    - Reads never commit: hits refresh last_used in memory and the refresh goes
+      out with the next write, so processes sharing the file rarely wait on
+      each other's locks.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " key TEXT PRIMARY KEY, summary TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text, mode, params):
+        """Hash of (text, mode, params); params is a dict of summarizer settings."""
+        h = hashlib.sha256()
+        h.update(json.dumps([mode, sorted(params.items())], default=str).encode('utf-8'))
+        h.update(b'\0')
+        h.update((text or '').encode('utf-8', errors='replace'))
+        return h.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_FLUSH_EVERY:
+                self._flush_touched()
+                self._conn.commit()
+            return row[0]
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE summaries SET last_used = ? WHERE key = ?",
+                                   [(t, k) for k, t in self._touched.items()])
+            self._touched = {}
+
+    def put(self, key, summary):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, last_used) VALUES (?, ?, ?)",
+                (key, summary, time.time())
+            )
+            self._flush_touched()
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM summaries WHERE key IN "
+                "(SELECT key FROM summaries ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+
+    def summarize(self, text, mode, params, summarize_fn):
+        """Return the cached summary for text, or compute it with summarize_fn(text) and store it."""
+        return self.summarize_many([text], mode, params, lambda texts: [summarize_fn(t) for t in texts])[0]
+
+    def summarize_many(self, texts, mode, params, summarize_many_fn):
+        """
+        Cached version of a batch summarizer.
+        summarize_many_fn(list_of_texts) -> list_of_summaries is only called with the misses.
+        """
+        lookup = self.lookup_many(texts, mode, params)
+        if not lookup[2]:
+            return lookup[1]
+        return self.fill_many(lookup, summarize_many_fn([texts[i] for i in lookup[2].values()]))
+
+    def lookup_many(self, texts, mode, params):
+        """
+        First half of summarize_many, for callers computing the misses elsewhere
+        (e.g. on a process pool). Returns (keys, results, missing):
+        - results: cached summary per text, None for misses.
+        - missing: each distinct missed key -> index of its first text, so a
+          text repeated within the batch is only computed once.
+        """
+        keys = [self.make_key(t, mode, params) for t in texts]
+        results = [self.get(k) for k in keys]
+        missing = {}
+        for i, r in enumerate(results):
+            if r is None:
+                missing.setdefault(keys[i], i)
+        return keys, results, missing
+
+    def fill_many(self, lookup, computed):
+        """Second half: store computed (one summary per missing key, in order) and return all summaries."""
+        keys, results, missing = lookup
+        for key, summary in zip(missing, computed):
+            self.put(key, summary)
+        by_key = dict(zip(missing, computed))
+        return [by_key[k] if r is None else r for k, r in zip(keys, results)]
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def clear(self):
+        with self._lock:
+            self._touched = {}
+            self._conn.execute("DELETE FROM summaries")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
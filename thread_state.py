@@ -0,0 +1,120 @@
+# thread_state.py
+import os
+import sqlite3
+import threading
+import time
+from googleapiclient.errors import HttpError
+from gmail_utils import execute, iter_history
+
+DEFAULT_THREAD_CACHE_PATH = os.path.join('.cache', 'threads.sqlite3')
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+
+class ThreadStateCache:
+    """
+    Persistent cache of "does this thread contain a SENT message" (SQLite),
+    keyed by threadId and the thread's historyId.
+    refresh() replays users().history().list since the last checkpoint and drops
+    the entries of every thread that changed, so a cached answer is reused
+    until its thread changes (e.g. the user replies from another client).
+    Callers that know a newer historyId of the thread (from one of its
+    messages) pass it to get(), which catches stale entries even without a
+    history replay.
+    """
+
+    def __init__(self, path=DEFAULT_THREAD_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            " thread_id TEXT PRIMARY KEY, history_id TEXT, replied INTEGER NOT NULL, checked_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def get(self, thread_id, history_id=None):
+        """
+        Return the cached replied flag, or None on a miss. history_id: a
+        historyId seen for the thread (e.g. of one of its messages); an entry
+        recorded at an older historyId predates that change and counts as a miss.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT history_id, replied FROM threads WHERE thread_id = ?",
+                                     (thread_id,)).fetchone()
+        stale = history_id is not None and row is not None and row[0] is not None and int(row[0]) < int(history_id)
+        if row is None or stale:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bool(row[1])
+
+    def put(self, thread_id, replied, history_id=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, history_id, replied, checked_at) VALUES (?, ?, ?, ?)",
+                (thread_id, None if history_id is None else str(history_id), int(bool(replied)), time.time())
+            )
+            self._conn.commit()
+
+    def invalidate(self, thread_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM threads WHERE thread_id = ?", [(t,) for t in thread_ids])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM threads")
+            self._conn.commit()
+
+    def refresh(self, service):
+        """
+        Drop entries for threads changed since the last refresh (one paged
+        history().list call) and move the checkpoint forward. The first call,
+        or an expired checkpoint, clears the cache. Returns the number of
+        threads invalidated.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = 'history_id'").fetchone()
+        checkpoint = row[0] if row else None
+        if checkpoint is None:
+            self.clear()
+            self._set_checkpoint(execute(service, service.users().getProfile(userId='me'), 'getProfile')['historyId'])
+            return 0
+        changed = set()
+        latest = int(checkpoint)
+        try:
+            for record in iter_history(service, checkpoint, history_types=HISTORY_TYPES):
+                latest = max(latest, int(record.get('id', 0)))
+                for m in record.get('messages', []):
+                    if m.get('threadId'):
+                        changed.add(m['threadId'])
+        except HttpError as e:
+            if getattr(e.resp, 'status', None) != 404:
+                raise
+            # checkpoint too old to replay: start over
+            self.clear()
+            self._set_checkpoint(execute(service, service.users().getProfile(userId='me'), 'getProfile')['historyId'])
+            return 0
+        self.invalidate(changed)
+        self._set_checkpoint(latest)
+        return len(changed)
+
+    def _set_checkpoint(self, history_id):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('history_id', ?)",
+                               (str(history_id),))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
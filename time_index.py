@@ -0,0 +1,76 @@
+# time_index.py
+import bisect
+import re
+from gmail_utils import iter_message_ids, get_messages
+
+# slack added around the Gmail after:/before: window (Gmail's bounds are in whole seconds)
+QUERY_MARGIN_MS = 60 * 1000
+
+
+class InternalDateIndex:
+    """
+    Sorted index of (internalDate ms, message id) pairs answering
+    range queries by binary search.
+    """
+
+    def __init__(self, pairs=()):
+        pairs = sorted((int(ms), mid) for mid, ms in pairs)
+        self._dates = [ms for ms, _ in pairs]
+        self._ids = [mid for _, mid in pairs]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, msg_id, internal_ms):
+        pos = bisect.bisect_right(self._dates, int(internal_ms))
+        self._dates.insert(pos, int(internal_ms))
+        self._ids.insert(pos, msg_id)
+
+    def range(self, start_ms, end_ms):
+        """Return [(id, internalDate)] with start_ms <= internalDate <= end_ms, oldest first."""
+        lo = bisect.bisect_left(self._dates, start_ms)
+        hi = bisect.bisect_right(self._dates, end_ms)
+        return list(zip(self._ids[lo:hi], self._dates[lo:hi]))
+
+    def around(self, target_ms, tol_ms):
+        """Return [(id, internalDate)] within tol_ms of target_ms."""
+        return self.range(target_ms - tol_ms, target_ms + tol_ms)
+
+    @classmethod
+    def build(cls, service, query=None, max_results=500, mirror=None):
+        """
+        Build an index from the messages matching query, downloading only
+        ids + internalDate (format='minimal'), or reading them from the mirror.
+        """
+        ids = list(iter_message_ids(service, query=query, limit=max_results, mirror=mirror))
+        # the mirror only holds full-format messages; reading those is local anyway
+        fmt = 'full' if mirror is not None else 'minimal'
+        msgs = get_messages(service, ids, format=fmt, mirror=mirror)
+        return cls((m['id'], m.get('internalDate', '0')) for m in msgs if m is not None)
+
+
+def narrow_query(target_ms, tol_ms, query=None, margin_ms=QUERY_MARGIN_MS):
+    """
+    Add after:/before: bounds (epoch seconds) around target_ms +- tol_ms to query,
+    so Gmail only lists messages that can possibly match.
+    """
+    start_s = max(0, (target_ms - tol_ms - margin_ms) // 1000)
+    end_s = (target_ms + tol_ms + margin_ms) // 1000 + 1
+    window = f"after:{start_s} before:{end_s}"
+    query = re.sub(r'\s+', ' ', query or '').strip()
+    return f"{query} {window}" if query else window
+
+
+def find_by_internal_date(service, target_ms, tol_ms=300000, query=None, max_results=500, mirror=None):
+    """
+    Return [(message, internalDate)] for messages whose internalDate is within
+    tol_ms of target_ms. Candidates are indexed from minimal-format fetches;
+    only the matches are downloaded in full.
+    """
+    index = InternalDateIndex.build(service, query=narrow_query(target_ms, tol_ms, query),
+                                    max_results=max_results, mirror=mirror)
+    hits = index.around(target_ms, tol_ms)
+    if not hits:
+        return []
+    msgs = get_messages(service, [mid for mid, _ in hits], mirror=mirror)
+    return [(m, internal) for m, (_, internal) in zip(msgs, hits) if m is not None]